@@ -1,33 +1,21 @@
 
-from base_simulation import BaseSimbox, BaseCircle, BaseRenderer
-from renderers import SimDisplayer, SimExporter
+from circle_simulation.base_simulation import BaseSimbox, BaseCircle, BaseRenderer
+from circle_simulation.renderers import SimDisplayer, SimExporter
 # Newtons Cradle
 def newtons_cradle():
     import numpy as np
-    class ColorCircle(BaseCircle):
-        def __init__(self, simbox=None, name='',radius=5, weight=1, damping=0,
-                 color=(156, 156, 156), angle=0, speed=0, vector=None, position=None):
-            super().__init__(simbox, name,radius, weight, damping,
-                 color, angle, speed, vector, position)
+    class CradleSim(BaseSimbox):
+        # recolors every circle touching something (another circle or the wall), all circles in one go
+        def post_contact(self, step):
+            touching = step.wall.copy()
+            touching[step.first] = True
+            touching[step.second] = True
+            step.colors[:] = np.where(touching[:, None], (255, 125, 180), (125, 180, 255))
 
-            self.initial_color = self.color
-        def update_movement_vector(self, my_neighbors):
-            super().update_movement_vector(my_neighbors)
-            if self.current_colliders:
-                self.color = (255, 125, 180)
-            else:
-                self.color = self.initial_color
-
-    c = [ColorCircle(radius=4, speed=2 if i == 0 else 0, position=None, angle=np.pi / 2, color=(125, 180, 255), damping=0) for i in range(7)]
     positions = np.array([[0., -90.], [0., -20.], [0., -10.], [0., 0.], [0., 10.], [0., 20.], [0., 90.]])
-
-    for i in range(len(c)):
-        c[i].position = positions[i]
-
-    sim = BaseSimbox(radius=100, boundary_color=(255, 255, 255), boundary_thickness=10, steps_per_frame=1,
-                     amount=0)
-    for i in c:
-        sim.add_circle(i)
+    sim = CradleSim(radius=100, boundary_color=(255, 255, 255), boundary_thickness=10, steps_per_frame=1,
+                    amount=7, positions=positions, sizes=[4] * 7, speeds=[2] + [0] * 6, angles=[np.pi / 2] * 7,
+                    vectors=None, weights=[1] * 7, damping=[0] * 7, colors=[(125, 180, 255)] * 7)
 
     #SimDisplayer(sim).run_live_sim()
     SimExporter("newtons_cradle", sim, seconds_to_run=15).run_sim()
@@ -36,7 +24,7 @@ def newtons_cradle():
 def inherit_renderer():
     from PIL import Image, ImageDraw, ImageFont
     import random
-    from extras import random_vectors_in_circle
+    from circle_simulation.extras import random_vectors_in_circle
     class InfoDisplayer(SimDisplayer):
         def render_frame(self) -> Image:
             img = super().render_frame()
@@ -88,25 +76,42 @@ def spiral_sim():
 
 # inheriting SimBox to add circles every time there is a collision, and randomly remove some circles on each frame
 def inherit_simbox():
-    import random
-    from extras import random_vectors_in_circle
-    class PopCornSim(BaseSimbox):
-        def simulate_frame(self):
-            super(PopCornSim, self).simulate_frame()
-            collisions_on_frame = sum([len(circle.current_colliders) for circle in self.circles])
-            positions = random_vectors_in_circle(amount=collisions_on_frame, radius=self.radius)
-            vector = random_vectors_in_circle(amount=collisions_on_frame, radius=2)
-            new_circles = [BaseCircle(radius=3,vector=vector[i], position=positions[i], color=(min(3 * len(self.circles), 255),min(12 * len(self.circles), 255),100)) for i in range(collisions_on_frame)]
-            for i in new_circles:
-                self.add_circle(i)
-            for i in range(len(self.circles) // 12):
-                self.circles.pop(random.randint(0, len(self.circles) - 1))
+    import numpy as np
+    from circle_simulation.vector_simulation import VectorSimbox
+    from circle_simulation.extras import uniform_in_disk
+    rng = np.random.default_rng()
+    class PopCornSim(VectorSimbox):
+        # one sub-step per frame, so this runs once per frame
+        def post_step(self, step):
+            # as many circles as there were colliders (both circles of a pair, and the wall) pop up
+            collisions_on_frame = 2 * len(step.first) + int(step.wall.sum())
+            amount = len(self.circles)
+            self.add_circles(uniform_in_disk(collisions_on_frame, self.radius, rng), 3,
+                             vectors=uniform_in_disk(collisions_on_frame, 2, rng),
+                             colors=(min(3 * amount, 255), min(12 * amount, 255), 100))
+            # removes a twelfth of the circles in one go (by id, no shifting the rest of the circles around)
+            self.remove_circles(rng.choice(self.get_ids(), len(self.circles) // 12, replace=False))
     sim = PopCornSim(radius=100, boundary_color=(10, 255, 25), boundary_thickness=10, steps_per_frame=1,
-                    amount=0, positions=None, sizes=None, angles=None, speeds=None, vectors=None, weights=None,
-                    damping=None, colors=None)
-    for i in range(10):
-        sim.add_circle(BaseCircle(radius=3, vector=random_vectors_in_circle(1, 2)[0], position=random_vectors_in_circle(1, sim.radius)[0]))
+                     amount=0, positions=None, sizes=None, angles=None, speeds=None, vectors=None, weights=None,
+                     damping=None, colors=None)
+    sim.add_circles(uniform_in_disk(10, sim.radius, rng), 3, vectors=uniform_in_disk(10, 2, rng))
     SimDisplayer(simbox=sim).run_live_sim()
 
+# a disk of circles pulling on each other, orbiting a heavy attractor in the middle
+def gravity_sim():
+    import numpy as np
+    from circle_simulation.vector_simulation import VectorSimbox
+    from circle_simulation.forces import Gravity, Attractor
+    from circle_simulation.extras import uniform_in_disk
+    amount = 2000
+    positions = uniform_in_disk(amount, 80, seed=0)
+    # circular orbits around the center: speed sqrt(strength / distance), perpendicular to the position
+    distance = np.sqrt((positions ** 2).sum(axis=1)) + 1
+    vectors = np.stack((-positions[:, 1], positions[:, 0]), axis=1) * (np.sqrt(30 / distance) / distance)[:, None]
+    sim = VectorSimbox(radius=100, boundary_color=(255, 255, 255), boundary_thickness=5, steps_per_frame=2,
+                       forces=[Attractor((0, 0), strength=30, softening=5), Gravity(constant=0.002, softening=2)])
+    sim.add_circles(positions, 1, vectors=vectors, colors=(250, 200, 120))
+    SimDisplayer(simbox=sim, resolution=4, backend='sprite').run_live_sim()
+
 if __name__ == '__main__':
     spiral_sim()
@@ -1,8 +1,41 @@
+import os
 import numpy as np
-from PIL import Image, ImageDraw
+from circle_simulation.broad_phase import find_pairs, overlap_push
+
+CHECKPOINT_VERSION = 3
+# per-circle arrays of a checkpoint: array name, BaseCircle attribute and dtype
+CHECKPOINT_CIRCLE_ARRAYS = {'positions': ('position', np.float64), 'vectors': ('vector', np.float64),
+                            'radii': ('radius', np.float64), 'weights': ('weight', np.float64),
+                            'damping': ('damping', np.float64), 'colors': ('color', np.uint8),
+                            'collisions': ('number_of_collisions', np.int64),
+                            'distances': ('distance_traveled', np.float64), 'times': ('circle_time', np.float64),
+                            'ids': ('circle_id', np.int64), 'asleep': ('asleep', bool),
+                            'rest_steps': ('rest_steps', np.int64), 'islands': ('island', np.int64)}
+
+def _circle_arrays(positions, radii, vectors=None, angles=None, speeds=None, weights=1, damping=0,
+                   colors=(156, 156, 156)):
+    '''
+    turns the arguments of BaseSimbox.add_circles into one array per circle attribute (named like the arrays of
+    vector_simulation.CircleStore). everything but positions may be given once for all circles
+    :return: dict of arrays: positions, vectors, radii, weights, damping (as restitution, 1 - damping) and colors
+    '''
+    positions = np.array(positions, dtype=np.float64).reshape(-1, 2)
+    n = len(positions)
+    if vectors is None:
+        # same as BaseCircle: speed * [cos(angle), sin(angle)]
+        angles = np.broadcast_to(np.asarray(0. if angles is None else angles, dtype=np.float64), (n,))
+        speeds = np.broadcast_to(np.asarray(0. if speeds is None else speeds, dtype=np.float64), (n,))
+        vectors = speeds[:, None] * np.stack((np.cos(angles), np.sin(angles)), axis=1)
+    else:
+        vectors = np.broadcast_to(np.asarray(vectors, dtype=np.float64).reshape(-1, 2), (n, 2))
+    return {'positions': positions, 'vectors': vectors,
+            'radii': np.broadcast_to(np.asarray(radii, dtype=np.float64), (n,)),
+            'weights': np.broadcast_to(np.asarray(weights, dtype=np.float64), (n,)),
+            'damping': 1 - np.broadcast_to(np.asarray(damping, dtype=np.float64), (n,)),
+            'colors': np.broadcast_to(np.asarray(colors, dtype=np.uint8).reshape(-1, 3), (n, 3))}
 
 class BaseRenderer:
-    def __init__(self, simbox, resolution=3):
+    def __init__(self, simbox, resolution=3, backend='pil', lod=None, lod_size=1., zoom=1., view_center=(0, 0)):
         # Resolution is the factor by which the sizes and positions are multiplied
         # Example. simulation size = 10, resolution = 20. display size will be 10*20 = 200
         self.resolution = resolution
@@ -11,11 +44,38 @@ class BaseRenderer:
         # size of the screen in pixels. shape is square such that <width = height>
         self.size = int(self.resolution * self.simbox.radius * 2)
 
-    def render_frame(self) -> Image:
+        # how circles are drawn: 'pil' (ImageDraw.ellipse per circle, through _get_circle_bbox and _draw_circle) or
+        # 'sprite' (all bounding boxes at once, circles stamped from cached sprites. see rasterizer.py)
+        if backend not in ('pil', 'sprite'):
+            raise ValueError(f"unknown backend {backend!r}, pick 'pil' or 'sprite'")
+        self.backend = backend
+        self._rasterizer = None
+        # boundary drawn once for the sprite backend (per channel order), with the settings it was drawn for
+        self._backgrounds = {}
+        self._background_key = None
+
+        # level of detail: circles less than lod_size pixels across are drawn as 'points' (one pixel each, in their
+        # color) or as a 'density' image (mean color of the circles in each pixel, brighter where there are more of
+        # them), instead of one ellipse each. None draws every circle as a circle (see rasterizer.splat_points)
+        if lod not in (None, 'points', 'density'):
+            raise ValueError(f"unknown level of detail {lod!r}, pick None, 'points' or 'density'")
+        self.lod = lod
+        self.lod_size = lod_size
+        # viewport: the frame shows the simbox magnified "zoom" times around view_center (in simbox coordinates).
+        # circles outside of it are dropped before drawing
+        self.zoom = zoom
+        self.view_center = view_center
+
+    def render_frame(self) -> 'Image':
         '''
         Responsible for drawing the circles onto the screen in their correct position and size
         :return: PIl.Image
         '''
+        # PIL is only loaded once something gets rendered. simulating alone needs nothing but numpy
+        from PIL import Image, ImageDraw
+        if self.backend == 'sprite':
+            return Image.fromarray(self.render_array())
+
         # Initialize image
         img = Image.new('RGB', size=(self.size, self.size))
         # Initialize Draw object
@@ -24,6 +84,20 @@ class BaseRenderer:
         # draw Simbox Boundaries
         self._draw_boundary(draw)
 
+        if self.lod is not None or self._zoomed():
+            # only the circles in view, sub-pixel ones splatted afterwards
+            circles = self.simbox.circles
+            left, top, right, bottom = self._get_circle_bboxes()
+            rows, splats = self._split_circles(left, top, right, bottom)
+            for i, l, t, r, b in zip(rows.tolist(), left[rows].tolist(), top[rows].tolist(), right[rows].tolist(),
+                                     bottom[rows].tolist()):
+                self._draw_circle(l, t, r, b, circles[i], draw)
+            if splats is None:
+                return img
+            frame = np.array(img)
+            self._splat(frame, *splats, self.simbox.get_colors())
+            return Image.fromarray(frame)
+
         # For each circle in the simulation
         sim_center = self.simbox.radius * self.resolution
         for c in self.simbox.circles:
@@ -33,9 +107,112 @@ class BaseRenderer:
             self._draw_circle(left, top, right, bottom, c, draw)
         return img
 
+    def render_array(self, channels='RGB'):
+        '''
+        same as render_frame, as a numpy array
+        :param channels: 'RGB', or 'BGR' (what OpenCV expects) to get a frame that can be handed to cv2 as is
+        :return: (size, size, 3) uint8 array. with the 'sprite' backend, it is the frame buffer of the rasterizer,
+                 which the next frame overwrites (copy it to keep it)
+        '''
+        if channels not in ('RGB', 'BGR'):
+            raise ValueError(f"unknown channel order {channels!r}, pick 'RGB' or 'BGR'")
+        if self.backend != 'sprite':
+            frame = np.asarray(self.render_frame())
+            return frame if channels == 'RGB' else np.ascontiguousarray(frame[..., ::-1])
+
+        from circle_simulation.rasterizer import SpriteRasterizer
+        if self._rasterizer is None or self._rasterizer.size != self.size:
+            self._rasterizer = SpriteRasterizer(self.size)
+        left, top, right, bottom = self._get_circle_bboxes()
+        colors = self.simbox.get_colors()
+        if channels == 'BGR':
+            colors = colors[:, ::-1]
+        if self.lod is None and not self._zoomed():
+            return self._rasterizer.render(left, top, right, bottom, colors, self._get_background(channels))
+
+        rows, splats = self._split_circles(left, top, right, bottom)
+        frame = self._rasterizer.render(left[rows], top[rows], right[rows], bottom[rows], colors[rows],
+                                        self._get_background(channels))
+        if splats is not None:
+            self._splat(frame, *splats, colors)
+        return frame
+
+    def _zoomed(self):
+        return self.zoom != 1 or tuple(self.view_center) != (0, 0)
+
+    def _split_circles(self, left, top, right, bottom):
+        '''
+        culls the circles outside of the frame, and picks the ones drawn by the level of detail mode
+        (arrays of _get_circle_bboxes)
+        :return: rows of the circles to draw as circles, and rows, pixel columns and pixel rows of the centers of the
+                 circles to splat (None without lod)
+        '''
+        size = self.size
+        visible = (right >= 0) & (left < size) & (bottom >= 0) & (top < size)
+        if self.lod is None:
+            return np.nonzero(visible)[0], None
+        small = right - left < self.lod_size
+        x = np.floor((left + right) / 2).astype(np.intp)
+        y = np.floor((top + bottom) / 2).astype(np.intp)
+        splatted = small & (x >= 0) & (x < size) & (y >= 0) & (y < size)
+        rows = np.nonzero(splatted)[0]
+        return np.nonzero(visible & ~small)[0], (rows, x[rows], y[rows])
+
+    def _splat(self, frame, rows, x, y, colors):
+        from circle_simulation.rasterizer import splat_points, splat_density
+        splat = splat_points if self.lod == 'points' else splat_density
+        splat(frame, x, y, colors[rows])
+
+    def _renders_arrays(self):
+        # frames can be taken straight from the rasterizer's buffer, unless a subclass changes what render_frame draws
+        return self.backend == 'sprite' and type(self).render_frame is BaseRenderer.render_frame
+
+    def _get_background(self, channels='RGB'):
+        # the boundary only changes if the simbox settings do, draw it once
+        key = (self.size, tuple(self.simbox.color), self.simbox.thickness, self.zoom, tuple(self.view_center))
+        if key != self._background_key:
+            from PIL import Image, ImageDraw
+            img = Image.new('RGB', size=(self.size, self.size))
+            self._draw_boundary(ImageDraw.Draw(img))
+            background = np.asarray(img).copy()
+            self._backgrounds = {'RGB': background, 'BGR': np.ascontiguousarray(background[..., ::-1])}
+            self._background_key = key
+        return self._backgrounds[channels]
+
+    def _get_circle_bboxes(self):
+        '''
+        vectorized version of _get_circle_bbox, for all circles at once
+        :return: arrays left, top, right, bottom of the bounding boxes of every circle, in pixels
+        '''
+        sim_center = self.simbox.radius * self.resolution
+        positions, radii = self.simbox.get_positions(), self.simbox.get_radii()
+        # pixels per unit, and the point of the simbox in the middle of the frame (see the viewport in __init__)
+        scale = self.resolution * self.zoom
+        x, y = self.view_center
+        left = sim_center + (positions[:, 0] - x - radii) * scale
+        top = sim_center - (positions[:, 1] - y + radii) * scale
+        right = left + 2 * radii * scale
+        bottom = top + 2 * radii * scale
+        return left, top, right, bottom
+
+    def _mark(self, phase):
+        # ends a phase of the current frame in the simbox's profiler, if it has one (see profiling.py)
+        profiler = getattr(self.simbox, 'profiler', None)
+        if profiler is not None:
+            profiler.mark(phase)
+
     def _draw_boundary(self, draw):
         # draw Simbox Boundaries
-        draw.ellipse([0, 0, self.size, self.size], outline=self.simbox.color, width=self.simbox.thickness)
+        if not self._zoomed():
+            draw.ellipse([0, 0, self.size, self.size], outline=self.simbox.color, width=self.simbox.thickness)
+            return
+        sim_center = self.simbox.radius * self.resolution
+        scale = self.resolution * self.zoom
+        x, y = self.view_center
+        left = sim_center - (x + self.simbox.radius) * scale
+        top = sim_center + (y - self.simbox.radius) * scale
+        box = [left, top, left + 2 * self.simbox.radius * scale, top + 2 * self.simbox.radius * scale]
+        draw.ellipse(box, outline=self.simbox.color, width=self.simbox.thickness)
 
     def _get_circle_bbox(self, c, sim_center):
         '''
@@ -78,7 +255,9 @@ class BaseRenderer:
 class BaseSimbox:
     def __init__(self, radius, boundary_color, boundary_thickness, steps_per_frame,
                  amount=0, positions=None, sizes=None, angles=None, speeds=None, vectors=None,
-                 weights=None, damping=None, colors=None):
+                 weights=None, damping=None, colors=None, grid_size=None, broad_phase='auto',
+                 collision_mode='discrete', adaptive_steps=False, min_steps=1, max_steps=64, max_travel=0.5,
+                 forces=None, sleep_speed=None, sleep_steps=30):
 
         self.color = boundary_color
         self.thickness = boundary_thickness
@@ -93,14 +272,70 @@ class BaseSimbox:
         # position set to center. useful for conforming to the way collision is handled in BaseCircle class
         self.position = np.array([0, 0], dtype=np.float64)
 
-        # STILL UNIMPLEMENTED. a grid of which circles are near each other to even be checked for collision.
-        self.grid_size = 1
+        # how possible colliders are found: 'brute' (every circle with every circle), 'grid' (uniform grid),
+        # 'sweep' (sweep and prune), 'tree' (KD-tree) or 'auto' to pick one on every sub-step according to the amount
+        # and sizes of the circles. (see broad_phase.py) All of them lead to exactly the same collisions
+        self.broad_phase = broad_phase
+        # name of the broad phase used on the last sub-step (info var, interesting with 'auto')
+        self.broad_phase_used = None
+
+        # size of the cells of the collision grid (broad_phase 'grid'). circles are only checked for collision with
+        # circles in the same or neighboring cells. None derives it from the largest circle (its diameter)
+        self.grid_size = grid_size
+        # possible colliders found on the last sub-step (see self._find_collisions and self.get_possible_colliders)
+        self._candidates = (np.zeros(0, dtype=np.intp), np.zeros(0, dtype=np.intp))
+        self._neighbor_index = {}
+        self._neighbor_offsets = None
+        self._neighbor_rows = None
+        self._near_wall = np.zeros(0, dtype=bool)
+        # contacts of the last sub-step: pairs of rows (first < second) and the mask of rows touching the wall
+        self._contacts = (np.zeros(0, dtype=np.intp), np.zeros(0, dtype=np.intp))
+        self._wall_contacts = np.zeros(0, dtype=bool)
 
         # movements and collision recalibrations per rendered frame
         self.steps_per_frame = steps_per_frame
 
+        # adaptive sub-stepping: steps_per_frame is picked again at the start of every frame, just high enough that no
+        # circle moves further than "max_travel" times the smallest radius (or the room left between the largest
+        # circle and the wall, if smaller) within one sub-step. bounded by min_steps and max_steps
+        self.adaptive_steps = adaptive_steps
+        self.min_steps = min_steps
+        self.max_steps = max_steps
+        self.max_travel = max_travel
+        # steps_per_frame used on every frame simulated with adaptive_steps (info var)
+        self.step_counts = []
+
+        # 'discrete': circles move a full sub-step, then whoever overlaps collides (fast circles can pass through each
+        # other unless steps_per_frame is high). 'continuous': every collision is resolved at the exact moment it
+        # happens within the sub-step, so steps_per_frame=1 is enough at any speed (see continuous.py)
+        if collision_mode not in ('discrete', 'continuous'):
+            raise ValueError(f"unknown collision mode {collision_mode!r}, pick 'discrete' or 'continuous'")
+        self.collision_mode = collision_mode
+
         # keeps track of time (info var)
         self.current_frame = 0
+        # total amount of collisions between circles from inception till now, each colliding pair counted once (info var)
+        self.number_of_collisions = 0
+
+        # force fields (gravity between the circles, attractors, uniform gravity... see forces.py) accelerating every
+        # circle at the start of each sub-step. (for future safety, use self.add_force)
+        self.forces = list(forces) if forces else []
+
+        # sleeping: circles slower than sleep_speed for sleep_steps sub-steps in a row (and every circle they touch) stop
+        # and are left out of the sub-steps until an awake circle touches them. None never puts any circle to sleep.
+        # (see sleeping.py)
+        self.sleep_speed = sleep_speed
+        self.sleep_steps = sleep_steps
+        # mask of the awake circles on the current sub-step (None while no circle sleeps)
+        self._awake = None
+
+        # profiling.Profiler recording the time spent in each phase of every frame. None (the default) records nothing
+        self.profiler = None
+
+        # ids of the circles: every circle added gets one (circle.circle_id), which stays the same until the circle is
+        # removed. ids of removed circles are handed out again (last in, first out)
+        self._next_id = 0
+        self._free_ids = []
 
         self.init_circles(amount=amount, positions=positions,
                           sizes=sizes, angles=angles, speeds=speeds,  weights=weights,
@@ -122,21 +357,106 @@ class BaseSimbox:
                         (alternatively fulfilled when supplying angles, speeds params)
         :param weights: list of size "amount" populated by
                         weight (i.e. mass) of type floats specifying each circles weight.
+        (lists or numpy arrays. for large scenes, add_circles takes the arrays directly)
         :return: None
         '''
-        for i in range(amount):
-            try:
-                if not vectors:
-                    c = BaseCircle(simbox=self, name="c" + str(i), radius=sizes[i], angle=angles[i], speed=speeds[i],
-                                   weight=weights[i], damping=damping[i], color=colors[i])
-                else:
-                    c = BaseCircle(simbox=self, name="c" + str(i), radius=sizes[i], vector=vectors[i],
-                                   weight=weights[i], damping=damping[i], color=colors[i])
-                c.position = np.array(positions[i], dtype=np.float64)
-            except IndexError as e:
+        if not amount:
+            return
+
+        def first(values):
+            # the first "amount" entries of one of the arguments
+            if values is None or len(values) < amount:
                 print("All arguments must be iterables of len >= amount")
-                raise e
-            self.circles.append(c)
+                raise IndexError("All arguments must be iterables of len >= amount")
+            return values[:amount]
+
+        if vectors is None or not len(vectors):
+            self.add_circles(first(positions), first(sizes), angles=first(angles), speeds=first(speeds),
+                             weights=first(weights), damping=first(damping), colors=first(colors))
+        else:
+            self.add_circles(first(positions), first(sizes), vectors=first(vectors), weights=first(weights),
+                             damping=first(damping), colors=first(colors))
+
+    def add_circles(self, positions, radii, vectors=None, angles=None, speeds=None, weights=1, damping=0,
+                    colors=(156, 156, 156)):
+        '''
+        adds many circles at once. every argument takes an array (or list) with one entry per circle, everything but
+        positions can also be given once for all of them. circles are named "c" + their index in self.circles.
+        (see extras.py for generators of positions and vectors)
+        :param positions: (n, 2) array of positions
+        :param radii: (n,) array of radii
+        :param vectors: (n, 2) array of movement vectors (alternatively given by angles and speeds)
+        :param angles: (n,) array of directions the circles travel in initially
+        :param speeds: (n,) array of initial speeds
+        :param weights: (n,) array of weights
+        :param damping: (n,) array of damping co-efficients (like BaseCircle's damping param)
+        :param colors: (n, 3) array of colors
+        :return: array of the ids of the new circles
+        '''
+        arrays = _circle_arrays(positions, radii, vectors, angles, speeds, weights, damping, colors)
+        ids = self._new_circle_ids(len(arrays['positions']))
+        start = len(self.circles)
+        # python numbers, like circles built one at a time
+        radii, weights = arrays['radii'].tolist(), arrays['weights'].tolist()
+        restitution, colors = arrays['damping'].tolist(), arrays['colors'].tolist()
+        for i, (position, vector) in enumerate(zip(arrays['positions'], arrays['vectors'])):
+            circle = BaseCircle(simbox=self, name="c" + str(start + i), radius=radii[i], vector=vector,
+                                weight=weights[i], color=tuple(colors[i]), position=position)
+            circle.damping = restitution[i]
+            circle.circle_id = ids[i]
+            self.circles.append(circle)
+        return np.array(ids, dtype=np.int64)
+
+    def remove_circles(self, circle_ids):
+        '''
+        removes many circles at once. the last circles of self.circles are moved into the gaps (swap-remove) instead of
+        shifting everything after each removed circle, so the order of the circles changes.
+        (self.circles.pop(i) keeps the order, but moves every circle after i. on a BaseSimbox, the id of a circle
+        removed that way isn't handed out again)
+        :param circle_ids: ids of the circles to remove (see add_circle, add_circles and get_ids)
+        :return: None
+        '''
+        remove = set(np.asarray(circle_ids, dtype=np.int64).reshape(-1).tolist())
+        if remove and min(remove) < 0:
+            raise KeyError(f"no circle with id {min(remove)} in the simbox")
+        rows = [i for i, circle in enumerate(self.circles) if circle.circle_id in remove]
+        if len(rows) != len(remove):
+            missing = remove - {self.circles[i].circle_id for i in rows}
+            raise KeyError(f"no circle with id {min(missing)} in the simbox")
+        # ids are freed in the order of the circles, like VectorSimbox does
+        self._free_ids.extend(self.circles[i].circle_id for i in rows)
+        # from the back, so the last circle is never one that's about to be removed
+        for i in reversed(rows):
+            circle = self.circles[i]
+            last = self.circles.pop()
+            if i < len(self.circles):
+                self.circles[i] = last
+            circle.circle_id = -1
+
+    def get_circle(self, circle_id):
+        '''
+        :param circle_id: id of a circle in the simbox
+        :return: the circle
+        '''
+        for circle in self.circles:
+            if circle.circle_id == circle_id:
+                return circle
+        raise KeyError(f"no circle with id {circle_id} in the simbox")
+
+    def get_ids(self):
+        '''
+        :return: (n,) array of the ids of all circles, in the order of self.circles
+        '''
+        return np.array([circle.circle_id for circle in self.circles], dtype=np.int64)
+
+    def _new_circle_ids(self, amount):
+        # ids for new circles, reusing the ones of removed circles first
+        reused = min(amount, len(self._free_ids))
+        ids = self._free_ids[len(self._free_ids) - reused:][::-1]
+        del self._free_ids[len(self._free_ids) - reused:]
+        ids += range(self._next_id, self._next_id + amount - reused)
+        self._next_id += amount - reused
+        return ids
 
     def simulate_frame(self):
         '''
@@ -144,45 +464,628 @@ class BaseSimbox:
         (runs a full frame, potentially containing multiple sub-steps)
         :return:
         '''
+        profiler = self.profiler
+        if profiler is not None:
+            profiler.begin_frame(self.current_frame)
+        self._update_steps_per_frame()
+        if profiler is not None and self.adaptive_steps:
+            profiler.mark('adaptive_steps')
         for i in range(self.steps_per_frame):
             self.current_frame += 1
+            if self._overrides('pre_step'):
+                self._run_hook(self.pre_step, contacts=False)
+            if self.forces:
+                self._apply_forces()
+                if profiler is not None:
+                    profiler.mark('forces')
+            if self.collision_mode == 'continuous':
+                self._simulate_step_continuous()
+                if profiler is not None:
+                    profiler.mark('continuous_step')
+                self._run_step_hooks()
+                continue
+
+            # find every colliding pair of circles once (and every circle touching the wall)
+            pairs, colliders = self._find_collisions()
+            self.number_of_collisions += len(pairs)
+            if self._overrides('post_contact'):
+                self._run_hook(self.post_contact)
+            circles = self.circles
+            if self._awake is not None:
+                # sleeping circles sit the sub-step out
+                awake = self._awake.tolist()
+                for circle, is_awake in zip(circles, awake):
+                    if not is_awake:
+                        circle.circle_time += 1 / self.steps_per_frame
+                circles = [circle for circle, is_awake in zip(circles, awake) if is_awake]
+                colliders = [neighbors for neighbors, is_awake in zip(colliders, awake) if is_awake]
 
-            # take care of collisions
-            for circle in self.circles:
-                neighbors = self.get_possible_colliders(circle)
+            # start from the current state. collisions are added onto the temporary vectors
+            for circle in circles:
+                circle.temp_vector = circle.vector.copy()
+                circle.temp_position = circle.position.copy()
+
+            # momentum exchange, once per colliding pair (updates both circles)
+            for circle, collider in pairs:
+                circle._handle_collision(collider)
+            if profiler is not None:
+                profiler.mark('handle_collision')
+
+            # take care of the rest of the collisions (energy loss, bouncing off the wall)
+            for circle, neighbors in zip(circles, colliders):
                 circle.update_movement_vector(my_neighbors=neighbors)
+            if profiler is not None:
+                profiler.mark('update_movement_vector')
 
             # move circles according to their (updated) movement vectors
-            for circle in self.circles:
+            for circle in circles:
                 circle.update_position()
+            if profiler is not None:
+                profiler.mark('update_position')
+
+            # ensures no circle overlaps with another circle. (every overlap is measured before anyone is pushed)
+            pushes = [circle._clean_collision(collider) for circle, collider in pairs]
+            for (circle, collider), push in zip(pairs, pushes):
+                circle.position -= push
+                collider.position += push
+
+            # ensures no circle escapes boundary
+            for circle, neighbors in zip(circles, colliders):
+                if neighbors and neighbors[-1] is self:
+                    circle._clean_simbox_collision()
+            if profiler is not None:
+                profiler.mark('clean_collisions')
+
+            if self.sleep_speed is not None:
+                self._settle()
+                if profiler is not None:
+                    profiler.mark('sleeping')
+            if self._overrides('post_step'):
+                self._run_hook(self.post_step)
+
+    def pre_step(self, step):
+        '''
+        batched hook, called at the start of every sub-step (before forces and collisions). override it to work on all
+        circles at once instead of overriding methods of every circle
+        :param step: StepArrays of the sub-step (without contacts)
+        :return: None
+        '''
+
+    def post_contact(self, step):
+        '''
+        batched hook, called once the contacts of a sub-step are found, before they are resolved. (in the continuous
+        collision mode right after the sub-step, with every pair that collided during it)
+        :param step: StepArrays of the sub-step
+        :return: None
+        '''
+
+    def post_step(self, step):
+        '''
+        batched hook, called at the end of every sub-step. circles may be added and removed here
+        :param step: StepArrays of the sub-step (contacts of the sub-step)
+        :return: None
+        '''
+
+    def _overrides(self, hook):
+        # whether a subclass implements the batched hook "hook" (the arrays are only put together if so)
+        return getattr(type(self), hook) is not getattr(BaseSimbox, hook)
+
+    def _run_step_hooks(self):
+        # post_contact and post_step after a sub-step of the continuous collision mode
+        if self._overrides('post_contact'):
+            self._run_hook(self.post_contact)
+        if self._overrides('post_step'):
+            self._run_hook(self.post_step)
+
+    def _run_hook(self, hook, contacts=True):
+        '''
+        calls a batched hook with arrays gathered from the circles, then writes positions, vectors and colors back
+        :param hook: bound method (pre_step, post_contact or post_step)
+        :param contacts: whether to hand over the contacts of the sub-step (empty otherwise)
+        :return: None
+        '''
+        circles = list(self.circles)
+        if contacts:
+            (first, second), wall = self._contacts, self._wall_contacts
+        else:
+            first = second = np.zeros(0, dtype=np.intp)
+            wall = np.zeros(len(circles), dtype=bool)
+        step = StepArrays(self.get_positions(), self.get_vectors(), self.get_colors(), self.get_radii(), first, second,
+                          wall)
+        hook(step)
+        # (circles removed by the hook get written too, it doesn't matter for them)
+        for circle, position, vector, color in zip(circles, step.positions, step.vectors, step.colors.tolist()):
+            circle.position = position.copy()
+            circle.vector = vector.copy()
+            circle.color = tuple(color)
+        # the time of a hook is a phase of its own (pre_step, post_contact or post_step)
+        if self.profiler is not None:
+            self.profiler.mark(hook.__name__)
+
+    def add_force(self, force):
+        '''
+        :param force: force field acting on every circle from now on (see forces.py)
+        :return: None
+        '''
+        self.forces.append(force)
 
-            # ensures no circle escapes boundary or overlaps with another circle
-            for c in self.circles:
-                c._clean_collisions()
+    def _apply_forces(self):
+        '''
+        adds the accelerations of all force fields onto the movement vectors, for one sub-step
+        :return: None
+        '''
+        from circle_simulation.forces import accelerations
+        change = accelerations(self.forces, self.get_positions(), self.get_weights(), self.get_ids())
+        change /= self.steps_per_frame
+        for circle, delta in zip(self.circles, change):
+            # sleeping circles stay put
+            if not circle.asleep:
+                circle.vector = circle.vector + delta
+
+    def wake(self, circle_ids=None):
+        '''
+        wakes sleeping circles (and the rest of their islands), e.g. after moving them by hand
+        :param circle_ids: ids of the circles to wake (None wakes every circle)
+        :return: None
+        '''
+        islands = None if circle_ids is None else \
+            {self.get_circle(circle_id).island for circle_id in np.asarray(circle_ids).reshape(-1).tolist()}
+        for circle in self.circles:
+            if circle.asleep and (islands is None or circle.island in islands):
+                circle.asleep = False
+                circle.rest_steps = 0
+                circle.island = -1
+
+    def _sleep_state(self):
+        # arrays asleep, rest_steps and islands of all circles (see sleeping.py)
+        return (np.array([circle.asleep for circle in self.circles], dtype=bool),
+                np.array([circle.rest_steps for circle in self.circles], dtype=np.int64),
+                np.array([circle.island for circle in self.circles], dtype=np.int64))
+
+    def _set_sleep_state(self, asleep, rest_steps, islands, rows=None):
+        # writes the arrays of _sleep_state back into the circles (only "rows", if given)
+        rows = range(len(self.circles)) if rows is None else rows
+        asleep, rest_steps, islands = asleep.tolist(), rest_steps.tolist(), islands.tolist()
+        for i in rows:
+            circle = self.circles[i]
+            circle.asleep = asleep[i]
+            circle.rest_steps = rest_steps[i]
+            circle.island = islands[i]
+
+    def _settle(self):
+        '''
+        counts the sub-steps every circle has been resting for and puts islands of resting circles to sleep
+        (see sleeping.settle)
+        :return: None
+        '''
+        from circle_simulation.sleeping import settle
+        first, second = self._contacts
+        vectors = self.get_vectors()
+        asleep, rest_steps, islands = self._sleep_state()
+        sleepers = settle(np.sqrt(vectors[:, 0] ** 2 + vectors[:, 1] ** 2), asleep, rest_steps, islands, first,
+                          second, self.sleep_speed, self.sleep_steps)
+        self._set_sleep_state(asleep, rest_steps, islands)
+        for i in sleepers.tolist():
+            self.circles[i].vector = np.zeros(2)
+
+    def _update_steps_per_frame(self):
+        '''
+        picks steps_per_frame for the coming frame when adaptive_steps is on. (stays the same for the whole frame, so
+        circle_time and the movement of the circles add up to exactly one frame)
+        :return: None
+        '''
+        if not self.adaptive_steps:
+            return
+        vectors, radii = self.get_vectors(), self.get_radii()
+        steps = self.min_steps
+        if len(radii):
+            max_speed = float(np.sqrt(vectors[:, 0] ** 2 + vectors[:, 1] ** 2).max())
+            # how far a circle may move in one sub-step
+            room = min(float(radii.min()), self.radius - float(radii.max()))
+            if room > 0:
+                steps = max(steps, int(np.ceil(max_speed / (self.max_travel * room))))
+            else:
+                steps = self.max_steps
+        self.steps_per_frame = min(steps, self.max_steps)
+        self.step_counts.append(self.steps_per_frame)
+
+    def _simulate_step_continuous(self):
+        '''
+        one sub-step in the continuous collision mode. the physics run on arrays gathered from the circles
+        (see continuous.advance), the circles then get their new state and info variables.
+        update_movement_vector is still called on every circle afterwards with its colliders of the sub-step
+        (BaseCircle's own returns right away, subclasses can add their logic on top)
+        :return: None
+        '''
+        from circle_simulation.continuous import advance, unique_pairs
+        circles = self.circles
+        n = len(circles)
+        positions = np.array([c.position for c in circles], dtype=np.float64).reshape(n, 2)
+        vectors = np.array([c.vector for c in circles], dtype=np.float64).reshape(n, 2)
+        radii = np.array([c.radius for c in circles], dtype=np.float64)
+        weights = np.array([c.weight for c in circles], dtype=np.float64)
+        restitution = np.array([c.damping for c in circles], dtype=np.float64)
+
+        first, second, walls, self.broad_phase_used = advance(positions, vectors, radii, weights, restitution,
+                                                              self.radius, 1 / self.steps_per_frame,
+                                                              self.broad_phase, self.grid_size)
+        self.number_of_collisions += len(first)
+        if self.profiler is not None:
+            self.profiler.count('contacts', len(first))
+        hits = (np.bincount(first, minlength=n) + np.bincount(second, minlength=n)).tolist()
+
+        # colliders of every circle, in the order of self.circles, followed by the simbox if it bounced off the wall
+        colliders = [[] for _ in range(n)]
+        a, b = unique_pairs(first, second)
+        rows, partners = np.concatenate((a, b)), np.concatenate((b, a))
+        order = np.lexsort((partners, rows))
+        for row, partner in zip(rows[order].tolist(), partners[order].tolist()):
+            colliders[row].append(circles[partner])
+        for row in np.unique(walls).tolist():
+            colliders[row].append(self)
+        self._contacts = (a, b)
+        self._wall_contacts = np.zeros(n, dtype=bool)
+        self._wall_contacts[walls] = True
+
+        for i, circle in enumerate(circles):
+            circle.position = positions[i]
+            circle.vector = vectors[i]
+            circle.circle_time += 1 / self.steps_per_frame
+            circle.number_of_collisions += hits[i]
+            circle.distance_traveled += abs(np.linalg.norm(circle.vector))
+            circle.current_colliders = colliders[i]
+        for circle, neighbors in zip(circles, colliders):
+            circle.update_movement_vector(my_neighbors=neighbors)
+
+    def run(self, frames, record=('positions', 'vectors', 'collisions'), out=None):
+        '''
+        steps the simulation "frames" frames without rendering anything, recording the state after every frame into
+        preallocated arrays. (nothing is appended frame by frame, so the physics are the only real cost)
+        :param frames: amount of frames to simulate
+        :param record: what to record after each frame, any of:
+                       'positions' - (frames, n, 2) positions of the circles
+                       'vectors' - (frames, n, 2) movement vectors of the circles
+                       'collisions' - (frames,) amount of collisions between circles on each frame
+        :param out: optional dict of arrays to record into (same keys and shapes as above), for example np.memmap's
+                    for runs too large for memory. Arrays not given are allocated with np.zeros
+        :return: dict of the recorded arrays
+        '''
+        n = len(self.circles)
+        shapes = {'positions': (frames, n, 2), 'vectors': (frames, n, 2), 'collisions': (frames,)}
+        recorded = {}
+        for name in record:
+            if name not in shapes:
+                raise ValueError(f"can't record {name!r}, pick from {list(shapes)}")
+            array = (out or {}).get(name)
+            if array is None:
+                array = np.zeros(shapes[name], dtype=np.int64 if name == 'collisions' else np.float64)
+            elif array.shape != shapes[name]:
+                raise ValueError(f"array for {name!r} has shape {array.shape}, expected {shapes[name]}")
+            recorded[name] = array
+
+        positions, vectors = recorded.get('positions'), recorded.get('vectors')
+        collisions = recorded.get('collisions')
+        for frame in range(frames):
+            collisions_before = self.number_of_collisions
+            self.simulate_frame()
+            if len(self.circles) != n:
+                raise ValueError("run() records a fixed amount of circles, but circles were added or removed")
+            if positions is not None:
+                self.get_positions(out=positions[frame])
+            if vectors is not None:
+                self.get_vectors(out=vectors[frame])
+            if collisions is not None:
+                collisions[frame] = self.number_of_collisions - collisions_before
+        return recorded
+
+    def get_positions(self, out=None):
+        '''
+        :param out: optional (n, 2) array to write into
+        :return: (n, 2) array of the positions of all circles
+        '''
+        if out is None:
+            out = np.empty((len(self.circles), 2))
+        for i, circle in enumerate(self.circles):
+            out[i] = circle.position
+        return out
+
+    def get_vectors(self, out=None):
+        '''
+        :param out: optional (n, 2) array to write into
+        :return: (n, 2) array of the movement vectors of all circles
+        '''
+        if out is None:
+            out = np.empty((len(self.circles), 2))
+        for i, circle in enumerate(self.circles):
+            out[i] = circle.vector
+        return out
+
+    def get_radii(self):
+        '''
+        :return: (n,) array of the radii of all circles
+        '''
+        return np.array([circle.radius for circle in self.circles], dtype=np.float64)
+
+    def get_weights(self):
+        '''
+        :return: (n,) array of the weights of all circles
+        '''
+        return np.array([circle.weight for circle in self.circles], dtype=np.float64)
+
+    def get_colors(self):
+        '''
+        :return: (n, 3) uint8 array of the colors of all circles
+        '''
+        return np.array([circle.color for circle in self.circles], dtype=np.uint8).reshape(-1, 3)
+
+    def get_distances(self):
+        '''
+        :return: (n,) array of the distance every circle traveled so far
+        '''
+        return np.array([circle.distance_traveled for circle in self.circles], dtype=np.float64)
+
+    def save_checkpoint(self, path):
+        '''
+        saves the full state of the simulation (every circle, frame count, boundary...) into a single uncompressed
+        .npz file, so a long run can be resumed later with load_checkpoint.
+        the file is written next to "path" first and moved in place, so a crash never leaves half a checkpoint behind
+        :param path: file to write (written as is, no extension is added)
+        :return: None
+        '''
+        state = self._get_circle_state()
+        state['names'] = np.array(self._get_circle_names(), dtype=str)
+        state['simbox'] = np.array([self.radius, self.thickness, self.steps_per_frame, self.current_frame,
+                                    self.number_of_collisions], dtype=np.float64)
+        state['boundary_color'] = np.array(self.color, dtype=np.int64)
+        state['broad_phase'] = np.array([self.broad_phase, '' if self.grid_size is None else repr(self.grid_size)])
+        state['collision_mode'] = np.array(self.collision_mode)
+        state['version'] = np.array(CHECKPOINT_VERSION)
+
+        temp_path = f"{path}.tmp"
+        with open(temp_path, 'wb') as f:
+            np.savez(f, **state)
+        os.replace(temp_path, path)
+
+    def load_checkpoint(self, path):
+        '''
+        restores the state saved by save_checkpoint into this simbox. the state is written into the circles already
+        in the simbox (so subclasses of BaseCircle keep their class), missing circles are created as BaseCircles and
+        extra circles are removed. simulating on from here gives exactly the same result as the original run
+        :param path: checkpoint file
+        :return: None
+        '''
+        with np.load(path) as f:
+            state = {name: f[name] for name in f.files}
+        if int(state['version']) not in (1, 2, CHECKPOINT_VERSION):
+            raise ValueError(f"unsupported checkpoint version {int(state['version'])}")
+        if 'ids' not in state:
+            # version 1 had no circle ids
+            state['ids'] = np.arange(len(state['names']))
+        if 'asleep' not in state:
+            # versions 1 and 2 had no sleeping circles
+            state['asleep'] = np.zeros(len(state['names']), dtype=bool)
+            state['rest_steps'] = np.zeros(len(state['names']), dtype=np.int64)
+            state['islands'] = np.full(len(state['names']), -1, dtype=np.int64)
+
+        radius, thickness, steps_per_frame, current_frame, number_of_collisions = state['simbox']
+        self.radius = float(radius)
+        self.thickness = int(thickness)
+        self.steps_per_frame = int(steps_per_frame)
+        self.current_frame = int(current_frame)
+        self.number_of_collisions = int(number_of_collisions)
+        self.color = tuple(state['boundary_color'].tolist())
+        broad_phase, grid_size = state['broad_phase'].tolist()
+        self.broad_phase = broad_phase
+        self.grid_size = float(grid_size) if grid_size else None
+        self.collision_mode = str(state['collision_mode'])
+
+        names = state['names'].tolist()
+        n = len(names)
+        del self.circles[n:]
+        if len(self.circles) < n:
+            self.add_circles(np.zeros((n - len(self.circles), 2)), 0)
+        self._set_circle_state(state)
+        self._set_circle_names(names)
+
+    def _get_circle_names(self):
+        return [str(circle.name) for circle in self.circles]
+
+    def _set_circle_names(self, names):
+        for circle, name in zip(self.circles, names):
+            circle.name = name
+
+    def _get_circle_state(self):
+        '''
+        :return: dict of the per-circle arrays of a checkpoint (see CHECKPOINT_CIRCLE_ARRAYS)
+        '''
+        n = len(self.circles)
+        state = {}
+        for name, (attribute, dtype) in CHECKPOINT_CIRCLE_ARRAYS.items():
+            array = np.array([getattr(circle, attribute) for circle in self.circles], dtype=dtype)
+            state[name] = array.reshape((n, 2) if name in ('positions', 'vectors') else (n, 3) if name == 'colors' else n)
+        return state
+
+    def _set_circle_state(self, state):
+        '''
+        writes the per-circle arrays of a checkpoint into self.circles (same amount of rows as circles)
+        :param state: dict of arrays (see CHECKPOINT_CIRCLE_ARRAYS)
+        :return: None
+        '''
+        for i, circle in enumerate(self.circles):
+            circle.position = state['positions'][i].copy()
+            circle.vector = state['vectors'][i].copy()
+            circle.radius = float(state['radii'][i])
+            circle.weight = float(state['weights'][i])
+            circle.damping = float(state['damping'][i])
+            circle.color = tuple(state['colors'][i].tolist())
+            circle.number_of_collisions = int(state['collisions'][i])
+            circle.distance_traveled = float(state['distances'][i])
+            circle.circle_time = float(state['times'][i])
+            circle.current_colliders = []
+            circle.circle_id = int(state['ids'][i])
+        self._set_sleep_state(state['asleep'], state['rest_steps'], state['islands'])
+        ids = state['ids'].tolist()
+        self._next_id = max(ids) + 1 if ids else 0
+        self._free_ids = sorted(set(range(self._next_id)) - set(ids), reverse=True)
 
     def get_possible_colliders(self, circle):
         '''
         :param circle:
-        :return: list of neighbors
+        :return: list of neighbors. (circles the broad phase found close enough on the last sub-step, in the order of
+                 self.circles, followed by the simbox if the circle is close enough to the wall)
         '''
-        # copy all circles into new list
-        colliders = self.circles.copy()
-        # remove itself from the list (it cannot collide in itself)
-        colliders.remove(circle)
+        row = self._neighbor_index.get(id(circle))
+        if row is None or self.circles[row] is not circle:
+            # circle is unknown to the broad phase (e.g. added in the midst of a sub-step). check it against everything
+            colliders = [c for c in self.circles if c is not circle]
+            colliders.append(self)
+            return colliders
+
+        if self._neighbor_offsets is None:
+            # both circles of a pair are possible colliders of each other. group them by circle, in circles order
+            first, second = self._candidates
+            rows = np.concatenate((first, second))
+            partners = np.concatenate((second, first))
+            order = np.lexsort((partners, rows))
+            self._neighbor_rows = partners[order]
+            self._neighbor_offsets = np.searchsorted(rows[order], np.arange(len(self._near_wall) + 1))
+
+        start, stop = self._neighbor_offsets[row], self._neighbor_offsets[row + 1]
+        colliders = [self.circles[i] for i in self._neighbor_rows[start:stop]]
         # add simbox as potential collider
-        colliders.append(self)
-        # Grid system code comes here. still unimplemented
+        if self._near_wall[row]:
+            colliders.append(self)
         return colliders
 
+    def _find_collisions(self):
+        '''
+        runs the broad phase over all circles, then measures the distance of each possible pair once.
+        runs once per sub-step, so circles added or removed in between are always accounted for
+        :return: list of colliding pairs of circles (in the order of self.circles), and for every circle the list of
+                 its colliders (circles in the order of self.circles, followed by the simbox if it touches the wall)
+        '''
+        n = len(self.circles)
+        positions = np.array([c.position for c in self.circles], dtype=np.float64).reshape(n, 2)
+        radii = np.array([c.radius for c in self.circles], dtype=np.float64)
+        first, second, self.broad_phase_used = find_pairs(self.broad_phase, positions, radii, self.grid_size)
+        profiler = self.profiler
+        if profiler is not None:
+            profiler.mark('broad_phase')
+            profiler.count('candidates', len(first))
+
+        # kept for get_possible_colliders
+        self._candidates = (first, second)
+        self._neighbor_offsets = None
+        self._neighbor_index = {id(c): i for i, c in enumerate(self.circles)}
+
+        # circles colliding with each other. (closer than the sum of their radii)
+        delta = positions[first] - positions[second]
+        touching = np.sqrt(delta[:, 0] ** 2 + delta[:, 1] ** 2) <= radii[first] + radii[second]
+        # circles colliding with the wall. (further from the center than the radius of the simbox allows)
+        distance = np.sqrt(positions[:, 0] ** 2 + positions[:, 1] ** 2)
+        self._near_wall = distance >= self.radius - radii
+
+        self._awake = None
+        if self.sleep_speed is not None:
+            asleep, rest_steps, islands = self._sleep_state()
+            if asleep.any():
+                # islands touched by awake circles wake up, pairs of sleeping circles are left out
+                from circle_simulation.sleeping import wake_touched
+                was_asleep = asleep.copy()
+                keep, woke = wake_touched(first[touching], second[touching], asleep, rest_steps, islands)
+                if woke:
+                    self._set_sleep_state(asleep, rest_steps, islands, np.nonzero(was_asleep & ~asleep)[0].tolist())
+                touching[touching] = keep
+                if asleep.any():
+                    self._awake = ~asleep
+                    self._near_wall &= self._awake
+        self._contacts = (first[touching], second[touching])
+        self._wall_contacts = self._near_wall
+
+        circles = self.circles
+        pairs = []
+        colliders = [[] for _ in range(n)]
+        # pairs are sorted by first then second, so each list of colliders ends up in the order of self.circles
+        for a, b in zip(first[touching].tolist(), second[touching].tolist()):
+            pairs.append((circles[a], circles[b]))
+            colliders[a].append(circles[b])
+            colliders[b].append(circles[a])
+        for a in np.nonzero(self._near_wall)[0].tolist():
+            colliders[a].append(self)
+        if profiler is not None:
+            profiler.mark('narrow_phase')
+            profiler.count('contacts', len(pairs))
+        return pairs, colliders
+
     def add_circle(self, circle):
         '''
         :param circle: Circle to add to Sim
         :return:
         '''
         circle.sim_box = self
+        circle.circle_id = self._new_circle_ids(1)[0]
         self.circles.append(circle)
 
+class StepArrays:
+    '''
+    Arrays of one sub-step handed to the batched hooks of BaseSimbox (pre_step, post_contact and post_step).
+    Row i belongs to the i-th circle of simbox.circles. With VectorSimbox they are views of its arrays, so changes go
+    straight into the simulation. BaseSimbox gathers them from the circles and writes positions, vectors and colors
+    back once the hook returns.
+    Circles may only be added or removed in post_step, the rest of the sub-step still runs on these arrays otherwise.
+    '''
+    def __init__(self, positions, vectors, colors, radii, first, second, wall):
+        # (n, 2) arrays
+        self.positions = positions
+        self.vectors = vectors
+        # (n, 3) uint8 array
+        self.colors = colors
+        # (n,) array (changes are not written back)
+        self.radii = radii
+        # contacts of the sub-step: rows of the colliding pairs (first < second, sorted by first then second) and the
+        # mask of the circles touching the wall
+        self.first = first
+        self.second = second
+        self.wall = wall
+
+class _StoredField:
+    '''
+    attribute of BaseCircle that lives on the circle itself until the circle is added to an array-backed simbox
+    (see vector_simulation.VectorSimbox). From then on, it is read from the simbox's arrays, which turns the
+    circle into a lightweight view of its row. (writes are redirected in BaseCircle.__setattr__)
+    While the circle owns its state, the value sits in the instance __dict__ and shadows this descriptor,
+    so plain circles pay nothing for it.
+    '''
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, circle, owner=None):
+        if circle is None:
+            return self
+        if circle._store is None:
+            raise AttributeError(self.name)
+        return circle._store.read(circle.circle_id, self.name)
+
 class BaseCircle:
+    # state that an array-backed simbox keeps in contiguous arrays once the circle is added to it
+    position = _StoredField()
+    vector = _StoredField()
+    radius = _StoredField()
+    weight = _StoredField()
+    damping = _StoredField()
+    color = _StoredField()
+    number_of_collisions = _StoredField()
+    distance_traveled = _StoredField()
+    circle_time = _StoredField()
+    current_colliders = _StoredField()
+    asleep = _StoredField()
+    rest_steps = _StoredField()
+    island = _StoredField()
+
+    # store that holds this circle's state. None while the circle owns its own state
+    _store = None
+    # id given by the simbox the circle is part of (stays the same until it's removed from it). -1 before that
+    circle_id = -1
 
     def __init__(self, simbox=None, name='',radius=5, weight=1, damping=0,
                  color=(156, 156, 156), angle=0, speed=0, vector=None, position=None):
@@ -226,6 +1129,21 @@ class BaseCircle:
         # stores a list of all colliders and is updated on every sim-step. (useful as info and for clean_collisions)
         self.current_colliders = []
 
+        # sleeping (see sleeping.py). whether the circle sits the sub-steps out, sub-steps in a row it has been
+        # moving slower than simbox.sleep_speed, and the group of touching circles it fell asleep with (-1 if awake)
+        self.asleep = False
+        self.rest_steps = 0
+        self.island = -1
+
+
+    def __setattr__(self, name, value):
+        # while the circle is part of an array-backed simbox, its stored attributes are written to the arrays
+        store = self._store
+        if store is not None and name in store.ATTRIBUTES:
+            store.write(self.circle_id, name, value)
+        else:
+            object.__setattr__(self, name, value)
+
     def __str__(self):
         return f"""
 Name:                 {self.name}        
@@ -238,29 +1156,31 @@ Total Distance:       {self.distance_traveled}
 
     def update_movement_vector(self, my_neighbors):
         '''
-        top level function to take care of collisions. (calls self._handle_collision, self._handle_simbox_collision
-        for the heavy lifting)
-        :param my_neighbors: all circles in the simulation environment (simbox) + the simbox's walls
+        top level function to take care of collisions. called by the simbox on every sub-step, after the momentum
+        exchange with every colliding circle was added onto self.temp_vector (see self._handle_collision).
+        takes care of the energy lost on each collision and of bouncing off the wall (self._handle_simbox_collision)
+        :param my_neighbors: all circles colliding with self on this sub-step (in the order of simbox.circles),
+                             followed by the simbox if self touches its wall
         :return: None
         '''
+        # array-backed simboxes and the continuous collision mode resolve the whole sub-step in bulk. they only call
+        # in here so that subclasses overriding this method still run their own logic (see VectorSimbox)
+        if self._store is not None or getattr(self.sim_box, 'collision_mode', 'discrete') == 'continuous':
+            return
+
         # ensures constant time no matter simbox steps per frame
         self.circle_time += 1 / self.sim_box.steps_per_frame
-        # get all circles colliding with self
-        self.current_colliders = self._is_colliding_with(neighbors=my_neighbors)
-
-        # copy current vector, position explicitly to temporary (in case there are no collisions)
-        self.temp_vector = self.vector.copy()
-        self.temp_position = self.position.copy()
+        self.current_colliders = my_neighbors
 
-        # handle vector changes due to collisions
         for collider in self.current_colliders:
             # if self collided with the wall..
             if isinstance(collider, BaseSimbox):
                 self._handle_simbox_collision()
 
-            # if self collided with another circle..
+            # if self collided with another circle.. (energy lost once per collision)
             else:
-                self._handle_collision(collider)
+                self.number_of_collisions += 1
+                self.temp_vector *= self.damping
 
     def update_position(self):
         '''
@@ -283,20 +1203,28 @@ Total Distance:       {self.distance_traveled}
         '''
         :param collider: BaseCircle instance that collides with self
         handles the vector changes after a collision. "the gut of the simulation".
-        self.vector is changed to transfer (some of) its momentum to colliding circles.
-        Each circle involved in the collision is updated on separate calls.
+        momentum is exchanged between self and collider: both temp_vectors are updated in this single call, which the
+        simbox makes once per colliding pair. The exchange is computed from the movement vectors at the start of the
+        sub-step, so the result does not depend on the order in which pairs are handled.
         :return:
         '''
 
-        d = np.sqrt((self.temp_position[0] - collider.position[0]) ** 2 + (self.temp_position[1] - collider.position[1]) ** 2)
-        norm_x = (self.temp_position[0] - collider.position[0]) / d
-        norm_y = (self.temp_position[1] - collider.position[1]) / d
+        d = np.sqrt((self.position[0] - collider.position[0]) ** 2 + (self.position[1] - collider.position[1]) ** 2)
+        # circles sitting exactly on top of each other have no direction to push in
+        if d == 0:
+            return
+        norm_x = (self.position[0] - collider.position[0]) / d
+        norm_y = (self.position[1] - collider.position[1]) / d
 
-        p = 2 * (self.temp_vector[0] * norm_x + self.temp_vector[1] * norm_y - collider.vector[0] * norm_x - collider.vector[1] * norm_y) / (self.weight + collider.weight)
+        p = 2 * (self.vector[0] * norm_x + self.vector[1] * norm_y - collider.vector[0] * norm_x - collider.vector[1] * norm_y) / (self.weight + collider.weight)
+        # pairs that are already moving apart (still overlapping from an earlier sub-step) exchange nothing
+        if p >= 0:
+            return
 
         self.temp_vector[0] = self.temp_vector[0] - p * norm_x * collider.weight
         self.temp_vector[1] = self.temp_vector[1] - p * norm_y * collider.weight
-        self.temp_vector *= self.damping
+        collider.temp_vector[0] = collider.temp_vector[0] + p * norm_x * self.weight
+        collider.temp_vector[1] = collider.temp_vector[1] + p * norm_y * self.weight
 
     def _handle_simbox_collision(self):
         '''
@@ -309,51 +1237,28 @@ Total Distance:       {self.distance_traveled}
         proj = (np.dot(self.temp_vector, posit_normalized) / np.dot(posit_normalized, posit_normalized)) * posit_normalized
         self.temp_vector = self.temp_vector - 2 * proj
 
-    def _clean_collisions(self):
+    def _clean_collision(self, collider):
         '''
-        creates distance between each colliding circle, enough to take it out of range. so that it wont look strange
-        :return: None
+        measures how much self and collider (still) overlap after moving, enough to take them out of range so that it
+        wont look strange. called once per colliding pair, each circle moves by half of the overlap (see
+        broad_phase.overlap_push)
+        :param collider: BaseCircle instance that collided with self on this sub-step
+        :return: vector to move collider by (self moves by the opposite)
         '''
-        for collider in self.current_colliders:
-            cur_distance = np.linalg.norm(self.position - collider.position)
-            # colliding with boundary
-            if isinstance(collider, BaseSimbox):
-                max_distance = collider.radius - self.radius
-                if cur_distance > max_distance:
-                    self.position = (max_distance / cur_distance) * self.position
-
-            else:
-                min_distance = self.radius + collider.radius
-                if min_distance - cur_distance > 0:
-                    difference = (min_distance - cur_distance) * (collider.position - self.position)
-                    self.position = self.position - difference
-
-    def _is_colliding_with(self, neighbors)->list:
-        '''
-        :param neighbors: Possible colliders list received from simbox. at this point, it includes all circles in the
-        sim, and the simbox
-        :return: list of colliding neighbors
-        '''
-        colliders = []
-        for n in neighbors:
-            # measures distance from n
-            # magnitude of vector a - b = direct line..
-            cur_distance = np.linalg.norm(self.position - n.position)
-            # if n is another circle..
-            if not isinstance(n, BaseSimbox):
-                # Test if they collide with each other; test works by calculating the closest (closest=furthest) they
-                # can to be without colliding, and checking if cur_distance < allowed_distance.
-                if cur_distance <= self.radius + n.radius:
-                    self.number_of_collisions += 1
-                    colliders.append(n)
-
-            # else, if n is the simbox-wall
-            else:
-                # if cur_distance > allowed_distance -> [radius of simulation-box]
-                if cur_distance >= self.sim_box.radius - self.radius:
-                    colliders.append(n)
+        difference = collider.position - self.position
+        return overlap_push(difference[None], np.array([self.radius + collider.radius], dtype=float))[0]
 
-        return colliders
+    def _clean_simbox_collision(self):
+        '''
+        pulls self back inside the boundary if it escaped it
+        :return: None
+        '''
+        # (measured exactly like the wall test in BaseSimbox._find_collisions, a circle pulled back onto the wall
+        # should be found touching it on the next sub-step)
+        cur_distance = np.sqrt(self.position[0] ** 2 + self.position[1] ** 2)
+        max_distance = self.sim_box.radius - self.radius
+        if cur_distance > max_distance:
+            self.position = (max_distance / cur_distance) * self.position
 
     def _vector_angle(self):
         '''
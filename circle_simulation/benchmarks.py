@@ -0,0 +1,369 @@
+'''
+Headless benchmarks of the physics and the rendering, built from the scenes of Examples.py and tests/test.py.
+
+Every scenario is scaled to the requested amounts of circles (the simbox grows with it, so the density stays that of
+the original scene) and measured separately for:
+    physics - sub-steps per second and frames per second of simulate_frame, peak memory
+    render  - frames per second of render_array for each renderer backend, peak memory
+    import  - seconds it takes a fresh interpreter to import the physics (and the renderers module), which must not
+              load any renderer backend and must stay within IMPORT_BUDGET
+    scaling - (with --scaling) steps per second of ParallelSimbox on each amount of workers, the speedup over
+              VectorSimbox, the efficiency (speedup / workers) and whether the results match VectorSimbox bit for bit
+
+Usage:
+    python -m circle_simulation.benchmarks --sizes 1000 10000 --out results.json
+    python -m circle_simulation.benchmarks --sizes 1000 10000 --baseline results.json --threshold 0.15
+    python -m circle_simulation.benchmarks --scenarios stress --sizes 1000000 --scaling 1 2 4 8 16 32
+The second run fails (exit code 1) if any measurement got worse than the baseline by more than the threshold, or if
+a measurement of the baseline wasn't taken at all (run the same scenarios, engines, sizes and backends).
+Any run fails if the import goes over its budget. The scaling run fails if a parallel run doesn't match the serial one.
+'''
+import json
+import os
+import platform
+import time
+import tracemalloc
+import numpy as np
+from circle_simulation.base_simulation import BaseSimbox, BaseRenderer
+from circle_simulation.vector_simulation import VectorSimbox
+from circle_simulation.parallel import ParallelSimbox
+from circle_simulation.extras import uniform_in_disk, spiral
+
+ENGINES = {'base': BaseSimbox, 'vector': VectorSimbox, 'parallel': ParallelSimbox}
+DEFAULT_SIZES = (1000, 10000, 100000)
+# the object engine steps every circle in python. larger scenes are skipped for it unless asked for explicitly
+BASE_ENGINE_LIMIT = 10000
+# width of the rendered frames in pixels, whatever the size of the scene
+RENDER_SIZE = 1000
+# modules a headless worker imports, the renderer backends they must not load on import, and the seconds their import
+# may take in a fresh interpreter (numpy alone takes most of it)
+HEADLESS_MODULES = ('circle_simulation.base_simulation', 'circle_simulation.vector_simulation',
+                    'circle_simulation.renderers')
+BACKEND_MODULES = ('PIL', 'pygame', 'cv2', 'keyboard')
+IMPORT_BUDGET = 0.25
+
+def _scaled_radius(radius, original_amount, amount):
+    # radius of a simbox holding "amount" circles as densely as the original scene held "original_amount"
+    return radius * max(1., (amount / original_amount) ** 0.5)
+
+def basic_scene(engine, amount, seed=0):
+    # the 5 circle scene of tests/test.py, repeated
+    rng = np.random.default_rng(seed)
+    radius = _scaled_radius(100, 5, amount)
+    sizes = np.resize([5, 5, 9, 5, 5], amount)
+    return ENGINES[engine](radius=radius, boundary_color=(255, 255, 255), boundary_thickness=1, steps_per_frame=1,
+                           amount=amount, positions=uniform_in_disk(amount, radius - 9, rng),
+                           sizes=sizes.tolist(), speeds=np.resize([1, 1, 1, 2, 3], amount).tolist(),
+                           angles=(rng.random(amount) * 2 * np.pi).tolist(), vectors=None,
+                           weights=np.resize([1, 1, 5, 1, 1], amount).tolist(), damping=[0] * amount,
+                           colors=[(60, 120, 250)] * amount)
+
+def spiral_scene(engine, amount, seed=0):
+    # spiral_sim of Examples.py
+    radius = _scaled_radius(100, 140, amount)
+    positions, x = spiral(amount, radius)
+    return ENGINES[engine](radius=radius, boundary_color=(255, 255, 255), boundary_thickness=5, steps_per_frame=1,
+                           amount=amount, positions=positions, sizes=[3] * amount, speeds=[1] * amount,
+                           angles=x.tolist(), vectors=None, weights=[1] * amount, damping=[0.0] * amount,
+                           colors=[(60, 120, 250)] * amount)
+
+def cradle_scene(engine, amount, seed=0):
+    # newtons_cradle of Examples.py: columns of 7 circles, the first of each column moving up into the others
+    columns = max(1, amount // 7)
+    radius = _scaled_radius(100, 7, amount) * 1.5
+    # lay the columns out on a square lattice inside of the simbox
+    side = int(np.ceil(columns ** 0.5))
+    spacing = 1.2 * radius / side
+    column_x = (np.arange(columns) % side - (side - 1) / 2) * spacing
+    column_y = (np.arange(columns) // side - (side - 1) / 2) * spacing
+    offsets = np.array([-6., -2., -1., 0., 1., 2., 6.]) * spacing / 14
+    positions = np.stack((np.repeat(column_x, 7), (column_y[:, None] + offsets).ravel()), axis=1)
+    n = len(positions)
+    speeds = np.tile([2, 0, 0, 0, 0, 0, 0], columns)
+    return ENGINES[engine](radius=radius, boundary_color=(255, 255, 255), boundary_thickness=10, steps_per_frame=1,
+                           amount=n, positions=positions, sizes=[min(4, spacing / 30)] * n, speeds=speeds.tolist(),
+                           angles=[np.pi / 2] * n, vectors=None, weights=[1] * n, damping=[0] * n,
+                           colors=[(125, 180, 255)] * n)
+
+def stress_scene(engine, amount, seed=0):
+    # test_stress_test of tests/test.py
+    rng = np.random.default_rng(seed)
+    radius = _scaled_radius(100, 500, amount)
+    return ENGINES[engine](radius=radius, boundary_color=(255, 255, 255), boundary_thickness=1, steps_per_frame=1,
+                           amount=amount, positions=uniform_in_disk(amount, radius, rng), sizes=[2] * amount,
+                           speeds=[1] * amount, angles=(rng.random(amount) * 6.28).tolist(), vectors=None,
+                           weights=[1] * amount, damping=[0.2] * amount, colors=[(60, 120, 250)] * amount)
+
+def popcorn_scene(engine, amount, seed=0):
+    # PopCornSim of Examples.py: every frame a twelfth of the circles is removed and as many new ones pop up
+    class PopCornSim(ENGINES[engine]):
+        def simulate_frame(self):
+            super().simulate_frame()
+            churn = len(self.circles) // 12
+            self.remove_circles(self.rng.choice(self.get_ids(), churn, replace=False))
+            positions = uniform_in_disk(churn, self.radius - 3, self.rng)
+            vectors = uniform_in_disk(churn, 2, self.rng)
+            self.add_circles(positions, 3, vectors=vectors, colors=(min(3 * len(self.circles), 255), 100, 100))
+
+    rng = np.random.default_rng(seed)
+    radius = _scaled_radius(100, 120, amount)
+    sim = PopCornSim(radius=radius, boundary_color=(10, 255, 25), boundary_thickness=10, steps_per_frame=1,
+                     amount=amount, positions=uniform_in_disk(amount, radius - 3, rng), sizes=[3] * amount,
+                     speeds=None, angles=None, vectors=uniform_in_disk(amount, 2, rng), weights=[1] * amount,
+                     damping=[0] * amount, colors=[(100, 100, 100)] * amount)
+    sim.rng = rng
+    return sim
+
+SCENARIOS = {'basic': basic_scene, 'spiral': spiral_scene, 'cradle': cradle_scene, 'popcorn': popcorn_scene,
+             'stress': stress_scene}
+
+def _peak_memory(function):
+    '''
+    :return: peak amount of bytes allocated while running function (numpy arrays included)
+    '''
+    tracemalloc.start()
+    try:
+        function()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def bench_physics(sim, frames):
+    '''
+    :param sim: simbox to step (left at the state after the benchmark)
+    :param frames: frames to time
+    :return: dict of steps_per_second, frames_per_second and peak_memory_bytes
+    '''
+    # one frame to warm up (lazy imports, caches), then the memory of a typical frame
+    sim.simulate_frame()
+    peak = _peak_memory(sim.simulate_frame)
+    steps = 0
+    start = time.perf_counter()
+    for _ in range(frames):
+        sim.simulate_frame()
+        steps += sim.steps_per_frame
+    seconds = time.perf_counter() - start
+    return {'steps_per_second': steps / seconds, 'frames_per_second': frames / seconds, 'peak_memory_bytes': peak}
+
+def bench_render(sim, frames, backend):
+    '''
+    :param sim: simbox to render (not stepped)
+    :param frames: frames to time
+    :param backend: renderer backend ('pil' or 'sprite')
+    :return: dict of frames_per_second and peak_memory_bytes
+    '''
+    renderer = BaseRenderer(sim, resolution=RENDER_SIZE / (2 * sim.radius), backend=backend)
+    renderer.render_array()
+    peak = _peak_memory(renderer.render_array)
+    start = time.perf_counter()
+    for _ in range(frames):
+        renderer.render_array()
+    seconds = time.perf_counter() - start
+    return {'frames_per_second': frames / seconds, 'peak_memory_bytes': peak}
+
+def bench_import(modules=HEADLESS_MODULES, repeat=3):
+    '''
+    imports "modules" in fresh interpreters (the best of "repeat" runs is kept, the first ones warm up the disk cache)
+    :param modules: modules to import
+    :param repeat: amount of interpreters started
+    :return: dict of the seconds the import took and the renderer backends it loaded
+    '''
+    import subprocess, sys
+    code = (f"import sys, time\nstart = time.perf_counter()\n"
+            f"import {', '.join(modules)}\n"
+            f"print(time.perf_counter() - start)\n"
+            f"print(' '.join(m for m in {BACKEND_MODULES!r} if m in sys.modules))")
+    best, loaded = float('inf'), []
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True).stdout
+        seconds, backends = (output.splitlines() + [''])[:2]
+        best = min(best, float(seconds))
+        loaded = backends.split()
+    return {'seconds': best, 'backends_loaded': loaded}
+
+def bench_scaling(scenario, amount, workers=(1, 2, 4, 8, 16, 32), frames=5, seed=0, verbose=True):
+    '''
+    steps the same scene with VectorSimbox and with ParallelSimbox on every amount of workers
+    :param scenario: name of the scenario (key of SCENARIOS)
+    :param amount: amount of circles
+    :param workers: amounts of worker processes to measure
+    :param frames: frames timed (after one frame to warm up)
+    :param seed: seed of the random scene
+    :param verbose: print every result as it comes in
+    :return: dict of scenario, circles, cores of the machine, serial steps_per_second and "runs": one dict per
+             amount of workers of steps_per_second, speedup, efficiency (speedup / workers) and identical (positions
+             and vectors match the serial run bit for bit)
+    '''
+    def timed(sim):
+        sim.simulate_frame()
+        steps = 0
+        start = time.perf_counter()
+        for _ in range(frames):
+            sim.simulate_frame()
+            steps += sim.steps_per_frame
+        return steps / (time.perf_counter() - start)
+
+    serial = SCENARIOS[scenario]('vector', amount, seed)
+    serial_speed = timed(serial)
+    report = {'scenario': scenario, 'circles': len(serial.circles), 'cores': os.cpu_count(),
+              'steps_per_second': serial_speed, 'runs': []}
+    if verbose:
+        print(f"{scenario:>8} {report['circles']:>7} circles, serial: {serial_speed:.2f} steps/s")
+    for amount_of_workers in workers:
+        sim = SCENARIOS[scenario]('parallel', amount, seed)
+        sim.workers = amount_of_workers
+        sim.min_circles = 0
+        try:
+            speed = timed(sim)
+            identical = bool(np.array_equal(sim.get_positions(), serial.get_positions()) and
+                             np.array_equal(sim.get_vectors(), serial.get_vectors()))
+        finally:
+            sim.close()
+        run = {'workers': amount_of_workers, 'steps_per_second': speed, 'speedup': speed / serial_speed,
+               'efficiency': speed / serial_speed / amount_of_workers, 'identical': identical}
+        report['runs'].append(run)
+        if verbose:
+            print(f"{amount_of_workers:>17} workers: {speed:.2f} steps/s, speedup {run['speedup']:.2f}, "
+                  f"efficiency {100 * run['efficiency']:.0f}%{'' if identical else ', RESULTS DIFFER'}")
+    return report
+
+def run_benchmarks(scenarios=tuple(SCENARIOS), sizes=DEFAULT_SIZES, engines=('vector',), backends=('pil', 'sprite'),
+                   frames=10, render_frames=5, seed=0, base_limit=BASE_ENGINE_LIMIT, verbose=True):
+    '''
+    :param scenarios: names of the scenarios to run (keys of SCENARIOS)
+    :param sizes: amounts of circles to scale every scenario to
+    :param engines: 'base' (BaseSimbox) and/or 'vector' (VectorSimbox)
+    :param backends: renderer backends to measure
+    :param frames: frames timed for the physics
+    :param render_frames: frames timed for each renderer backend
+    :param seed: seed of the random scenes
+    :param base_limit: largest scene run with the 'base' engine (None for no limit)
+    :param verbose: print every result as it comes in
+    :return: dict with "meta" (machine info), "import" (see bench_import) and "results" (one dict per scenario,
+             engine and size)
+    '''
+    imports = bench_import()
+    if verbose:
+        print(f"  import: {1000 * imports['seconds']:.1f} ms (budget {1000 * IMPORT_BUDGET:.0f} ms), "
+              f"backends loaded: {', '.join(imports['backends_loaded']) or 'none'}")
+    results = []
+    for scenario in scenarios:
+        for engine in engines:
+            for amount in sizes:
+                if engine == 'base' and base_limit is not None and amount > base_limit:
+                    continue
+                sim = SCENARIOS[scenario](engine, amount, seed)
+                result = {'scenario': scenario, 'engine': engine, 'circles': len(sim.circles),
+                          'physics': bench_physics(sim, frames),
+                          'render': {backend: bench_render(sim, render_frames, backend) for backend in backends}}
+                results.append(result)
+                if verbose:
+                    renders = ', '.join(f"{backend} {stats['frames_per_second']:.1f} fps"
+                                        for backend, stats in result['render'].items())
+                    print(f"{scenario:>8} {engine:>6} {result['circles']:>7} circles: "
+                          f"{result['physics']['steps_per_second']:.1f} steps/s, "
+                          f"{result['physics']['peak_memory_bytes'] / 2 ** 20:.1f} MiB | render: {renders}")
+    meta = {'python': platform.python_version(), 'numpy': np.__version__, 'machine': platform.machine(),
+            'platform': platform.platform(), 'time': time.strftime('%Y-%m-%dT%H:%M:%S')}
+    return {'meta': meta, 'import': imports, 'results': results}
+
+def _measurements(report):
+    # flattens a report into {(scenario, engine, circles, measurement): value}
+    flat = {}
+    for result in report['results']:
+        key = (result['scenario'], result['engine'], result['circles'])
+        for name, value in result['physics'].items():
+            flat[key + ('physics.' + name,)] = value
+        for backend, stats in result['render'].items():
+            for name, value in stats.items():
+                flat[key + (f'render.{backend}.{name}',)] = value
+    return flat
+
+def compare(report, baseline, threshold=0.1):
+    '''
+    :param report: results of run_benchmarks
+    :param baseline: earlier results of run_benchmarks to compare to
+    :param threshold: allowed relative change for the worse (0.1 = 10% fewer frames per second, or 10% more memory)
+    :return: list of regressions, each a dict of scenario, engine, circles, measurement, baseline, value and change.
+             measurements of the baseline missing from the report (a scenario renamed or left out) are regressions
+             too, with value and change None
+    '''
+    current = _measurements(report)
+    regressions = []
+    for key, old in _measurements(baseline).items():
+        if key not in current:
+            scenario, engine, circles, measurement = key
+            regressions.append({'scenario': scenario, 'engine': engine, 'circles': circles,
+                                'measurement': measurement, 'baseline': old, 'value': None, 'change': None})
+            continue
+        if not old:
+            continue
+        new = current[key]
+        # throughput should not drop, memory should not grow
+        change = (new - old) / old
+        worse = change > threshold if key[3].endswith('memory_bytes') else change < -threshold
+        if worse:
+            scenario, engine, circles, measurement = key
+            regressions.append({'scenario': scenario, 'engine': engine, 'circles': circles,
+                                'measurement': measurement, 'baseline': old, 'value': new, 'change': change})
+    return regressions
+
+def main(args=None):
+    import argparse
+    parser = argparse.ArgumentParser(description="benchmarks the physics and rendering of circle_simulation")
+    parser.add_argument('--scenarios', nargs='+', default=list(SCENARIOS), choices=list(SCENARIOS))
+    parser.add_argument('--sizes', nargs='+', type=int, default=list(DEFAULT_SIZES))
+    parser.add_argument('--engines', nargs='+', default=['vector'], choices=list(ENGINES))
+    parser.add_argument('--backends', nargs='+', default=['pil', 'sprite'], choices=['pil', 'sprite'])
+    parser.add_argument('--frames', type=int, default=10, help="frames timed for the physics")
+    parser.add_argument('--render-frames', type=int, default=5, help="frames timed for each renderer backend")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--base-limit', type=int, default=BASE_ENGINE_LIMIT,
+                        help="largest scene run with the base engine")
+    parser.add_argument('--import-budget', type=float, default=IMPORT_BUDGET,
+                        help=f"seconds the headless import may take (default {IMPORT_BUDGET})")
+    parser.add_argument('--scaling', nargs='+', type=int, metavar='WORKERS',
+                        help="instead of the benchmarks, report the scaling of the parallel engine on these amounts "
+                             "of workers (for every scenario and size)")
+    parser.add_argument('--out', help="file to write the results to (json)")
+    parser.add_argument('--baseline', help="results (json) to compare to. exits with 1 on regressions")
+    parser.add_argument('--threshold', type=float, default=0.1, help="allowed relative regression (default 0.1)")
+    args = parser.parse_args(args)
+
+    if args.scaling:
+        reports = [bench_scaling(scenario, amount, args.scaling, args.frames, args.seed)
+                   for scenario in args.scenarios for amount in args.sizes]
+        if args.out:
+            with open(args.out, 'w') as f:
+                json.dump({'scaling': reports}, f, indent=1)
+        return 0 if all(run['identical'] for report in reports for run in report['runs']) else 1
+
+    report = run_benchmarks(args.scenarios, args.sizes, args.engines, args.backends, args.frames,
+                            args.render_frames, args.seed, args.base_limit)
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(report, f, indent=1)
+    imports = report['import']
+    if imports['seconds'] > args.import_budget or imports['backends_loaded']:
+        print(f"IMPORT BUDGET exceeded: {1000 * imports['seconds']:.1f} ms "
+              f"(budget {1000 * args.import_budget:.0f} ms), backends loaded: {imports['backends_loaded']}")
+        return 1
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.threshold)
+        for r in regressions:
+            if r['value'] is None:
+                print(f"MISSING {r['scenario']} {r['engine']} {r['circles']} {r['measurement']}: "
+                      f"in the baseline ({r['baseline']:.4g}) but not measured")
+                continue
+            print(f"REGRESSION {r['scenario']} {r['engine']} {r['circles']} {r['measurement']}: "
+                  f"{r['baseline']:.4g} -> {r['value']:.4g} ({100 * r['change']:+.1f}%)")
+        if regressions:
+            return 1
+        print(f"no regressions beyond {100 * args.threshold:.0f}%")
+    return 0
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(main())
@@ -0,0 +1,291 @@
+import numpy as np
+
+# relative margin added to every distance bound of the broad phases, so that rounding errors can never hide a pair
+# that the (exact) collision test would count as colliding
+SLACK = 1e-9
+
+def _ragged_pairs(owners, starts, counts):
+    '''
+    expands runs of consecutive partners into explicit pairs.
+    Example: owners=[4, 7], starts=[0, 5], counts=[2, 1] -> a=[4, 4, 7], b=[0, 1, 5]
+    :param owners: first element of the pairs of each run
+    :param starts: first partner of each run
+    :param counts: amount of partners in each run
+    :return: arrays a, b of paired elements
+    '''
+    total = int(counts.sum())
+    a = np.repeat(owners, counts)
+    # position of every run inside the output
+    offsets = np.cumsum(counts) - counts
+    b = np.repeat(starts - offsets, counts) + np.arange(total)
+    return a, b
+
+def _sorted_pairs(a, b):
+    '''
+    :param a: first element of each pair
+    :param b: second element of each pair
+    :return: the same pairs as arrays "first", "second" with first < second, sorted by first then second
+    '''
+    first, second = np.minimum(a, b), np.maximum(a, b)
+    pair_order = np.lexsort((second, first))
+    return first[pair_order], second[pair_order]
+
+def _boxes_overlap(positions, radii, a, b):
+    '''
+    :return: mask of the pairs (a, b) whose bounding boxes overlap. (with some slack so that rounding never drops
+             a pair the exact distance test would keep)
+    '''
+    reach = (radii[a] + radii[b]) * (1 + SLACK)
+    return (np.abs(positions[a, 0] - positions[b, 0]) <= reach) & (np.abs(positions[a, 1] - positions[b, 1]) <= reach)
+
+def _no_pairs():
+    return np.zeros(0, dtype=np.intp), np.zeros(0, dtype=np.intp)
+
+class BruteForce:
+    '''
+    Broad phase that checks every circle against every other circle, the way the simulation always did.
+    Cheapest for a handful of circles. (runs in blocks to bound the memory of the n^2 comparisons)
+    '''
+    name = 'brute'
+    # max amount of comparisons made at once
+    BLOCK_SIZE = 2 ** 20
+
+    def find_pairs(self, positions, radii):
+        '''
+        :param positions: (n, 2) array of circle positions
+        :param radii: (n,) array of circle radii
+        :return: arrays "first", "second" of candidate pairs (first < second), sorted by first then second.
+                 includes every pair of circles closer than the sum of their radii
+        '''
+        n = len(positions)
+        block = max(1, self.BLOCK_SIZE // max(n, 1))
+        firsts, seconds = [], []
+        for start in range(0, n, block):
+            stop = min(start + block, n)
+            reach = (radii[start:stop, None] + radii[None, :]) * (1 + SLACK)
+            close = np.abs(positions[start:stop, None, 0] - positions[None, :, 0]) <= reach
+            close &= np.abs(positions[start:stop, None, 1] - positions[None, :, 1]) <= reach
+            # every pair once, (and not a circle with itself)
+            close &= np.arange(start, stop)[:, None] < np.arange(n)[None, :]
+            rows, columns = np.nonzero(close)
+            firsts.append(rows + start)
+            seconds.append(columns)
+        if not firsts:
+            return _no_pairs()
+        return np.concatenate(firsts), np.concatenate(seconds)
+
+class SweepAndPrune:
+    '''
+    Broad phase that sorts the circles along the axis they are most spread out on, and pairs each circle with the
+    circles whose extent on that axis overlaps its own. Handles mixed sizes well, but degrades when many circles
+    share the same stretch of the axis (dense clusters).
+    '''
+    name = 'sweep'
+
+    def find_pairs(self, positions, radii):
+        '''
+        :param positions: (n, 2) array of circle positions
+        :param radii: (n,) array of circle radii
+        :return: arrays "first", "second" of candidate pairs (first < second), sorted by first then second.
+                 includes every pair of circles closer than the sum of their radii
+        '''
+        n = len(positions)
+        if n < 2:
+            return _no_pairs()
+        axis = int(np.argmax(np.ptp(positions, axis=0)))
+        low = positions[:, axis] - radii * (1 + SLACK)
+        high = positions[:, axis] + radii * (1 + SLACK)
+
+        order = np.argsort(low, kind='stable')
+        # each circle overlaps every following circle (in sorted order) that starts before it ends
+        ends = np.searchsorted(low[order], high[order], side='right')
+        rank = np.arange(n)
+        a, b = _ragged_pairs(rank, rank + 1, np.maximum(ends - rank - 1, 0))
+        a, b = order[a], order[b]
+        keep = _boxes_overlap(positions, radii, a, b)
+        return _sorted_pairs(a[keep], b[keep])
+
+class KDTree:
+    '''
+    Broad phase that builds a balanced KD-tree over the circles (splitting each node in half along its wider side)
+    and walks it for all circles at once, descending only into nodes whose bounding box overlaps the circle.
+    Adapts to clusters and to circles of very different sizes.
+    '''
+    name = 'tree'
+
+    def __init__(self, leaf_size=8):
+        # max amount of circles in a leaf of the tree (at least 2, so that no node is ever split into an empty one)
+        self.leaf_size = max(2, leaf_size)
+
+    def find_pairs(self, positions, radii):
+        '''
+        :param positions: (n, 2) array of circle positions
+        :param radii: (n,) array of circle radii
+        :return: arrays "first", "second" of candidate pairs (first < second), sorted by first then second.
+                 includes every pair of circles closer than the sum of their radii
+        '''
+        n = len(positions)
+        if n < 2:
+            return _no_pairs()
+
+        # build the tree. every node is a run [start, stop) of circles in "order". node k of a level has
+        # nodes 2k and 2k+1 of the next level as its children
+        order = np.arange(n)
+        starts, stops = np.array([0]), np.array([n])
+        levels = [(starts, stops)]
+        while (stops - starts).max() > self.leaf_size:
+            sorted_positions = positions[order]
+            node_of = np.repeat(np.arange(len(starts)), stops - starts)
+            x_spread = np.maximum.reduceat(sorted_positions[:, 0], starts) - np.minimum.reduceat(sorted_positions[:, 0], starts)
+            y_spread = np.maximum.reduceat(sorted_positions[:, 1], starts) - np.minimum.reduceat(sorted_positions[:, 1], starts)
+            split_on_y = (y_spread > x_spread)[node_of]
+            key = np.where(split_on_y, sorted_positions[:, 1], sorted_positions[:, 0])
+            order = order[np.lexsort((key, node_of))]
+            middles = (starts + stops) // 2
+            starts = np.stack((starts, middles), axis=1).ravel()
+            stops = np.stack((middles, stops), axis=1).ravel()
+            levels.append((starts, stops))
+
+        # bounding box of every node (around the bounding boxes of its circles)
+        low = (positions - (radii * (1 + SLACK))[:, None])[order]
+        high = (positions + (radii * (1 + SLACK))[:, None])[order]
+        boxes = [(np.minimum.reduceat(low, starts, axis=0), np.maximum.reduceat(high, starts, axis=0))
+                 for starts, stops in levels]
+
+        # walk down the tree with every circle at once, keeping the (circle, node) pairs that overlap
+        circle_low = positions - radii[:, None]
+        circle_high = positions + radii[:, None]
+        queries = np.arange(n)
+        nodes = np.zeros(n, dtype=np.intp)
+        for level, (box_low, box_high) in enumerate(boxes):
+            overlap = np.all((circle_low[queries] <= box_high[nodes]) & (circle_high[queries] >= box_low[nodes]), axis=1)
+            queries, nodes = queries[overlap], nodes[overlap]
+            if level < len(boxes) - 1:
+                queries = np.repeat(queries, 2)
+                nodes = np.stack((2 * nodes, 2 * nodes + 1), axis=1).ravel()
+
+        # pair every circle with the circles of the leaves it reached
+        leaf_starts, leaf_stops = levels[-1]
+        a, b = _ragged_pairs(queries, leaf_starts[nodes], leaf_stops[nodes] - leaf_starts[nodes])
+        b = order[b]
+        keep = a < b
+        a, b = a[keep], b[keep]
+        keep = _boxes_overlap(positions, radii, a, b)
+        return _sorted_pairs(a[keep], b[keep])
+
+class UniformGrid:
+    '''
+    Broad phase that hashes every circle into a square cell of a uniform grid. Only circles in the same or
+    in neighboring cells are returned as possible colliders, which makes finding collisions ~O(n) instead of O(n^2)
+    for scenes where the circles are roughly the same size.
+    '''
+    name = 'grid'
+
+    def __init__(self, cell_size=None):
+        # side length of a cell. None derives it from the largest circle (its diameter), which means only the
+        # 8 surrounding cells have to be searched. Smaller cells search further out to stay correct
+        self.cell_size = cell_size
+
+    def find_pairs(self, positions, radii):
+        '''
+        :param positions: (n, 2) array of circle positions
+        :param radii: (n,) array of circle radii
+        :return: arrays "first", "second" of candidate pairs (first < second), sorted by first then second.
+                 includes every pair of circles closer than the sum of their radii (and usually some more)
+        '''
+        n = len(positions)
+        if n < 2:
+            return np.zeros(0, dtype=np.intp), np.zeros(0, dtype=np.intp)
+
+        largest = 2 * float(radii.max()) * (1 + SLACK)
+        cell_size = self.cell_size or largest or 1.
+        # how many cells away the furthest possible collider can be
+        reach = max(1, int(np.ceil(largest / cell_size)))
+
+        # integer cell of every circle, as a single key per cell.
+        # (width leaves room for the neighbors of the border cells, so neighboring keys never wrap around)
+        cells = np.floor(positions / cell_size).astype(np.int64)
+        cells -= cells.min(axis=0)
+        width = int(cells[:, 1].max()) + 2 * reach + 1
+        keys = cells[:, 0] * width + cells[:, 1]
+
+        # sort circles by cell, so that each cell is a run of consecutive circles
+        order = np.argsort(keys, kind='stable')
+        cell_keys, cell_starts, cell_counts = np.unique(keys[order], return_index=True, return_counts=True)
+        cell_of = np.repeat(np.arange(len(cell_keys)), cell_counts)
+        rank = np.arange(n)
+
+        # pairs inside the same cell: each circle with the circles following it in its run
+        cell_ends = (cell_starts + cell_counts)[cell_of]
+        a_list, b_list = [], []
+        a, b = _ragged_pairs(rank, rank + 1, cell_ends - rank - 1)
+        a_list.append(a)
+        b_list.append(b)
+
+        # pairs of neighboring cells. only half of the neighbors, the other half sees these cells as its neighbors
+        for dx in range(0, reach + 1):
+            for dy in range(-reach, reach + 1):
+                if dx == 0 and dy <= 0:
+                    continue
+                neighbor_keys = cell_keys + dx * width + dy
+                found = np.searchsorted(cell_keys, neighbor_keys)
+                found[found == len(cell_keys)] = 0
+                exists = cell_keys[found] == neighbor_keys
+                starts = np.where(exists, cell_starts[found], 0)
+                counts = np.where(exists, cell_counts[found], 0)
+                a, b = _ragged_pairs(rank, starts[cell_of], counts[cell_of])
+                a_list.append(a)
+                b_list.append(b)
+
+        return _sorted_pairs(order[np.concatenate(a_list)], order[np.concatenate(b_list)])
+
+# broad phases that can be selected by name
+BROAD_PHASES = {'brute': BruteForce, 'grid': UniformGrid, 'sweep': SweepAndPrune, 'tree': KDTree}
+
+def choose_broad_phase(radii):
+    '''
+    picks the broad phase expected to be fastest for a scene ("auto" mode)
+    :param radii: (n,) array of circle radii
+    :return: name of the broad phase (key of BROAD_PHASES)
+    '''
+    n = len(radii)
+    if n <= 32:
+        # not worth the setup
+        return 'brute'
+    # the grid's cells fit the largest circle. when that one is far larger than a typical circle,
+    # each cell is crowded with small circles
+    if radii.max() > 4 * np.median(radii):
+        return 'sweep' if n <= 20000 else 'tree'
+    return 'grid'
+
+def find_pairs(broad_phase, positions, radii, grid_size=None):
+    '''
+    :param broad_phase: name of a broad phase (key of BROAD_PHASES or "auto") or an object with a
+                        find_pairs(positions, radii) method
+    :param positions: (n, 2) array of circle positions
+    :param radii: (n,) array of circle radii
+    :param grid_size: cell size for the uniform grid (None derives it from the largest circle)
+    :return: arrays "first", "second" of candidate pairs (first < second, sorted) and the name of the broad phase
+             that found them
+    '''
+    if not isinstance(broad_phase, str):
+        return broad_phase.find_pairs(positions, radii) + (getattr(broad_phase, 'name', type(broad_phase).__name__),)
+    name = choose_broad_phase(radii) if broad_phase == 'auto' else broad_phase
+    if name not in BROAD_PHASES:
+        raise ValueError(f"unknown broad phase {broad_phase!r}, pick one of {list(BROAD_PHASES)} or 'auto'")
+    strategy = UniformGrid(grid_size) if name == 'grid' else BROAD_PHASES[name]()
+    return strategy.find_pairs(positions, radii) + (name,)
+
+def overlap_push(difference, min_distance):
+    '''
+    push that takes pairs of circles out of each other: each circle of a pair moves by half of their overlap, along
+    the line through their centers. shared by every engine so that they all separate circles the same way
+    :param difference: (m, 2) offsets from the first to the second circle of each pair
+    :param min_distance: (m,) sum of the radii of each pair
+    :return: (m, 2) vector to move the second circle of each pair by (the first moves by the opposite). 0 for pairs
+             that don't overlap and for circles sitting exactly on top of each other (no direction to push in)
+    '''
+    cur_distance = np.sqrt(difference[:, 0] ** 2 + difference[:, 1] ** 2)
+    overlap = np.maximum(min_distance - cur_distance, 0)
+    scale = np.divide(overlap / 2, cur_distance, out=np.zeros_like(overlap), where=cur_distance > 0)
+    return difference * scale[:, None]
@@ -0,0 +1,247 @@
+'''
+Continuous collision mode (collision_mode='continuous' of BaseSimbox and VectorSimbox).
+
+Instead of moving every circle by its full step and cleaning up the overlaps afterwards (which lets fast circles pass
+through each other and through the wall unless steps_per_frame is huge), a step is simulated as a series of events:
+the exact time at which each pair of circles touches, or a circle reaches the wall, is predicted and kept in a
+priority queue. The earliest event is resolved (only the circles involved are moved up to that time), and only the
+predictions of those circles are redone, against their neighbours. Predictions made for a circle before its last
+collision are dropped when they come up, using a per-circle collision counter.
+
+Neighbours are the circles whose disks overlap: every circle gets a disk around where it starts, reaching further than
+it travels during the step (see DISK_REACH), and the broad phase finds the overlapping disks once per step. Circles
+stay inside of their disks unless collisions speed them up a lot. A circle that could leave its disk gets a new one
+around where it is, and its neighbours are looked up again among all disks.
+'''
+import heapq
+import numpy as np
+from circle_simulation.broad_phase import find_pairs, overlap_push
+
+# circles sitting further into each other (or the wall) than this at the end of a step get pushed apart
+# (only happens when circles started out overlapping, or a step ran out of events)
+OVERLAP_TOLERANCE = 1e-9
+# disks of the neighbour lists reach this many times as far as the circles travel (beyond their radius). larger disks
+# mean more neighbours to predict events with, smaller ones more circles sped up out of their disks by collisions
+# (2 redraws about one disk per 600 collisions in a dense scene)
+DISK_REACH = 2
+
+def _pair_times(delta, relative, reach, now, end):
+    '''
+    time of impact of pairs of circles moving in straight lines
+    :param delta: (m, 2) position of one circle relative to the other at time "now"
+    :param relative: (m, 2) velocity of one circle relative to the other
+    :param reach: (m,) sum of the radii of each pair
+    :param now: time the positions are given at
+    :param end: end of the step
+    :return: (m,) time each pair touches, and a mask of the pairs that touch before "end"
+    '''
+    a = relative[:, 0] ** 2 + relative[:, 1] ** 2
+    b = delta[:, 0] * relative[:, 0] + delta[:, 1] * relative[:, 1]
+    c = delta[:, 0] ** 2 + delta[:, 1] ** 2 - reach ** 2
+    discriminant = b ** 2 - a * c
+    # only circles coming closer collide. circles already touching collide right away
+    valid = (b < 0) & (discriminant >= 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = np.where(c <= 0, 0., (-b - np.sqrt(np.maximum(discriminant, 0))) / a)
+    t = now + np.maximum(t, 0)
+    return t, valid & (t <= end)
+
+def _wall_times(positions, velocities, limit, now, end):
+    '''
+    time at which circles moving in straight lines reach the wall
+    :param positions: (m, 2) positions at time "now"
+    :param velocities: (m, 2) velocities
+    :param limit: (m,) furthest distance from the center each circle can get to (simbox radius - circle radius)
+    :param now: time the positions are given at
+    :param end: end of the step
+    :return: (m,) time each circle reaches the wall, and a mask of the circles that do before "end"
+    '''
+    a = velocities[:, 0] ** 2 + velocities[:, 1] ** 2
+    b = positions[:, 0] * velocities[:, 0] + positions[:, 1] * velocities[:, 1]
+    c = positions[:, 0] ** 2 + positions[:, 1] ** 2 - limit ** 2
+    # circles on (or past) the wall and moving outwards bounce right away. every other moving circle reaches the
+    # wall at some point (a circle that just bounced off it, at the far side)
+    outside = (c >= 0) & (b > 0)
+    valid = a > 0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = np.where(outside, 0., (-b + np.sqrt(np.maximum(b ** 2 - a * c, 0))) / a)
+    t = now + np.maximum(t, 0)
+    return t, valid & (t <= end)
+
+def advance(positions, vectors, radii, weights, restitution, boundary, duration, broad_phase='auto', grid_size=None,
+            max_events=None):
+    '''
+    moves every circle for "duration" (position += vector * duration), resolving every collision at the moment it
+    happens. collisions exchange momentum like BaseCircle._handle_collision, followed by the energy loss of both
+    circles (restitution, like BaseCircle.damping). a pair with different restitutions then gets pushed apart along
+    the normal if it needs to, so that it separates and doesn't collide again on the spot. circles bounce off the wall
+    like in BaseCircle._handle_simbox_collision. positions and vectors are updated in place
+    :param positions: (n, 2) array of circle positions
+    :param vectors: (n, 2) array of movement vectors
+    :param radii: (n,) array of radii
+    :param weights: (n,) array of weights
+    :param restitution: (n,) array of restitution factors (1 - damping)
+    :param boundary: radius of the simbox
+    :param duration: time to advance by (1 / steps_per_frame)
+    :param broad_phase: broad phase used to find the pairs that can meet during the step (see broad_phase.py)
+    :param grid_size: cell size for the uniform grid broad phase
+    :param max_events: max amount of collisions resolved in this step (None: 100 per circle). in the rare case it
+                       is reached, the rest of the step is moved without collisions and overlaps are pushed apart
+    :return: arrays "first", "second" of the circles of every collision between circles (in the order they
+             happened, the same pair can show up more than once), array of the circles that bounced off the wall
+             and the name of the broad phase used
+    '''
+    n = len(positions)
+    if max_events is None:
+        max_events = 100 * n + 100
+    # time each circle's position is at (circles are only moved when involved in an event)
+    times = np.zeros(n)
+    # collisions of each circle so far. predictions made with an older count are out of date
+    counts = np.zeros(n, dtype=np.int64)
+    limit = boundary - radii
+    queue = []
+    # tie breaker, so that events at the same time come out in the order they were predicted
+    sequence = 0
+
+    # pairs that can meet during the step: the circles' disks overlap
+    centers = positions.copy()
+    reach = radii + DISK_REACH * np.sqrt(vectors[:, 0] ** 2 + vectors[:, 1] ** 2) * duration
+    first, second, broad_phase_used = find_pairs(broad_phase, centers, reach, grid_size)
+    t, valid = _pair_times(positions[first] - positions[second], vectors[first] - vectors[second],
+                           radii[first] + radii[second], 0., duration)
+    for time, i, j in zip(t[valid].tolist(), first[valid].tolist(), second[valid].tolist()):
+        queue.append((time, sequence, i, j, 0, 0))
+        sequence += 1
+    t, valid = _wall_times(positions, vectors, limit, 0., duration)
+    for time, i in zip(t[valid].tolist(), np.nonzero(valid)[0].tolist()):
+        queue.append((time, sequence, i, -1, 0, -1))
+        sequence += 1
+    heapq.heapify(queue)
+
+    # neighbours of circle i: neighbours[starts[i]:starts[i + 1]] (the pairs found above, both ways), or redrawn[i]
+    # once its disk was redrawn. plus added[i]: circles whose redrawn disks reach circle i's. kept sorted, so that
+    # events at the same time come out in the same order whichever way the neighbours were found
+    both, others = np.concatenate((first, second)), np.concatenate((second, first))
+    order = np.lexsort((others, both))
+    neighbours = others[order]
+    starts = np.searchsorted(both[order], np.arange(n + 1))
+    redrawn, added = {}, {}
+
+    def neighbours_of(i, now):
+        # circle i just changed direction at time "now". gets a new disk first if it can leave its own before the end
+        distance = np.sqrt(((positions[i] - centers[i]) ** 2).sum())
+        way = np.sqrt(vectors[i, 0] ** 2 + vectors[i, 1] ** 2) * (duration - now)
+        if distance + way + radii[i] > reach[i] + OVERLAP_TOLERANCE:
+            centers[i] = positions[i]
+            reach[i] = radii[i] + DISK_REACH * way
+            difference = centers - centers[i]
+            close = difference[:, 0] ** 2 + difference[:, 1] ** 2 <= (reach + reach[i]) ** 2
+            close[i] = False
+            redrawn[i] = np.nonzero(close)[0]
+            added.pop(i, None)
+            for j in redrawn[i].tolist():
+                added.setdefault(j, []).append(i)
+        own = redrawn.get(i)
+        if own is None:
+            own = neighbours[starts[i]:starts[i + 1]]
+        return np.union1d(own, added[i]).astype(np.intp) if i in added else own
+
+    def predict(i, now):
+        # new events of circle i (which just changed direction at time "now"), with its neighbours and the wall
+        nonlocal sequence
+        others = neighbours_of(i, now)
+        current = positions[others] + vectors[others] * (now - times[others])[:, None]
+        t, valid = _pair_times(current - positions[i], vectors[others] - vectors[i], radii[others] + radii[i], now,
+                               duration)
+        for time, j in zip(t[valid].tolist(), others[valid].tolist()):
+            heapq.heappush(queue, (time, sequence, i, j, counts[i], counts[j]))
+            sequence += 1
+        t, valid = _wall_times(positions[i:i + 1], vectors[i:i + 1], limit[i:i + 1], now, duration)
+        if valid[0]:
+            heapq.heappush(queue, (t[0], sequence, i, -1, counts[i], -1))
+            sequence += 1
+
+    pair_events, wall_events = [], []
+    while queue and len(pair_events) + len(wall_events) < max_events:
+        time, _, i, j, count_i, count_j = heapq.heappop(queue)
+        if counts[i] != count_i or (j >= 0 and counts[j] != count_j):
+            continue
+
+        # move the circles involved up to the moment of the event
+        positions[i] += vectors[i] * (time - times[i])
+        times[i] = time
+        if j < 0:
+            # reflect vector over position vector
+            normal = positions[i] / np.sqrt(positions[i, 0] ** 2 + positions[i, 1] ** 2)
+            vectors[i] -= 2 * (vectors[i, 0] * normal[0] + vectors[i, 1] * normal[1]) * normal
+            wall_events.append(i)
+            counts[i] += 1
+            predict(i, time)
+            continue
+
+        positions[j] += vectors[j] * (time - times[j])
+        times[j] = time
+        delta = positions[i] - positions[j]
+        d = np.sqrt(delta[0] ** 2 + delta[1] ** 2)
+        if d > 0:
+            normal = delta / d
+            approach = (vectors[i, 0] - vectors[j, 0]) * normal[0] + (vectors[i, 1] - vectors[j, 1]) * normal[1]
+            p = 2 * approach / (weights[i] + weights[j])
+            vectors[i] -= p * weights[j] * normal
+            vectors[j] += p * weights[i] * normal
+        # energy lost once per collision
+        vectors[i] *= restitution[i]
+        vectors[j] *= restitution[j]
+        if d > 0 and restitution[i] != restitution[j]:
+            # scaled by different factors, the pair can still be coming closer and would collide again right away.
+            # it always separates at least at the lower restitution times the speed it came in at (pushed apart along
+            # the normal, momentum kept)
+            separation = (vectors[i, 0] - vectors[j, 0]) * normal[0] + (vectors[i, 1] - vectors[j, 1]) * normal[1]
+            missing = -min(restitution[i], restitution[j]) * approach - separation
+            if missing > 0:
+                impulse = missing / (1 / weights[i] + 1 / weights[j])
+                vectors[i] += impulse / weights[i] * normal
+                vectors[j] -= impulse / weights[j] * normal
+        pair_events.append((i, j))
+        counts[i] += 1
+        counts[j] += 1
+        predict(i, time)
+        predict(j, time)
+
+    # move everyone to the end of the step
+    positions += vectors * (duration - times)[:, None]
+    _separate(positions, radii, boundary, broad_phase, grid_size)
+
+    pairs = np.array(pair_events, dtype=np.intp).reshape(-1, 2)
+    return pairs[:, 0], pairs[:, 1], np.array(wall_events, dtype=np.intp), broad_phase_used
+
+def unique_pairs(first, second):
+    '''
+    :param first: first circle of each collision (as returned by advance)
+    :param second: second circle of each collision
+    :return: arrays "first", "second" of every pair that collided, once (first < second, sorted by first then second)
+    '''
+    pairs = np.unique(np.stack((np.minimum(first, second), np.maximum(first, second)), axis=1), axis=0)
+    return pairs[:, 0], pairs[:, 1]
+
+def _separate(positions, radii, boundary, broad_phase, grid_size):
+    '''
+    pushes apart circles that overlap (each moves by half of the overlap, see broad_phase.overlap_push) and pulls
+    escaped circles back inside the boundary
+    '''
+    n = len(positions)
+    first, second, _ = find_pairs(broad_phase, positions, radii, grid_size)
+    difference = positions[second] - positions[first]
+    min_distance = radii[first] + radii[second]
+    overlapping = min_distance - np.sqrt(difference[:, 0] ** 2 + difference[:, 1] ** 2) > OVERLAP_TOLERANCE
+    if np.any(overlapping):
+        first, second = first[overlapping], second[overlapping]
+        difference = overlap_push(difference[overlapping], min_distance[overlapping])
+        for axis in range(2):
+            positions[:, axis] -= np.bincount(first, difference[:, axis], minlength=n)
+            positions[:, axis] += np.bincount(second, difference[:, axis], minlength=n)
+
+    cur_distance = np.sqrt(positions[:, 0] ** 2 + positions[:, 1] ** 2)
+    max_distance = boundary - radii
+    escaped = cur_distance > max_distance + OVERLAP_TOLERANCE
+    positions[escaped] *= (max_distance[escaped] / cur_distance[escaped])[:, None]
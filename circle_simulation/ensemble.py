@@ -0,0 +1,202 @@
+'''
+Ensembles: the same scene simulated headless over a grid of parameters (seeds, damping, weights, speeds...) in a pool
+of worker processes, to collect statistics.
+
+A scene is a function taking the parameters of one run as keyword arguments and returning a simbox (random_scene below,
+or any module level function, so the worker processes can import it). Every run simulates "frames" frames and sends
+back a summary: total collisions, distance traveled, and the kinetic energy of the scene every "sample_every" frames.
+Summaries come back as soon as their run finishes. With a cache directory, each summary is also saved there under a
+hash of the run's configuration (scene, parameters, frames, sample_every), and runs already in the cache are not
+simulated again.
+
+Usage:
+    for summary in run_ensemble(random_scene, parameter_grid(seed=range(20), damping=[0, 0.1]), frames=300,
+                                cache_dir=".ensemble_cache"):
+        print(summary['params'], summary['collisions'])
+
+    python -m circle_simulation.ensemble --grid seed=0:20 damping=0,0.1 speed=1,2 --frames 300 --out runs.jsonl
+'''
+import hashlib
+import itertools
+import json
+import os
+import time
+import numpy as np
+
+def random_scene(amount=100, radius=100, circle_radius=2, speed=1, weight=1, damping=0, seed=0, engine='vector',
+                 steps_per_frame=1):
+    '''
+    circles of one size spread uniformly over the simbox, all moving at "speed" in random directions
+    :param amount: number of circles
+    :param radius: radius of the simbox
+    :param circle_radius: radius of every circle
+    :param speed: initial speed of every circle
+    :param weight: weight of every circle
+    :param damping: damping co-efficient of every circle
+    :param seed: seed of the positions and directions
+    :param engine: 'base' (BaseSimbox) or 'vector' (VectorSimbox)
+    :param steps_per_frame: sub-steps per frame
+    :return: the simbox
+    '''
+    from circle_simulation.base_simulation import BaseSimbox
+    from circle_simulation.vector_simulation import VectorSimbox
+    from circle_simulation.extras import uniform_in_disk, random_vectors
+    rng = np.random.default_rng(seed)
+    sim = {'base': BaseSimbox, 'vector': VectorSimbox}[engine](radius=radius, boundary_color=(255, 255, 255),
+                                                                boundary_thickness=1,
+                                                                steps_per_frame=steps_per_frame)
+    sim.add_circles(uniform_in_disk(amount, radius - circle_radius, rng), circle_radius,
+                    vectors=random_vectors(amount, speed, rng), weights=weight, damping=damping)
+    return sim
+
+def parameter_grid(**axes):
+    '''
+    :param axes: values of each parameter, e.g. seed=range(10), damping=[0, 0.1]
+    :return: list of the parameters of every run: every combination of the values of all axes
+    '''
+    names = list(axes)
+    return [dict(zip(names, values)) for values in itertools.product(*(list(axes[name]) for name in names))]
+
+def config_key(scene, params, frames, sample_every):
+    '''
+    :return: hash identifying a run (the name of its cache file)
+    '''
+    config = {'scene': f"{scene.__module__}:{scene.__qualname__}", 'params': params, 'frames': frames,
+              'sample_every': sample_every}
+    return hashlib.sha256(json.dumps(config, sort_keys=True, default=str).encode()).hexdigest()[:24]
+
+def _kinetic_energy(sim):
+    vectors = sim.get_vectors()
+    return float(0.5 * np.sum(sim.get_weights() * (vectors[:, 0] ** 2 + vectors[:, 1] ** 2)))
+
+def run_one(scene, params, frames, sample_every=1):
+    '''
+    simulates one run (in the calling process)
+    :param scene: scene function
+    :param params: keyword arguments of the scene
+    :param frames: frames to simulate
+    :param sample_every: the energy is sampled every "sample_every" frames
+    :return: summary of the run (dict, json serializable)
+    '''
+    start = time.perf_counter()
+    sim = scene(**params)
+    energy = [_kinetic_energy(sim)]
+    for frame in range(1, frames + 1):
+        sim.simulate_frame()
+        if not frame % sample_every:
+            energy.append(_kinetic_energy(sim))
+    distances = sim.get_distances()
+    return {'key': config_key(scene, params, frames, sample_every), 'params': params, 'frames': frames,
+            'circles': len(sim.circles), 'collisions': int(sim.number_of_collisions),
+            'distance_traveled': float(distances.sum()),
+            'mean_distance_traveled': float(distances.mean()) if len(distances) else 0.,
+            'sample_every': sample_every, 'energy': energy, 'seconds': time.perf_counter() - start}
+
+def _load_cached(cache_dir, key):
+    path = os.path.join(cache_dir, f"{key}.json")
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+def _save_cached(cache_dir, summary):
+    # written next to its place first, so an interrupted run never leaves half a summary behind
+    path = os.path.join(cache_dir, f"{summary['key']}.json")
+    with open(f"{path}.tmp", 'w') as f:
+        json.dump(summary, f)
+    os.replace(f"{path}.tmp", path)
+
+def run_ensemble(scene, grid, frames, workers=None, cache_dir=None, sample_every=1):
+    '''
+    runs "scene" once per entry of "grid", in a pool of worker processes
+    :param scene: module level function taking the parameters of a run and returning a simbox (see random_scene)
+    :param grid: list of parameter dicts, one per run (see parameter_grid)
+    :param frames: frames simulated by each run
+    :param workers: amount of worker processes (None: one per cpu, 0: run everything in this process)
+    :param cache_dir: directory of finished runs. runs found there are not simulated again. None caches nothing
+    :param sample_every: the energy is sampled every "sample_every" frames
+    :return: generator of the summaries of the runs (see run_one), cached ones first, then in the order the runs
+             finish. summaries read from the cache have "cached" set to True
+    '''
+    if cache_dir is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+    pending = []
+    for params in grid:
+        cached = _load_cached(cache_dir, config_key(scene, params, frames, sample_every)) if cache_dir else None
+        if cached is not None:
+            cached['cached'] = True
+            yield cached
+        else:
+            pending.append(params)
+
+    def finished(summary):
+        summary['cached'] = False
+        if cache_dir is not None:
+            _save_cached(cache_dir, summary)
+        return summary
+
+    if workers == 0:
+        for params in pending:
+            yield finished(run_one(scene, params, frames, sample_every))
+        return
+
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(run_one, scene, params, frames, sample_every) for params in pending]
+        try:
+            for future in as_completed(futures):
+                yield finished(future.result())
+        finally:
+            # stopped early (an error, or the caller stopped iterating): don't start the runs left
+            for future in futures:
+                future.cancel()
+
+def _parse_axis(text):
+    # "name=0:10" (range of ints) or "name=a,b,c" (json values, plain strings otherwise)
+    name, _, values = text.partition('=')
+    if ':' in values:
+        start, stop = values.split(':')
+        return name, list(range(int(start), int(stop)))
+    parsed = []
+    for value in values.split(','):
+        try:
+            parsed.append(json.loads(value))
+        except ValueError:
+            parsed.append(value)
+    return name, parsed
+
+def main(args=None):
+    import argparse, importlib
+    parser = argparse.ArgumentParser(description="runs a scene over a grid of parameters in worker processes")
+    parser.add_argument('--scene', default='circle_simulation.ensemble:random_scene',
+                        help="module:function returning the simbox of a run (default: random_scene)")
+    parser.add_argument('--grid', nargs='+', default=['seed=0:4'],
+                        help="parameter axes, e.g. seed=0:20 damping=0,0.1 engine=vector")
+    parser.add_argument('--frames', type=int, default=100)
+    parser.add_argument('--sample-every', type=int, default=1, help="frames between two energy samples")
+    parser.add_argument('--workers', type=int, default=None, help="worker processes (default: one per cpu)")
+    parser.add_argument('--cache', default='.ensemble_cache', help="cache directory ('' for none)")
+    parser.add_argument('--out', help="file to write every summary to (one json per line)")
+    args = parser.parse_args(args)
+
+    module, _, function = args.scene.partition(':')
+    scene = getattr(importlib.import_module(module), function)
+    grid = parameter_grid(**dict(_parse_axis(axis) for axis in args.grid))
+    out = open(args.out, 'w') if args.out else None
+    try:
+        for done, summary in enumerate(run_ensemble(scene, grid, args.frames, args.workers, args.cache or None,
+                                                    args.sample_every), start=1):
+            source = 'cached' if summary['cached'] else f"{summary['seconds']:.2f}s"
+            print(f"[{done}/{len(grid)}] {summary['params']}: {summary['collisions']} collisions, "
+                  f"distance {summary['distance_traveled']:.1f}, energy {summary['energy'][0]:.4g} -> "
+                  f"{summary['energy'][-1]:.4g} ({source})")
+            if out is not None:
+                out.write(json.dumps(summary) + '\n')
+    finally:
+        if out is not None:
+            out.close()
+    return 0
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(main())
@@ -3,4 +3,153 @@ def random_vectors_in_circle(amount, radius):
     angles = [random.random() * 6.28 for _ in range(amount)]
     mag = [radius * (random.random() ** 0.5) for _ in range(amount)]
     positions = [np.array([mag[i] * np.cos(angles[i]), mag[i] * np.sin(angles[i])]) for i in range(amount)]
-    return positions
\ No newline at end of file
+    return positions
+
+# seeded generators for large scenes. each returns a numpy array for BaseSimbox.add_circles (or the amount / positions
+# arguments of the simboxes) and takes "seed": an int, a numpy.random.Generator, or None for a fresh random one
+def uniform_in_disk(amount, radius, seed=None):
+    '''
+    :param amount: number of points
+    :param radius: radius of the disk (pass simbox.radius - circle radius to keep the circles inside)
+    :param seed: int, numpy.random.Generator or None
+    :return: (amount, 2) array of points spread uniformly over the disk
+    '''
+    import numpy as np
+    rng = np.random.default_rng(seed)
+    angles = rng.random(amount) * 2 * np.pi
+    mag = radius * rng.random(amount) ** 0.5
+    return np.stack((mag * np.cos(angles), mag * np.sin(angles)), axis=1)
+
+def random_vectors(amount, speed, seed=None):
+    '''
+    :param amount: number of vectors
+    :param speed: length of the vectors (one for all, or one per vector)
+    :param seed: int, numpy.random.Generator or None
+    :return: (amount, 2) array of movement vectors pointing in uniformly random directions
+    '''
+    import numpy as np
+    angles = np.random.default_rng(seed).random(amount) * 2 * np.pi
+    return np.asarray(speed, dtype=np.float64).reshape(-1, 1) * np.stack((np.cos(angles), np.sin(angles)), axis=1)
+
+def spiral(amount, radius, start=10, stop=None):
+    '''
+    points along an archimedean spiral, like spiral_sim of Examples.py (which is spiral(140, 100))
+    :param amount: number of points
+    :param radius: distance of the outer end of the spiral from the center
+    :param start: angle (radians) the spiral starts at
+    :param stop: angle it ends at (amount * 0.3 by default)
+    :return: (amount, 2) array of points, and (amount,) array of their angles (the angles of Examples.py)
+    '''
+    import numpy as np
+    stop = amount * 0.3 if stop is None else stop
+    angles = np.linspace(start=start, stop=stop, num=amount)
+    scale = radius / stop
+    return np.stack((scale * angles * np.cos(angles), scale * angles * np.sin(angles)), axis=1), angles
+
+def lattice(amount, radius, spacing=None, kind='hex', jitter=0., seed=None):
+    '''
+    :param amount: number of points
+    :param radius: radius of the disk the points are taken from
+    :param spacing: distance between neighboring points. None spreads them over the whole disk
+    :param kind: 'hex' (hexagonal lattice) or 'square'
+    :param jitter: points are moved randomly by up to jitter * spacing on each axis
+    :param seed: int, numpy.random.Generator or None (only used with jitter)
+    :return: (amount, 2) array of the lattice points closest to the center
+    '''
+    import numpy as np
+    if kind not in ('hex', 'square'):
+        raise ValueError(f"unknown lattice {kind!r}, pick 'hex' or 'square'")
+    # area taken by each point of the lattice, relative to spacing ** 2
+    cell_area = np.sqrt(3) / 2 if kind == 'hex' else 1.
+    if spacing is None:
+        # a little tighter than the disk's area would allow, the disk's edge cuts off some lattice cells
+        spacing = 0.95 * np.sqrt(np.pi * radius ** 2 / (max(amount, 1) * cell_area))
+    row_height = spacing * cell_area
+    rows = int(radius // row_height)
+    columns = int(radius // spacing) + 1
+    y, x = np.mgrid[-rows:rows + 1, -columns:columns + 1].astype(np.float64)
+    if kind == 'hex':
+        # every other row is shifted by half a spacing
+        x += (y % 2) / 2
+    points = np.stack((x.ravel() * spacing, y.ravel() * row_height), axis=1)
+    distances = np.sqrt(points[:, 0] ** 2 + points[:, 1] ** 2)
+    inside = np.nonzero(distances <= radius)[0]
+    if len(inside) < amount:
+        raise ValueError(f"only {len(inside)} points of spacing {spacing} fit into radius {radius}")
+    points = points[inside[np.argsort(distances[inside], kind='stable')[:amount]]]
+    if jitter:
+        points += np.random.default_rng(seed).uniform(-jitter, jitter, points.shape) * spacing
+    return points
+
+def poisson_disk(radius, min_distance, amount=None, seed=None, batch=None):
+    '''
+    random points no closer to each other than min_distance (so circles of radius min_distance / 2 placed on them
+    never overlap). candidates are drawn uniformly over the disk in batches and every candidate closer than
+    min_distance to a point placed before it (or drawn before it in the same batch) is dropped. neighbors are looked
+    up on a grid of cells small enough to hold one point each
+    :param radius: radius of the disk
+    :param min_distance: smallest distance between two points
+    :param amount: number of points. None fills the disk until candidates hardly ever fit anymore
+    :param seed: int, numpy.random.Generator or None
+    :param batch: candidates drawn at once (default: a quarter of amount, or of what fits into the disk)
+    :return: (amount, 2) array of points
+    '''
+    import numpy as np
+    rng = np.random.default_rng(seed)
+    cell = min_distance / np.sqrt(2)
+    # grid over the disk, padded by 2 cells on every side so the 5x5 neighborhood of a cell never leaves it.
+    # each cell holds the position of its point (nan if empty) and the number of the candidate in it within the
+    # current batch (-1 for points placed in earlier batches)
+    side = int(np.ceil(2 * radius / cell)) + 5
+    cell_points = np.full((side * side, 2), np.nan)
+    cell_numbers = np.full(side * side, -1, dtype=np.int64)
+    # no more points than circles of radius min_distance / 2 fit into the disk grown by that radius (by area)
+    limit = int(((radius + min_distance / 2) / (min_distance / 2)) ** 2)
+    if amount is not None and amount > limit:
+        raise ValueError(f"{amount} points at least {min_distance} apart don't fit into radius {radius}")
+    points = np.empty((limit if amount is None else amount, 2))
+    batch = batch or max(256, (amount or limit) // 4)
+    # the 24 neighboring cells that can hold a point within min_distance, nearest first
+    offsets = sorted(((dx, dy) for dx in range(-2, 3) for dy in range(-2, 3) if dx or dy),
+                     key=lambda offset: offset[0] ** 2 + offset[1] ** 2)
+    offsets = [dx * side + dy for dx, dy in offsets]
+    placed = 0
+    while amount is None or placed < amount:
+        candidates = uniform_in_disk(batch, radius, rng)
+        cells = np.floor((candidates + radius) / cell).astype(np.intp) + 2
+        cells = cells[:, 0] * side + cells[:, 1]
+        # one candidate per free cell (the first drawn)
+        free = np.nonzero(np.isnan(cell_points[cells, 0]))[0]
+        _, first = np.unique(cells[free], return_index=True)
+        keep = np.sort(free[first])
+        cells, candidates = cells[keep], candidates[keep]
+        number = np.arange(len(keep))
+        cell_points[cells] = candidates
+        cell_numbers[cells] = number
+
+        # drop candidates too close to points placed earlier, or to candidates of this batch drawn before them.
+        # (the nearest cells come first and rule out most candidates, only the ones still in question go on)
+        ok = np.ones(len(keep), dtype=bool)
+        active = number
+        for offset in offsets:
+            neighbors = cells[active] + offset
+            delta = candidates[active] - cell_points[neighbors]
+            with np.errstate(invalid='ignore'):
+                close = delta[:, 0] ** 2 + delta[:, 1] ** 2 < min_distance ** 2
+            close &= cell_numbers[neighbors] < active
+            ok[active[close]] = False
+            active = active[~close]
+        if amount is not None:
+            ok &= np.cumsum(ok) <= amount - placed
+        cell_points[cells[~ok]] = np.nan
+        cell_numbers[cells[ok]] = -1
+        kept = candidates[ok]
+        points[placed:placed + len(kept)] = kept
+        placed += len(kept)
+        # the disk is practically full once hardly any candidate fits
+        if len(kept) < batch / 500:
+            if amount is not None and placed < amount:
+                raise ValueError(f"only {placed} of {amount} points at least {min_distance} apart fit into "
+                                 f"radius {radius}")
+            break
+    return points[:placed]
@@ -0,0 +1,436 @@
+'''
+Force fields acting on the circles of a simbox (BaseSimbox.forces).
+
+At the start of every sub-step the accelerations of all fields are summed up for all circles at once and added onto
+the movement vectors (vector += acceleration / steps_per_frame), before collisions are handled. Units are those of
+the simulation: a vector is the distance moved per frame, an acceleration the change of the vector per frame.
+
+    UniformGravity - the same acceleration for every circle
+    Attractor      - pull towards (or push away from, with a negative strength) a fixed point
+    Gravity        - every circle attracts every other circle, proportionally to their weights
+    Electrostatics - every circle carries a charge, like charges repel and opposite charges attract
+
+Gravity and Electrostatics don't sum up every pair of circles (O(n^2)): they use the Barnes-Hut approximation
+(see barnes_hut), which is O(n log n). All fields are "softened": a distance d is taken as sqrt(d^2 + softening^2),
+so overlapping circles don't get infinite forces.
+'''
+import numpy as np
+from circle_simulation.broad_phase import _ragged_pairs
+
+# bits per axis of the quadtree cells (the tree is at most this deep)
+MAX_DEPTH = 16
+# amount of (body, node) and (body, body) interactions evaluated at once, bounds the memory used
+CHUNK_SIZE = 1 << 21
+# default opening angle of the Barnes-Hut approximation (see barnes_hut for what it costs in accuracy)
+THETA = 0.45
+
+def _spread_bits(x):
+    # inserts a zero bit before each of the lower 16 bits of x (half of a morton code)
+    x = (x | (x << 8)) & 0x00FF00FF
+    x = (x | (x << 4)) & 0x0F0F0F0F
+    x = (x | (x << 2)) & 0x33333333
+    return (x | (x << 1)) & 0x55555555
+
+def _pair_sums(function, array, starts, stops):
+    '''
+    :param function: ufunc to reduce with (np.add, np.minimum...)
+    :param array: array to reduce along its first axis
+    :param starts: first index of each run
+    :param stops: end of each run (runs must not be empty, and not overlap)
+    :return: reduction of array[start:stop] for each run
+    '''
+    padded = np.concatenate((array, array[:1]))
+    return function.reduceat(padded, np.stack((starts, stops), axis=1).ravel(), axis=0)[::2]
+
+class QuadTree:
+    '''
+    Quadtree over a set of bodies, built for all of them at once: the bodies are sorted along a Z-order curve, so
+    every node is a run of consecutive bodies. Nodes with at most "leaf_size" bodies are leaves.
+    Every node holds the sum of the sources (masses or charges) of its bodies and their center (weighted by the
+    absolute value of the sources)
+    '''
+    def __init__(self, positions, sources, leaf_size=4):
+        '''
+        :param positions: (n, 2) array of positions
+        :param sources: (n,) array of the masses or charges of the bodies
+        :param leaf_size: largest amount of bodies in a leaf (unless they all share the smallest cell)
+        '''
+        n = len(positions)
+        low = positions.min(axis=0)
+        side = float(np.ptp(positions, axis=0).max()) * (1 + 1e-9) or 1.
+        cells = np.minimum(((positions - low) / side * (1 << MAX_DEPTH)).astype(np.int64), (1 << MAX_DEPTH) - 1)
+        codes = _spread_bits(cells[:, 0]) | (_spread_bits(cells[:, 1]) << 1)
+        # bodies in Z-order. every node is a run [start, stop) of it
+        self.order = np.argsort(codes, kind='stable')
+        codes = codes[self.order]
+        self.positions = positions[self.order]
+        self.sources = sources[self.order]
+
+        # nodes, level by level. bodies of a leaf are done with, the rest is split up on the next level
+        active = np.ones(n, dtype=bool)
+        starts, stops, levels, leaves = [], [], [], []
+        for level in range(MAX_DEPTH + 1):
+            rows = np.nonzero(active)[0]
+            if not len(rows):
+                break
+            prefix = codes[rows] >> (2 * (MAX_DEPTH - level))
+            new = np.ones(len(rows), dtype=bool)
+            new[1:] = prefix[1:] != prefix[:-1]
+            first = np.nonzero(new)[0]
+            level_starts = rows[first]
+            level_stops = rows[np.append(first[1:], len(rows)) - 1] + 1
+            leaf = (level_stops - level_starts <= leaf_size) | (level == MAX_DEPTH)
+            starts.append(level_starts)
+            stops.append(level_stops)
+            levels.append(np.full(len(first), level))
+            leaves.append(leaf)
+            # bodies of the new leaves are no longer split up
+            change = np.zeros(n + 1, dtype=np.int64)
+            np.add.at(change, level_starts[leaf], 1)
+            np.add.at(change, level_stops[leaf], -1)
+            active &= np.cumsum(change)[:n] == 0
+
+        # children of every node: the run of nodes of the next level within its bodies
+        first_child, child_counts, offset = [], [], 0
+        for level in range(len(starts)):
+            offset += len(starts[level])
+            if level + 1 < len(starts):
+                below = starts[level + 1]
+                begin = np.searchsorted(below, starts[level])
+                end = np.searchsorted(below, stops[level])
+            else:
+                begin = end = np.zeros(len(starts[level]), dtype=np.intp)
+            first_child.append(begin + offset)
+            child_counts.append(np.where(leaves[level], 0, end - begin))
+        self.starts, self.stops = np.concatenate(starts), np.concatenate(stops)
+        self.levels, self.leaves = np.concatenate(levels), np.concatenate(leaves)
+        self.first_child, self.child_counts = np.concatenate(first_child), np.concatenate(child_counts)
+
+        # parent of every node (-1 for the root)
+        self.parents = np.full(len(self.starts), -1)
+        children = np.nonzero(self.child_counts)[0]
+        self.parents[_ragged_pairs(children, self.first_child[children], self.child_counts[children])[1]] = \
+            np.repeat(children, self.child_counts[children])
+
+        # sum and center of the sources of every node
+        self.totals = _pair_sums(np.add, self.sources, self.starts, self.stops)
+        strength = np.abs(self.sources)
+        weight = _pair_sums(np.add, strength, self.starts, self.stops)
+        centers = _pair_sums(np.add, self.positions * strength[:, None], self.starts, self.stops)
+        # bounding box of the bodies of every node. nodes without any source are centered on it (they don't pull on
+        # anything anyway)
+        low = _pair_sums(np.minimum, self.positions, self.starts, self.stops)
+        high = _pair_sums(np.maximum, self.positions, self.starts, self.stops)
+        self.middles = (low + high) / 2
+        self.centers = np.where(weight[:, None] > 0, centers / np.where(weight > 0, weight, 1)[:, None],
+                                self.middles)
+        # dipole and quadrupole moments of the sources of every node around its center: sums of source * offset and
+        # source * offset * offset (xx, xy, yy) over its bodies. (taken from sums around the middle of the tree, so
+        # that they stay precise far away from the origin)
+        offsets = self.positions - (positions.min(axis=0) + positions.max(axis=0)) / 2
+        first = _pair_sums(np.add, self.sources[:, None] * offsets, self.starts, self.stops)
+        second = _pair_sums(np.add, self.sources[:, None] * np.stack((offsets[:, 0] ** 2, offsets[:, 0] * offsets[:, 1],
+                                                                       offsets[:, 1] ** 2), axis=1),
+                            self.starts, self.stops)
+        center = self.centers - (positions.min(axis=0) + positions.max(axis=0)) / 2
+        self.dipoles = first - self.totals[:, None] * center
+        self.quadrupoles = np.stack((second[:, 0] - 2 * center[:, 0] * first[:, 0],
+                                     second[:, 1] - center[:, 0] * first[:, 1] - center[:, 1] * first[:, 0],
+                                     second[:, 2] - 2 * center[:, 1] * first[:, 1]), axis=1) \
+            + self.totals[:, None] * np.stack((center[:, 0] ** 2, center[:, 0] * center[:, 1], center[:, 1] ** 2), axis=1)
+        # distance from the middle (and from the center) of every node to the furthest corner of its box
+        self.extents = np.sqrt(((high - low) ** 2).sum(axis=1)) / 2
+        corner = np.maximum(high - self.centers, self.centers - low)
+        self.center_extents = np.sqrt((corner ** 2).sum(axis=1))
+
+def _field(difference, strength, squared_softening):
+    '''
+    :param difference: (m, 2) position of each source relative to where the field is taken
+    :param strength: (m,) source of each
+    :return: (m, 2) field strength * difference / r^3 (r^2 = |difference|^2 + softening^2)
+    '''
+    squared = difference[:, 0] ** 2 + difference[:, 1] ** 2 + squared_softening
+    inverse = np.zeros_like(squared)
+    np.divide(1, squared, out=inverse, where=squared > 0)
+    return difference * (strength * inverse * np.sqrt(inverse))[:, None]
+
+def _far_field(difference, totals, dipoles, quadrupoles, squared_softening):
+    '''
+    second order expansion of the field of far nodes: the field of each node is taken from its sources, dipole and
+    quadrupole moment, and expanded around where it is taken up to its second derivatives
+    :param difference: (m, 2) center of each node relative to where the field is taken
+    :param totals: (m,) sum of the sources of each node
+    :param dipoles: (m, 2) dipole moment of each node around its center (see QuadTree)
+    :param quadrupoles: (m, 3) quadrupole moment xx, xy, yy of each node around its center
+    :return: (m, 2) field, (m, 3) its derivatives xx, xy, yy and (m, 4) its second derivatives xxx, xxy, xyy, yyy by
+             the position the field is taken at
+    '''
+    x, y = difference[:, 0], difference[:, 1]
+    squared = x ** 2 + y ** 2 + squared_softening
+    inverse = np.zeros_like(squared)
+    np.divide(1, squared, out=inverse, where=squared > 0)
+    # derivatives of 1 / r by the difference, first to third order
+    a = inverse * np.sqrt(inverse)
+    b = 3 * a * inverse
+    c = 5 * b * inverse
+    first = (-x * a, -y * a)
+    second = (x * x * b - a, x * y * b, y * y * b - a)
+    third = (3 * x * b - x ** 3 * c, y * b - x * x * y * c, x * b - x * y * y * c, 3 * y * b - y ** 3 * c)
+    dx, dy = dipoles[:, 0], dipoles[:, 1]
+    qxx, qxy, qyy = quadrupoles[:, 0], quadrupoles[:, 1], quadrupoles[:, 2]
+    field = np.stack((-(totals * first[0] + dx * second[0] + dy * second[1]
+                        + (qxx * third[0] + 2 * qxy * third[1] + qyy * third[2]) / 2),
+                      -(totals * first[1] + dx * second[1] + dy * second[2]
+                        + (qxx * third[1] + 2 * qxy * third[2] + qyy * third[3]) / 2)), axis=1)
+    gradient = np.stack((totals * second[0] + dx * third[0] + dy * third[1],
+                         totals * second[1] + dx * third[1] + dy * third[2],
+                         totals * second[2] + dx * third[2] + dy * third[3]), axis=1)
+    curvature = -totals[:, None] * np.stack(third, axis=1)
+    return field, gradient, curvature
+
+def _expand(field, gradient, curvature, shift):
+    '''
+    :param field: (m, 2) field at the points expanded around
+    :param gradient: (m, 3) its derivatives xx, xy, yy
+    :param curvature: (m, 4) its second derivatives xxx, xxy, xyy, yyy
+    :param shift: (m, 2) offset to move each expansion by
+    :return: field and gradient at the shifted points
+    '''
+    sx, sy = shift[:, 0], shift[:, 1]
+    hxxx, hxxy, hxyy, hyyy = curvature[:, 0], curvature[:, 1], curvature[:, 2], curvature[:, 3]
+    moved_gradient = np.stack((gradient[:, 0] + hxxx * sx + hxxy * sy, gradient[:, 1] + hxxy * sx + hxyy * sy,
+                               gradient[:, 2] + hxyy * sx + hyyy * sy), axis=1)
+    moved_field = np.stack((field[:, 0] + gradient[:, 0] * sx + gradient[:, 1] * sy
+                            + (hxxx * sx * sx + 2 * hxxy * sx * sy + hxyy * sy * sy) / 2,
+                            field[:, 1] + gradient[:, 1] * sx + gradient[:, 2] * sy
+                            + (hxxy * sx * sx + 2 * hxyy * sx * sy + hyyy * sy * sy) / 2), axis=1)
+    return moved_field, moved_gradient
+
+def barnes_hut(positions, sources, theta=THETA, softening=1., leaf_size=4):
+    '''
+    field of point sources at every body: sum over the other bodies j of sources[j] * (x_j - x) / (|x_j - x|^2 +
+    softening^2)^(3/2), approximated with a Barnes-Hut quadtree.
+    The tree is walked for pairs of nodes: a source node far enough from a target node (both their extents together
+    less than theta times their distance) counts as a single source at its center with a dipole and quadrupole
+    moment, and its field is added to the target node as a second order expansion (field and its first and second
+    derivatives at the middle of the node). The expansions are then passed down the tree to the bodies. Bodies of
+    leaves close to each other are summed up exactly (see exact_field).
+    The error shrinks with theta^3. Mean (max) error of the field of 2000 bodies spread out normally, relative to the
+    median field:
+        theta   masses          charges (+1 and -1)
+        0.2     0.08% (0.5%)    0.09% (1.3%)
+        0.3     0.3% (2.6%)     0.4% (5%)
+        0.45    1.2% (9%)       1.8% (27%)
+        0.7     5% (39%)        7% (62%)
+        1.0     16% (135%)      24% (208%)
+    :param positions: (n, 2) array of positions
+    :param sources: (n,) array of masses (or charges)
+    :param theta: opening angle. smaller is more accurate and slower, 0 sums up every pair exactly
+    :param softening: distance added to every distance (see the top of this module)
+    :param leaf_size: largest amount of bodies in a leaf of the tree
+    :return: (n, 2) array of the field at every body
+    '''
+    n = len(positions)
+    field = np.zeros((n, 2))
+    if n < 2:
+        return field
+    tree = QuadTree(positions, sources, leaf_size)
+    squared_softening = softening ** 2
+
+    # walk the tree for pairs of nodes, starting with the root and itself. pairs not far enough apart open the
+    # larger of the two nodes (unless it's a leaf), pairs of leaves are summed up body by body
+    targets, nodes = np.zeros(1, dtype=np.intp), np.zeros(1, dtype=np.intp)
+    far, near = [], []
+    while len(targets):
+        difference = tree.centers[nodes] - tree.middles[targets]
+        distance = np.sqrt(difference[:, 0] ** 2 + difference[:, 1] ** 2)
+        accept = tree.extents[targets] + tree.center_extents[nodes] < theta * distance
+        far.append((targets[accept], nodes[accept]))
+        target_leaf, node_leaf = tree.leaves[targets], tree.leaves[nodes]
+        leaves = ~accept & target_leaf & node_leaf
+        near.append((targets[leaves], nodes[leaves]))
+        opened = ~accept & ~leaves
+        open_target = opened & ~target_leaf & (node_leaf | (tree.extents[targets] >= tree.extents[nodes]))
+        open_node = opened & ~open_target
+        repeated_nodes, new_targets = _ragged_pairs(nodes[open_target], tree.first_child[targets[open_target]],
+                                                    tree.child_counts[targets[open_target]])
+        repeated_targets, new_nodes = _ragged_pairs(targets[open_node], tree.first_child[nodes[open_node]],
+                                                    tree.child_counts[nodes[open_node]])
+        targets = np.concatenate((new_targets, repeated_targets))
+        nodes = np.concatenate((repeated_nodes, new_nodes))
+    far_targets, far_nodes = (np.concatenate(arrays) for arrays in zip(*far))
+    near_targets, near_nodes = (np.concatenate(arrays) for arrays in zip(*near))
+
+    # expansions of the far sources around the middle of every target node
+    m = len(tree.starts)
+    local_field, local_gradient, local_curvature = np.zeros((m, 2)), np.zeros((m, 3)), np.zeros((m, 4))
+    for start in range(0, len(far_targets), CHUNK_SIZE):
+        targets, nodes = far_targets[start:start + CHUNK_SIZE], far_nodes[start:start + CHUNK_SIZE]
+        parts = _far_field(tree.centers[nodes] - tree.middles[targets], tree.totals[nodes], tree.dipoles[nodes],
+                           tree.quadrupoles[nodes], squared_softening)
+        for local, part in zip((local_field, local_gradient, local_curvature), parts):
+            for component in range(part.shape[1]):
+                local[:, component] += np.bincount(targets, part[:, component], minlength=m)
+
+    # pass the expansions down to the children (nodes come level by level, parents first)
+    for level in range(1, int(tree.levels.max()) + 1):
+        nodes = np.nonzero(tree.levels == level)[0]
+        parents = tree.parents[nodes]
+        moved_field, moved_gradient = _expand(local_field[parents], local_gradient[parents], local_curvature[parents],
+                                              tree.middles[nodes] - tree.middles[parents])
+        local_field[nodes] += moved_field
+        local_gradient[nodes] += moved_gradient
+        local_curvature[nodes] += local_curvature[parents]
+
+    # ... and from the leaves to their bodies
+    leaves = np.nonzero(tree.leaves)[0]
+    counts = tree.stops[leaves] - tree.starts[leaves]
+    leaf_of, bodies = _ragged_pairs(leaves, tree.starts[leaves], counts)
+    sorted_field = np.zeros((n, 2))
+    sorted_field[bodies] = _expand(local_field[leaf_of], local_gradient[leaf_of], local_curvature[leaf_of],
+                                   tree.positions[bodies] - tree.middles[leaf_of])[0]
+
+    # leaves close to each other, body by body. pairs of leaves are expanded into pairs of bodies in chunks
+    sizes = tree.stops - tree.starts
+    ends = np.cumsum(sizes[near_targets] * sizes[near_nodes])
+    total = int(ends[-1]) if len(ends) else 0
+    # chunks of about CHUNK_SIZE pairs of bodies (at least one pair of leaves each)
+    stops = np.searchsorted(ends, np.arange(CHUNK_SIZE, total + CHUNK_SIZE, CHUNK_SIZE), side='right')
+    start = 0
+    for stop in np.unique(np.append(np.maximum(stops, 1), len(near_targets))).tolist():
+        targets, nodes = near_targets[start:stop], near_nodes[start:stop]
+        start = stop
+        pair, body = _ragged_pairs(np.arange(len(targets)), tree.starts[targets], sizes[targets])
+        body, other = _ragged_pairs(body, tree.starts[nodes[pair]], sizes[nodes[pair]])
+        part_field = _field(tree.positions[other] - tree.positions[body], tree.sources[other], squared_softening)
+        for axis in range(2):
+            sorted_field[:, axis] += np.bincount(body, part_field[:, axis], minlength=n)
+
+    field[tree.order] = sorted_field
+    return field
+
+def exact_field(positions, sources, softening=1.):
+    '''
+    the field barnes_hut approximates, summed up over every pair of bodies (O(n^2), to check the approximation)
+    (parameters and return see barnes_hut)
+    '''
+    n = len(positions)
+    field = np.zeros((n, 2))
+    rows = max(1, CHUNK_SIZE // max(n, 1))
+    for start in range(0, n, rows):
+        body, other = np.divmod(np.arange(start * n, min(start + rows, n) * n), n)
+        part = _field(positions[other] - positions[body], sources[other], softening ** 2)
+        for axis in range(2):
+            field[start:start + rows, axis] = np.bincount(body - start, part[:, axis], minlength=min(rows, n - start))
+    return field
+
+class UniformGravity:
+    def __init__(self, acceleration=(0, -0.1)):
+        '''
+        :param acceleration: acceleration of every circle (x, y). the default pulls down
+        '''
+        self.acceleration = np.asarray(acceleration, dtype=np.float64)
+
+    def accelerations(self, positions, weights, ids):
+        '''
+        :param positions: (n, 2) array of the positions of the circles
+        :param weights: (n,) array of their weights
+        :param ids: (n,) array of their ids (BaseSimbox.get_ids)
+        :return: (n, 2) array of the acceleration of every circle
+        '''
+        return np.broadcast_to(self.acceleration, positions.shape)
+
+class Attractor:
+    def __init__(self, position=(0, 0), strength=1., softening=1.):
+        '''
+        :param position: point the circles are pulled towards
+        :param strength: acceleration at a distance of 1 (falls off with the square of the distance). negative
+                         strengths push the circles away
+        :param softening: see the top of this module
+        '''
+        self.position = np.asarray(position, dtype=np.float64)
+        self.strength = strength
+        self.softening = softening
+
+    def accelerations(self, positions, weights, ids):
+        difference = self.position - positions
+        squared = difference[:, 0] ** 2 + difference[:, 1] ** 2 + self.softening ** 2
+        factor = np.zeros_like(squared)
+        np.divide(self.strength, squared * np.sqrt(squared), out=factor, where=squared > 0)
+        return difference * factor[:, None]
+
+class Gravity:
+    def __init__(self, constant=1., theta=THETA, softening=1., leaf_size=4):
+        '''
+        every circle pulls on every other circle with constant * weight / distance^2
+        :param constant: gravitational constant
+        :param theta: opening angle of the Barnes-Hut approximation (see barnes_hut)
+        :param softening: see the top of this module
+        :param leaf_size: see barnes_hut
+        '''
+        self.constant = constant
+        self.theta = theta
+        self.softening = softening
+        self.leaf_size = leaf_size
+
+    def accelerations(self, positions, weights, ids):
+        return self.constant * barnes_hut(positions, weights, self.theta, self.softening, self.leaf_size)
+
+class Electrostatics:
+    def __init__(self, charges, constant=1., theta=THETA, softening=1., leaf_size=4):
+        '''
+        every circle pushes on every other circle with constant * charge * other charge / distance^2 (pulls, for
+        opposite charges). heavier circles get accelerated less
+        :param charges: charges of the circles by id: a dict {circle id: charge}, or an (n,) array of the charges of
+                        the circles with ids 0 to n-1 (the circles a simbox starts with, in order). charges stay with
+                        their circles when others are removed, circles added later get theirs with set_charges
+        :param constant: Coulomb constant
+        (theta, softening and leaf_size see Gravity)
+        '''
+        # charge of every circle id, nan for ids without one
+        self.charges = np.zeros(0)
+        if isinstance(charges, dict):
+            self.set_charges(list(charges.keys()), list(charges.values()))
+        else:
+            charges = np.asarray(charges, dtype=np.float64)
+            self.set_charges(np.arange(len(charges)), charges)
+        self.constant = constant
+        self.theta = theta
+        self.softening = softening
+        self.leaf_size = leaf_size
+
+    def set_charges(self, circle_ids, charges):
+        '''
+        :param circle_ids: ids of circles (as returned by add_circles)
+        :param charges: their charges (or one charge for all of them)
+        :return: None
+        '''
+        circle_ids = np.asarray(circle_ids, dtype=np.int64).reshape(-1)
+        if len(circle_ids) and circle_ids.max() >= len(self.charges):
+            grown = np.full(max(circle_ids.max() + 1, 2 * len(self.charges)), np.nan)
+            grown[:len(self.charges)] = self.charges
+            self.charges = grown
+        self.charges[circle_ids] = charges
+
+    def accelerations(self, positions, weights, ids):
+        known = ids < len(self.charges)
+        charges = np.full(len(ids), np.nan)
+        charges[known] = self.charges[ids[known]]
+        if np.any(np.isnan(charges)):
+            missing = ids[np.isnan(charges)][0]
+            raise ValueError(f"no charge for the circle with id {missing} (see Electrostatics.set_charges)")
+        field = barnes_hut(positions, charges, self.theta, self.softening, self.leaf_size)
+        return -(self.constant * charges / weights)[:, None] * field
+
+def accelerations(forces, positions, weights, ids):
+    '''
+    :param forces: force fields (objects with an accelerations(positions, weights, ids) method)
+    :param positions: (n, 2) array of the positions of the circles
+    :param weights: (n,) array of their weights
+    :param ids: (n,) array of their ids
+    :return: (n, 2) array of the sum of the accelerations of all fields
+    '''
+    total = np.zeros((len(positions), 2))
+    for force in forces:
+        total += force.accelerations(positions, weights, ids)
+    return total
@@ -0,0 +1,353 @@
+'''
+Lossless concatenation of mp4 files holding a single video track encoded the same way (same codec, size and settings,
+e.g. the segments SimExporter writes with cv2.VideoWriter). Nothing is decoded or encoded again: the samples (encoded
+frames) of every file are copied one after the other into a new mdat box, and the sample tables of the track are joined
+into a new moov box. Every segment has to start with a key frame, which is how cv2.VideoWriter starts every file.
+
+Only the boxes the joined file needs are read (see the ISO base media file format, ISO/IEC 14496-12):
+    moov/mvhd                  movie timescale and duration
+    moov/trak/tkhd, edts/elst  track duration
+    moov/trak/mdia/mdhd        media timescale and duration
+    .../stbl/stsd              sample description (codec settings), has to be the same in every file
+    .../stbl/stts, ctts        sample durations and composition offsets
+    .../stbl/stss              key frames
+    .../stbl/stsc, stsz        samples per chunk, sample sizes
+    .../stbl/stco or co64      chunk offsets
+Everything else is copied from the first file.
+'''
+import struct
+import numpy as np
+
+# boxes holding nothing but other boxes
+CONTAINERS = {b'moov', b'trak', b'mdia', b'minf', b'stbl', b'edts', b'dinf'}
+# boxes in the sample table rebuilt for the joined file
+TABLES = (b'stts', b'ctts', b'stss', b'stsc', b'stsz', b'stco', b'co64')
+
+def read_boxes(data, start=0, end=None):
+    '''
+    :param data: bytes of a file (or of a box)
+    :param start: offset of the first box
+    :param end: offset the boxes end at (end of data by default)
+    :return: list of (type, offset of the payload, end of the box)
+    '''
+    end = len(data) if end is None else end
+    boxes = []
+    position = start
+    while position + 8 <= end:
+        size, kind = struct.unpack('>I4s', data[position:position + 8])
+        header = 8
+        if size == 1:
+            size = struct.unpack('>Q', data[position + 8:position + 16])[0]
+            header = 16
+        elif size == 0:
+            # box reaching to the end of the file
+            size = end - position
+        if size < header or position + size > end:
+            raise ValueError(f"broken box {kind!r} at byte {position}")
+        boxes.append((kind, position + header, position + size))
+        position += size
+    return boxes
+
+def _find(boxes, kind):
+    found = [box for box in boxes if box[0] == kind]
+    if len(found) != 1:
+        raise ValueError(f"expected one {kind.decode()} box, found {len(found)}")
+    return found[0]
+
+def _box(kind, payload):
+    if len(payload) + 8 < 2 ** 32:
+        return struct.pack('>I4s', len(payload) + 8, kind) + payload
+    return struct.pack('>I4sQ', 1, kind, len(payload) + 16) + payload
+
+def _full_box(kind, version, payload):
+    return _box(kind, struct.pack('>I', version << 24) + payload)
+
+def _entries(data, start, fields):
+    '''
+    :return: (entries, fields) array of the table of the full box whose payload starts at "start"
+    '''
+    count = struct.unpack('>I', data[start + 4:start + 8])[0]
+    return np.frombuffer(data, dtype='>u4', count=count * fields, offset=start + 8).reshape(count, fields)
+
+class _Track:
+    '''
+    the sample table of the single video track of an mp4 file
+    '''
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            data = f.read()
+        self.path = path
+        self.data = data
+        top = read_boxes(data)
+        self.ftyp = _find(top, b'ftyp')
+        self.moov = _find(top, b'moov')
+        tracks = [box for box in read_boxes(data, *self.moov[1:]) if box[0] == b'trak']
+        if len(tracks) != 1:
+            raise ValueError(f"{path} has {len(tracks)} tracks, only files with a single (video) track can be joined")
+        self.trak = tracks[0]
+        mdia = _find(read_boxes(data, *self.trak[1:]), b'mdia')
+        mdhd = _find(read_boxes(data, *mdia[1:]), b'mdhd')
+        self.timescale = self._timescale(mdhd)
+        minf = _find(read_boxes(data, *mdia[1:]), b'minf')
+        stbl = _find(read_boxes(data, *minf[1:]), b'stbl')
+        boxes = {box[0]: box for box in read_boxes(data, *stbl[1:])}
+        self.stsd = data[boxes[b'stsd'][1]:boxes[b'stsd'][2]]
+
+        # size of every sample
+        stsz = boxes[b'stsz'][1]
+        fixed, count = struct.unpack('>II', data[stsz + 4:stsz + 12])
+        if fixed:
+            self.sizes = np.full(count, fixed, dtype=np.int64)
+        else:
+            self.sizes = np.frombuffer(data, dtype='>u4', count=count, offset=stsz + 12).astype(np.int64)
+        # duration of every sample, and its composition offset
+        stts = _entries(data, boxes[b'stts'][1], 2).astype(np.int64)
+        self.durations = np.repeat(stts[:, 1], stts[:, 0])
+        self.offsets = None
+        if b'ctts' in boxes:
+            ctts = _entries(data, boxes[b'ctts'][1], 2)
+            # (signed in version 1)
+            self.offsets = np.repeat(ctts[:, 1].astype(np.uint32).view(np.int32).astype(np.int64), ctts[:, 0])
+        # key frames (rows). every sample is one without a stss box
+        self.sync = _entries(data, boxes[b'stss'][1], 1)[:, 0].astype(np.int64) - 1 if b'stss' in boxes else None
+        if len(self.sizes) and self.sync is not None and (not len(self.sync) or self.sync[0] != 0):
+            raise ValueError(f"{path} doesn't start with a key frame")
+
+        # where every chunk starts, and how many samples it holds
+        if b'co64' in boxes:
+            start = boxes[b'co64'][1]
+            count = struct.unpack('>I', data[start + 4:start + 8])[0]
+            chunk_offsets = np.frombuffer(data, dtype='>u8', count=count, offset=start + 8).astype(np.int64)
+        else:
+            chunk_offsets = _entries(data, boxes[b'stco'][1], 1)[:, 0].astype(np.int64)
+        stsc = _entries(data, boxes[b'stsc'][1], 3).astype(np.int64)
+        # every run of stsc lasts until the first chunk of the next one
+        firsts = np.append(stsc[:, 0], len(chunk_offsets) + 1)
+        self.per_chunk = np.repeat(stsc[:, 1], np.diff(firsts))
+        if self.per_chunk.sum() != len(self.sizes):
+            raise ValueError(f"the chunks of {path} don't add up to its samples")
+        # byte ranges of the chunks (the samples of a chunk are stored back to back)
+        ends = np.cumsum(self.per_chunk)
+        total = np.concatenate(([0], np.cumsum(self.sizes)))
+        self.chunks = list(zip(chunk_offsets.tolist(), (total[ends] - total[ends - self.per_chunk]).tolist()))
+        # sample tables the file has
+        self.tables = set(boxes)
+
+    def _timescale(self, mdhd):
+        start = mdhd[1]
+        if self.data[start] == 1:
+            return struct.unpack('>I', self.data[start + 20:start + 24])[0]
+        return struct.unpack('>I', self.data[start + 12:start + 16])[0]
+
+def _descriptor(data, position):
+    '''
+    :return: tag, offset of the payload and size of the MPEG-4 descriptor at "position" (see the esds box)
+    '''
+    tag = data[position]
+    size = 0
+    position += 1
+    while True:
+        byte = data[position]
+        position += 1
+        size = size << 7 | byte & 0x7f
+        if not byte & 0x80:
+            return tag, position, size
+
+def _settings(stsd):
+    '''
+    :return: the sample description without the bitrate info (buffer size, maximal and average bitrate), which every
+             encoded file gets from its own frames. what's left has to be the same to join files
+    '''
+    settings = bytearray(stsd)
+    start = stsd.find(b'btrt')
+    if start >= 0:
+        settings[start + 4:start + 16] = bytes(12)
+    start = stsd.find(b'esds')
+    if start >= 0:
+        try:
+            tag, position, _ = _descriptor(stsd, start + 8)
+            if tag == 3:
+                # ES_ID, then the flags telling which optional fields follow
+                flags = stsd[position + 2]
+                position += 3 + 2 * bool(flags & 0x80) + 2 * bool(flags & 0x20)
+                if flags & 0x40:
+                    position += 1 + stsd[position]
+                tag, position, _ = _descriptor(stsd, position)
+                if tag == 4:
+                    # object type and stream type, then buffer size (3 bytes), maximal and average bitrate (4 each)
+                    settings[position + 2:position + 13] = bytes(11)
+        except IndexError:
+            pass
+    return bytes(settings)
+
+def _run_lengths(values):
+    '''
+    :return: (runs, 2) array of (count, value) of the runs of equal values
+    '''
+    if not len(values):
+        return np.zeros((0, 2), dtype=np.int64)
+    starts = np.flatnonzero(np.diff(values, prepend=values[0] - 1))
+    counts = np.diff(np.append(starts, len(values)))
+    return np.stack((counts, values[starts]), axis=1)
+
+def _table(kind, rows, dtype='>u4', version=0):
+    rows = np.asarray(rows)
+    return _full_box(kind, version, struct.pack('>I', len(rows)) + rows.astype(dtype).tobytes())
+
+def _set_duration(kind, payload, duration):
+    '''
+    :return: the payload of an mvhd, tkhd or mdhd box with its duration replaced
+    '''
+    version = payload[0]
+    # offset of the duration field in the payload, by version
+    offset = {b'mvhd': (16, 24), b'tkhd': (20, 28), b'mdhd': (16, 24)}[kind][version]
+    field = '>Q' if version == 1 else '>I'
+    if version == 0 and duration >= 2 ** 32:
+        raise ValueError("the joined video is too long for the duration fields of the first file")
+    return payload[:offset] + struct.pack(field, duration) + payload[offset + struct.calcsize(field):]
+
+def _rebuild(data, start, end, replace):
+    '''
+    copies the boxes between start and end, descending into containers
+    :param replace: function (type, payload) -> new bytes of the whole box, or None to keep the box as it was
+    :return: bytes
+    '''
+    out = []
+    for kind, payload_start, box_end in read_boxes(data, start, end):
+        if kind in CONTAINERS:
+            out.append(_box(kind, _rebuild(data, payload_start, box_end, replace)))
+            continue
+        new = replace(kind, data[payload_start:box_end])
+        out.append(new if new is not None else _box(kind, data[payload_start:box_end]))
+    return b''.join(out)
+
+def concat_mp4(paths, out_path, chunk_bytes=1 << 24):
+    '''
+    joins mp4 files into one, without encoding anything again (see the top of this module)
+    :param paths: files to join, in order
+    :param out_path: file to write
+    :param chunk_bytes: bytes copied at once
+    :return: amount of frames (samples) in the joined file
+    '''
+    tracks = [_Track(path) for path in paths]
+    if not tracks:
+        raise ValueError("nothing to join")
+    first = tracks[0]
+    for track in tracks[1:]:
+        if _settings(track.stsd) != _settings(first.stsd) or track.timescale != first.timescale:
+            raise ValueError(f"{track.path} isn't encoded like {first.path}, only identical settings can be joined")
+
+    sizes = np.concatenate([track.sizes for track in tracks])
+    durations = np.concatenate([track.durations for track in tracks])
+    media_duration = int(durations.sum())
+    # one chunk per chunk of the files
+    per_chunk = np.concatenate([track.per_chunk for track in tracks])
+    chunk_sizes = [size for track in tracks for _, size in track.chunks]
+
+    mdat_size = sum(chunk_sizes)
+    ftyp = first.data[first.ftyp[1] - 8:first.ftyp[2]]
+    large = mdat_size + 8 >= 2 ** 32
+    mdat_header = struct.pack('>I4sQ', 1, b'mdat', mdat_size + 16) if large else \
+        struct.pack('>I4s', mdat_size + 8, b'mdat')
+    data_start = len(ftyp) + len(mdat_header)
+    chunk_offsets = data_start + np.concatenate(([0], np.cumsum(chunk_sizes)[:-1])).astype(np.int64)
+
+    # the sample table of the joined track
+    runs = _run_lengths(per_chunk)
+    firsts = np.concatenate(([0], np.cumsum(runs[:, 0])[:-1])) + 1
+    tables = {
+        b'stts': _table(b'stts', _run_lengths(durations)),
+        b'stsz': _full_box(b'stsz', 0, struct.pack('>II', 0, len(sizes)) + sizes.astype('>u4').tobytes()),
+        b'stsc': _table(b'stsc', np.stack((firsts, runs[:, 1], np.ones(len(runs), dtype=np.int64)), axis=1)),
+    }
+    if chunk_offsets[-1:].max(initial=0) < 2 ** 32:
+        tables[b'stco'] = _table(b'stco', chunk_offsets[:, None])
+    else:
+        tables[b'co64'] = _table(b'co64', chunk_offsets[:, None], dtype='>u8')
+    if any(track.sync is not None for track in tracks):
+        starts = np.cumsum([0] + [len(track.sizes) for track in tracks])
+        sync = np.concatenate([(track.sync if track.sync is not None else np.arange(len(track.sizes))) + start
+                               for track, start in zip(tracks, starts)])
+        tables[b'stss'] = _table(b'stss', sync[:, None] + 1)
+    if any(track.offsets is not None for track in tracks):
+        offsets = np.concatenate([track.offsets if track.offsets is not None else np.zeros(len(track.sizes), np.int64)
+                                  for track in tracks])
+        tables[b'ctts'] = _table(b'ctts', _run_lengths(offsets), dtype='>i4', version=1)
+
+    data = first.data
+    movie_timescale = _movie_timescale(first)
+    movie_duration = int(round(media_duration * movie_timescale / first.timescale))
+
+    def replace(kind, payload):
+        if kind in TABLES:
+            # written once, where the first of them was
+            if kind in (b'stco', b'co64'):
+                kind = b'stco' if b'stco' in tables else b'co64'
+            return tables.pop(kind, b'')
+        if kind in (b'mvhd', b'tkhd'):
+            return _box(kind, _set_duration(kind, payload, movie_duration))
+        if kind == b'mdhd':
+            return _box(kind, _set_duration(kind, payload, media_duration))
+        if kind == b'elst':
+            return _box(kind, _set_edit(payload, movie_duration))
+        if kind == b'stsd':
+            # tables missing from the first file go right after the sample description
+            return _box(kind, payload) + b''.join(tables.pop(name) for name in (b'stss', b'ctts')
+                                                  if name in tables and name not in first.tables)
+        return None
+
+    moov = _box(b'moov', _rebuild(data, first.moov[1], first.moov[2], replace))
+    with open(out_path, 'wb') as out:
+        out.write(ftyp)
+        out.write(mdat_header)
+        for track in tracks:
+            with open(track.path, 'rb') as f:
+                for offset, size in track.chunks:
+                    f.seek(offset)
+                    _copy(f, out, size, chunk_bytes)
+        out.write(moov)
+    return len(sizes)
+
+def track_info(path):
+    '''
+    :param path: mp4 file holding a single video track
+    :return: dict with the amount of frames, the duration in seconds of the track (mdhd) and of the movie (mvhd), and
+             the frames that are key frames
+    '''
+    track = _Track(path)
+    data = track.data
+    mvhd = _find(read_boxes(data, *track.moov[1:]), b'mvhd')[1]
+    if data[mvhd] == 1:
+        timescale, duration = struct.unpack('>IQ', data[mvhd + 20:mvhd + 32])
+    else:
+        timescale, duration = struct.unpack('>II', data[mvhd + 12:mvhd + 20])
+    return {'frames': len(track.sizes), 'seconds': int(track.durations.sum()) / track.timescale,
+            'movie_seconds': duration / timescale,
+            'key_frames': track.sync if track.sync is not None else np.arange(len(track.sizes))}
+
+def _movie_timescale(track):
+    data = track.data
+    mvhd = _find(read_boxes(data, *track.moov[1:]), b'mvhd')[1]
+    offset = 20 if data[mvhd] == 1 else 12
+    return struct.unpack('>I', data[mvhd + offset:mvhd + offset + 4])[0]
+
+def _set_edit(payload, duration):
+    '''
+    :return: the payload of an elst box whose only edit now covers "duration" (edit lists with several edits are
+             kept as they are)
+    '''
+    version = payload[0]
+    count = struct.unpack('>I', payload[4:8])[0]
+    if count != 1:
+        return payload
+    if version == 1:
+        return payload[:8] + struct.pack('>Q', duration) + payload[16:]
+    return payload[:8] + struct.pack('>I', min(duration, 2 ** 32 - 1)) + payload[12:]
+
+def _copy(source, target, size, chunk_bytes):
+    while size > 0:
+        block = source.read(min(size, chunk_bytes))
+        if not block:
+            raise ValueError("the file ended before its samples did")
+        target.write(block)
+        size -= len(block)
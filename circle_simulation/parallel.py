@@ -0,0 +1,380 @@
+'''
+Domain-decomposed stepping of one large simulation on several cores (ParallelSimbox).
+
+Every frame the disk is cut into vertical strips holding about the same amount of circles, one per worker process.
+The arrays of the circles live in shared memory, so the workers read them without any copying. Each sub-step:
+    contacts - every worker finds the colliding pairs whose first circle lies in its strip. it runs the broad and
+               narrow phase on its strip plus a halo (the circles less than the largest diameter outside of it), so
+               that pairs across the border are found too. the parent merges the pairs into the order the serial
+               engine finds them in (sorted by first then second)
+    vectors  - every worker computes the new movement vectors of the circles of its strip, from the merged pairs
+    shift    - after the parent moved every circle, every worker computes how far the circles of its strip get
+               pushed apart
+Each circle is updated from the same pairs, in the same order, with the same arithmetic as in VectorSimbox, so the
+results are identical to the serial engine bit for bit (whatever the amount of workers).
+Hooks, the collision counts, integration and the wall clamp stay in the parent. The continuous collision mode is not
+split up (it runs serially).
+'''
+import os
+import traceback
+import weakref
+import multiprocessing
+from multiprocessing.shared_memory import SharedMemory
+import numpy as np
+from circle_simulation.broad_phase import find_pairs, overlap_push, SLACK
+from circle_simulation.vector_simulation import VectorSimbox, CircleStore
+
+class SharedArrays:
+    '''
+    numpy arrays in named shared memory blocks. worker processes attach to them through specs()
+    '''
+    def __init__(self):
+        # name -> (block, shape, dtype)
+        self.blocks = {}
+        # replaced blocks still viewed by some array (closed as soon as they no longer are)
+        self.retired = []
+
+    def create(self, name, shape, dtype):
+        '''
+        :param name: name of the array (replaces the array of that name, if any)
+        :param shape: shape of the array
+        :param dtype: dtype of the array
+        :return: the new array, filled with zeros
+        '''
+        dtype = np.dtype(dtype)
+        block = SharedMemory(create=True, size=max(int(np.prod(shape)) * dtype.itemsize, 1))
+        self.retire(name)
+        self.blocks[name] = (block, tuple(shape), dtype.str)
+        return np.ndarray(shape, dtype, buffer=block.buf)
+
+    def specs(self):
+        '''
+        :return: dict of name -> (block name, shape, dtype) of every array, to attach to with _attach
+        '''
+        return {name: (block.name, shape, dtype) for name, (block, shape, dtype) in self.blocks.items()}
+
+    def retire(self, name):
+        entry = self.blocks.pop(name, None)
+        if entry is not None:
+            entry[0].unlink()
+            self.retired.append(entry[0])
+        retired = []
+        for block in self.retired:
+            try:
+                block.close()
+            except BufferError:
+                # an array (e.g. a circle.position somebody kept) still views it
+                retired.append(block)
+        self.retired = retired
+
+    def close(self):
+        for name in list(self.blocks):
+            self.retire(name)
+
+class SharedCircleStore(CircleStore):
+    '''
+    CircleStore whose arrays read by the workers live in shared memory, plus the per-row buffers the workers write
+    their results into
+    '''
+    SHARED = ('positions', 'vectors', 'radii', 'weights', 'damping')
+    # name, trailing shape and dtype of the buffers. (damping ** contacts, wall contacts, new vectors, clean-up shift)
+    BUFFERS = (('factor', (), np.float64), ('wall', (), bool), ('new_vectors', (2,), np.float64),
+               ('shift', (2,), np.float64))
+
+    def __init__(self, owner, capacity=64):
+        self.shared = SharedArrays()
+        super().__init__(owner, capacity)
+        # colliding pairs of the sub-step, for the workers (grown as needed, see ParallelSimbox._share_pairs)
+        self.pair_first = self.shared.create('pair_first', (0,), np.intp)
+        self.pair_second = self.shared.create('pair_second', (0,), np.intp)
+
+    def reserve(self, capacity):
+        if capacity <= self.capacity:
+            return
+        super().reserve(capacity)
+        for field in self.SHARED:
+            array = getattr(self, field)
+            shared = self.shared.create(field, array.shape, array.dtype)
+            shared[:] = array
+            setattr(self, field, shared)
+        for name, shape, dtype in self.BUFFERS:
+            setattr(self, name, self.shared.create(name, (self.capacity,) + shape, dtype))
+
+class _WorkerError:
+    # exception raised in a worker, re-raised by the parent
+    def __init__(self, text):
+        self.text = text
+
+def _attach(attached, specs):
+    '''
+    :param attached: dict of name -> (block name, block, array) of the arrays the worker is attached to
+    :param specs: SharedArrays.specs() of the parent
+    :return: dict of name -> array
+    '''
+    for name, (block_name, shape, dtype) in specs.items():
+        current = attached.get(name)
+        if current is not None and current[0] == block_name:
+            continue
+        if current is not None:
+            block = attached.pop(name)[1]
+            del current
+            block.close()
+        block = SharedMemory(name=block_name)
+        attached[name] = (block_name, block, np.ndarray(shape, np.dtype(dtype), buffer=block.buf))
+    return {name: array for name, (block_name, block, array) in attached.items()}
+
+def _strip_contacts(arrays, strip, n, low, high, halo, broad_phase, grid_size):
+    '''
+    colliding pairs whose first circle is in the strip low <= x < high
+    :param arrays: shared arrays
+    :param strip: dict the worker keeps the circles of its strip in for the following phases
+    :return: arrays "first", "second" of colliding rows (first < second, sorted by first then second), amount of
+             candidate pairs and the name of the broad phase used
+    '''
+    positions, radii = arrays['positions'][:n], arrays['radii'][:n]
+    x = positions[:, 0]
+    owned = (x >= low) & (x < high)
+    strip['owned'] = owned
+    strip['rows'] = np.nonzero(owned)[0]
+    near = np.nonzero((x >= low - halo) & (x < high + halo))[0]
+    first, second, broad_phase_used = find_pairs(broad_phase, positions[near], radii[near], grid_size)
+    # rows of "near" are sorted, so the pairs stay sorted and first < second
+    first, second = near[first], near[second]
+    keep = owned[first]
+    first, second = first[keep], second[keep]
+    delta = positions[first] - positions[second]
+    touching = np.sqrt(delta[:, 0] ** 2 + delta[:, 1] ** 2) <= radii[first] + radii[second]
+    return first[touching], second[touching], len(first), broad_phase_used
+
+def _strip_pairs(arrays, strip, pairs):
+    # the merged pairs touching a circle of the strip, which side of each is in the strip, and the position of those
+    # circles in strip['rows']
+    first, second = arrays['pair_first'][:pairs], arrays['pair_second'][:pairs]
+    owned = strip['owned']
+    first_owned, second_owned = owned[first], owned[second]
+    involved = first_owned | second_owned
+    first, second = first[involved], second[involved]
+    first_owned, second_owned = first_owned[involved], second_owned[involved]
+    rows = strip['rows']
+    return (first, second, first_owned, second_owned, np.searchsorted(rows, first[first_owned]),
+            np.searchsorted(rows, second[second_owned]))
+
+def _strip_vectors(arrays, strip, n, pairs):
+    '''
+    VectorSimbox._collision_vectors for the circles of the strip, written into arrays['new_vectors']
+    :param pairs: amount of merged pairs in arrays['pair_first'] and arrays['pair_second']
+    :return: None
+    '''
+    positions, vectors, weights = arrays['positions'][:n], arrays['vectors'][:n], arrays['weights'][:n]
+    rows = strip['rows']
+    m = len(rows)
+    new_vectors = vectors[rows]
+
+    if pairs:
+        first, second, first_owned, second_owned, first_rows, second_rows = _strip_pairs(arrays, strip, pairs)
+        delta = positions[first] - positions[second]
+        d = np.sqrt(delta[:, 0] ** 2 + delta[:, 1] ** 2)
+        d[d == 0] = np.inf
+        normal = delta / d[:, None]
+        relative = vectors[first] - vectors[second]
+        p = 2 * (relative[:, 0] * normal[:, 0] + relative[:, 1] * normal[:, 1]) / (weights[first] + weights[second])
+        # pairs that are already moving apart (still overlapping from an earlier sub-step) exchange nothing
+        p = np.minimum(p, 0)
+        push_first = -(p * weights[second])[:, None] * normal
+        push_second = (p * weights[first])[:, None] * normal
+        for axis in range(2):
+            new_vectors[:, axis] += np.bincount(first_rows, push_first[first_owned, axis], minlength=m)
+            new_vectors[:, axis] += np.bincount(second_rows, push_second[second_owned, axis], minlength=m)
+        new_vectors *= arrays['factor'][rows][:, None]
+
+    touching = np.nonzero(arrays['wall'][rows] & np.any(positions[rows] != 0, axis=1))[0]
+    if len(touching):
+        posit = positions[rows[touching]]
+        posit_normalized = posit / np.sqrt(posit[:, 0] ** 2 + posit[:, 1] ** 2)[:, None]
+        v = new_vectors[touching]
+        proj = ((v * posit_normalized).sum(axis=1) / (posit_normalized ** 2).sum(axis=1))[:, None] * posit_normalized
+        new_vectors[touching] = v - 2 * proj
+    arrays['new_vectors'][rows] = new_vectors
+
+def _strip_shift(arrays, strip, n, pairs):
+    '''
+    push of VectorSimbox._clean_collisions for the circles of the strip, written into arrays['shift']
+    :return: None
+    '''
+    positions, radii = arrays['positions'][:n], arrays['radii'][:n]
+    rows = strip['rows']
+    m = len(rows)
+    first, second, first_owned, second_owned, first_rows, second_rows = _strip_pairs(arrays, strip, pairs)
+    difference = overlap_push(positions[second] - positions[first], radii[first] + radii[second])
+    shift = np.zeros((m, 2))
+    for axis in range(2):
+        shift[:, axis] -= np.bincount(first_rows, difference[first_owned, axis], minlength=m)
+        shift[:, axis] += np.bincount(second_rows, difference[second_owned, axis], minlength=m)
+    arrays['shift'][rows] = shift
+
+PHASES = {'contacts': _strip_contacts, 'vectors': _strip_vectors, 'shift': _strip_shift}
+
+def _worker(connection):
+    # main loop of a worker process: runs the phases it is sent on its strip until it gets None
+    attached, strip = {}, {}
+    while True:
+        message = connection.recv()
+        if message is None:
+            break
+        phase, specs, args = message
+        try:
+            result = PHASES[phase](_attach(attached, specs), strip, *args)
+        except Exception:
+            result = _WorkerError(traceback.format_exc())
+        connection.send(result)
+    strip.clear()
+    while attached:
+        block = attached.popitem()[1][1]
+        block.close()
+
+def _shutdown(processes, connections, shared):
+    # stops the workers and frees the shared memory (also called when the simbox is garbage collected)
+    for connection in connections:
+        try:
+            connection.send(None)
+        except OSError:
+            pass
+    for process in processes:
+        process.join(timeout=5)
+        if process.is_alive():
+            process.terminate()
+    processes.clear()
+    connections.clear()
+    shared.close()
+
+class ParallelSimbox(VectorSimbox):
+    '''
+    VectorSimbox stepping each sub-step on several worker processes, one vertical strip of the disk each (see the
+    top of this module). Results are identical to VectorSimbox.
+
+    The workers are started on the first sub-step and run until close() (or until the simbox is garbage collected).
+    Scenes with fewer than "min_circles" circles are stepped serially, the round trips to the workers would cost more
+    than they save.
+    '''
+    store_class = SharedCircleStore
+
+    def __init__(self, *args, workers=None, min_circles=10000, **kwargs):
+        '''
+        :param workers: amount of worker processes (None: one per core). 1 steps serially
+        :param min_circles: smallest scene stepped on the workers
+        (other arguments as VectorSimbox)
+        '''
+        self.workers = workers or os.cpu_count() or 1
+        self.min_circles = min_circles
+        # x coordinates the strips are cut at, redone every frame
+        self.strip_bounds = None
+        self._processes, self._connections = [], []
+        super().__init__(*args, **kwargs)
+        self._finalizer = weakref.finalize(self, _shutdown, self._processes, self._connections, self.store.shared)
+
+    def close(self):
+        '''
+        stops the workers and frees the shared memory. the simbox can't be stepped afterwards
+        :return: None
+        '''
+        self._finalizer()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _parallel(self):
+        return self.workers > 1 and self.store.size >= max(self.min_circles, 2)
+
+    def _start_workers(self):
+        if len(self._processes) == self.workers:
+            return
+        _shutdown(self._processes, self._connections, SharedArrays())
+        context = multiprocessing.get_context()
+        for _ in range(self.workers):
+            parent, child = context.Pipe()
+            process = context.Process(target=_worker, args=(child,), daemon=True)
+            process.start()
+            child.close()
+            self._processes.append(process)
+            self._connections.append(parent)
+
+    def _run(self, phase, args):
+        '''
+        :param phase: key of PHASES
+        :param args: one tuple of arguments per worker
+        :return: list of what each worker returned
+        '''
+        self._start_workers()
+        specs = self.store.shared.specs()
+        for connection, worker_args in zip(self._connections, args):
+            connection.send((phase, specs, worker_args))
+        results = [connection.recv() for connection in self._connections]
+        for result in results:
+            if isinstance(result, _WorkerError):
+                raise RuntimeError("a worker of the ParallelSimbox failed:\n" + result.text)
+        return results
+
+    def simulate_frame(self):
+        if self._parallel():
+            # strips with (about) the same amount of circles
+            n = self.store.size
+            cuts = np.arange(1, self.workers) * n // self.workers
+            x = np.partition(self.store.positions[:n, 0], cuts)[cuts]
+            self.strip_bounds = np.concatenate(([-np.inf], x, [np.inf]))
+        super().simulate_frame()
+
+    def _find_contacts(self, positions, radii):
+        # (the workers look at the whole store, not at a subset of its rows like the one of sleeping circles)
+        if not self._parallel() or self.strip_bounds is None or len(positions) != self.store.size:
+            return super()._find_contacts(positions, radii)
+        n = len(positions)
+        # circles further than the largest diameter from a strip can't touch any of its circles
+        halo = 2 * float(radii.max()) * (1 + SLACK)
+        bounds = self.strip_bounds.tolist()
+        results = self._run('contacts', [(n, bounds[i], bounds[i + 1], halo, self.broad_phase, self.grid_size)
+                                         for i in range(self.workers)])
+        first = np.concatenate([result[0] for result in results])
+        second = np.concatenate([result[1] for result in results])
+        order = np.lexsort((second, first))
+        self.broad_phase_used = results[0][3]
+        profiler = self.profiler
+        if profiler is not None:
+            profiler.mark('broad_phase')
+            profiler.count('candidates', sum(result[2] for result in results))
+        return first[order], second[order]
+
+    def _collision_vectors(self, first, second, contacts, wall):
+        if not self._parallel() or self.strip_bounds is None:
+            return super()._collision_vectors(first, second, contacts, wall)
+        store = self.store
+        n = store.size
+        self._share_pairs(first, second)
+        store.wall[:n] = wall
+        if len(first):
+            store.factor[:n] = store.damping[:n] ** contacts
+        self._run('vectors', [(n, len(first))] * self.workers)
+        return store.new_vectors[:n]
+
+    def _clean_collisions(self, first, second, wall):
+        if not self._parallel() or self.strip_bounds is None or not len(first):
+            return super()._clean_collisions(first, second, wall)
+        store = self.store
+        n = store.size
+        self._run('shift', [(n, len(first))] * self.workers)
+        store.positions[:n] += store.shift[:n]
+        # only the wall is left
+        super()._clean_collisions(first[:0], second[:0], wall)
+
+    def _share_pairs(self, first, second):
+        # copies the pairs of the sub-step into shared memory for the workers
+        store = self.store
+        capacity = len(store.pair_first)
+        if len(first) > capacity:
+            capacity = max(len(first), 2 * capacity, 1024)
+            store.pair_first = store.shared.create('pair_first', (capacity,), np.intp)
+            store.pair_second = store.shared.create('pair_second', (capacity,), np.intp)
+        store.pair_first[:len(first)] = first
+        store.pair_second[:len(second)] = second
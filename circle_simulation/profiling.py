@@ -0,0 +1,128 @@
+'''
+Opt-in instrumentation of the simulation and the renderers.
+
+Set simbox.profiler = Profiler() to record, for every frame, the wall time of each phase of the simulation (broad
+phase, narrow phase, collision response, integration, clean-up, forces, each batched hook...), candidate pair and
+contact counts, and the time the renderers spend rendering, displaying or encoding that frame. The last "capacity"
+frames are kept in a ring buffer.
+Left at None (the default), the instrumented code only checks that attribute.
+(the decoupled live mode of SimDisplayer and the pipelined SimExporter run on several threads and only record the
+phases of the simulation. the pipeline reports its stages itself, see SimExporter.stage_stats)
+
+Usage:
+    sim.profiler = Profiler()
+    SimExporter("scene", sim).run_sim()
+    print(sim.profiler.summary())
+    sim.profiler.save_chrome_trace("scene.trace.json")   # open in chrome://tracing or ui.perfetto.dev
+'''
+import json
+import time
+from collections import deque
+
+class Profiler:
+    def __init__(self, capacity=1000):
+        '''
+        :param capacity: amount of frames kept (the oldest frames are dropped first)
+        '''
+        self.capacity = capacity
+        # one record per frame: {'frame', 'spans': [(phase, start, seconds)...], 'counters': {name: amount}}
+        self.records = deque(maxlen=capacity)
+        self._last = time.perf_counter()
+        # origin of the timestamps of the chrome trace
+        self._origin = self._last
+
+    def begin_frame(self, frame):
+        '''
+        starts the record of a new frame. renderers add their phases to it once the simbox is done with it
+        :param frame: simbox.current_frame at the start of the frame
+        :return: None
+        '''
+        self.records.append({'frame': frame, 'spans': [], 'counters': {}})
+        self._last = time.perf_counter()
+
+    def mark(self, phase):
+        '''
+        ends phase "phase": the time since the previous mark (or begin_frame) is recorded as that phase
+        :param phase: name of the phase
+        :return: None
+        '''
+        now = time.perf_counter()
+        if self.records:
+            self.records[-1]['spans'].append((phase, self._last, now - self._last))
+        self._last = now
+
+    def count(self, counter, amount):
+        '''
+        adds "amount" to a counter of the current frame (e.g. candidate pairs, contacts)
+        :return: None
+        '''
+        if self.records:
+            counters = self.records[-1]['counters']
+            counters[counter] = counters.get(counter, 0) + amount
+
+    def frames(self):
+        '''
+        :return: list of every recorded frame, oldest first: {'frame', 'phases': {phase: seconds}, 'counters'}
+                 (phases occurring several times a frame, once per sub-step, are summed up)
+        '''
+        frames = []
+        for record in self.records:
+            phases = {}
+            for phase, start, seconds in record['spans']:
+                phases[phase] = phases.get(phase, 0.) + seconds
+            frames.append({'frame': record['frame'], 'phases': phases, 'counters': dict(record['counters'])})
+        return frames
+
+    def summary(self):
+        '''
+        :return: dict of the mean seconds per frame of every phase and the mean of every counter over the recorded
+                 frames, plus the amount of frames
+        '''
+        frames = self.frames()
+        phases, counters = {}, {}
+        for frame in frames:
+            for phase, seconds in frame['phases'].items():
+                phases[phase] = phases.get(phase, 0.) + seconds
+            for counter, amount in frame['counters'].items():
+                counters[counter] = counters.get(counter, 0) + amount
+        n = max(len(frames), 1)
+        return {'frames': len(frames), 'phases': {phase: total / n for phase, total in phases.items()},
+                'counters': {counter: total / n for counter, total in counters.items()}}
+
+    def clear(self):
+        self.records.clear()
+
+    def save_json(self, path):
+        '''
+        writes the recorded frames (see self.frames) and the summary as json
+        :param path: file to write
+        :return: None
+        '''
+        with open(path, 'w') as f:
+            json.dump({'summary': self.summary(), 'frames': self.frames()}, f, indent=1)
+
+    def chrome_trace(self):
+        '''
+        :return: the recorded frames in the Chrome trace event format (one complete event per phase, counters as
+                 counter events), readable by chrome://tracing and ui.perfetto.dev
+        '''
+        events = []
+        for record in self.records:
+            spans = record['spans']
+            if not spans:
+                continue
+            start = spans[0][1]
+            end = spans[-1][1] + spans[-1][2]
+            events.append({'name': f"frame {record['frame']}", 'cat': 'frame', 'ph': 'X', 'pid': 0, 'tid': 0,
+                           'ts': (start - self._origin) * 1e6, 'dur': (end - start) * 1e6})
+            for phase, begin, seconds in spans:
+                events.append({'name': phase, 'cat': 'phase', 'ph': 'X', 'pid': 0, 'tid': 0,
+                               'ts': (begin - self._origin) * 1e6, 'dur': seconds * 1e6})
+            if record['counters']:
+                events.append({'name': 'counters', 'ph': 'C', 'pid': 0, 'ts': (start - self._origin) * 1e6,
+                               'args': dict(record['counters'])})
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def save_chrome_trace(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.chrome_trace(), f)
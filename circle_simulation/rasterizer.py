@@ -0,0 +1,151 @@
+'''
+Sprite based rasterizer: the 'sprite' backend of BaseRenderer.
+
+Instead of drawing every circle with ImageDraw.ellipse, each distinct pixel size is drawn once with PIL and cached as a
+sprite (the pixels it covers). A frame is then rendered by stamping every group of circles sharing a sprite with fancy
+indexing, and painting the covered pixels over the background in a reused frame buffer.
+
+Frames come out pixel for pixel like the 'pil' backend: bounding boxes are rounded the way ImageDraw rounds them
+(towards zero), and where circles overlap the later one wins, like when they are drawn one after another.
+
+splat_points and splat_density draw circles smaller than a pixel (the level of detail modes of BaseRenderer), which
+would only come out as noise one ellipse at a time.
+'''
+from collections import OrderedDict
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+# sprites kept by a rasterizer. a zoomed or lod view of circles of many sizes makes new sprites every frame, the least
+# recently used ones are dropped past this
+MAX_SPRITES = 4096
+
+class SpriteRasterizer:
+    def __init__(self, size, max_sprites=MAX_SPRITES):
+        '''
+        :param size: width and height of the frames in pixels
+        :param max_sprites: how many sprites to cache (least recently used ones are dropped first)
+        '''
+        self.size = size
+        self.max_sprites = max_sprites
+        # frame buffer, reused by every frame. (size, size, 3) uint8, channels in the order the colors are given in
+        self.buffer = np.zeros((size, size, 3), dtype=np.uint8)
+        # highest circle covering each pixel while a frame is rendered (-1 everywhere in between)
+        self._owners = np.full(size * size, -1, dtype=np.intp)
+        # (width, height) -> (rows, cols, offsets in the flattened frame), least recently used first
+        self.sprites = OrderedDict()
+
+    def sprite(self, width, height):
+        '''
+        :param width: width of the bounding box of the circle in pixels (right - left, like ImageDraw.ellipse)
+        :param height: height of the bounding box in pixels
+        :return: rows and columns of the pixels covered by the circle from its top left pixel, and the same as offsets
+                 in the flattened frame (only valid for circles entirely inside of it)
+        '''
+        key = (width, height)
+        sprite = self.sprites.get(key)
+        if sprite is not None:
+            self.sprites.move_to_end(key)
+            return sprite
+        # drawn by PIL itself, so stamped circles look exactly like the ones of the 'pil' backend
+        mask = Image.new('L', (width + 1, height + 1))
+        ImageDraw.Draw(mask).ellipse([0, 0, width, height], fill=255)
+        rows, cols = np.nonzero(np.asarray(mask))
+        rows, cols = rows.astype(np.intp), cols.astype(np.intp)
+        sprite = (rows, cols, rows * self.size + cols)
+        self.sprites[key] = sprite
+        if len(self.sprites) > self.max_sprites:
+            self.sprites.popitem(last=False)
+        return sprite
+
+    def render(self, left, top, right, bottom, colors, background=None):
+        '''
+        draws circles into self.buffer
+        :param left: (n,) left edges of the bounding boxes of the circles in pixels
+        :param top: (n,) top edges
+        :param right: (n,) right edges
+        :param bottom: (n,) bottom edges
+        :param colors: (n, 3) colors of the circles, in the channel order of the frame (RGB, or BGR for OpenCV)
+        :param background: optional (size, size, 3) array the frame starts from (black otherwise)
+        :return: self.buffer (overwritten by the next call, copy it to keep the frame)
+        '''
+        buffer = self.buffer
+        if background is None:
+            buffer.fill(0)
+        else:
+            buffer[:] = background
+        if not len(left):
+            return buffer
+
+        # pixel coordinates the way ImageDraw.ellipse rounds them (towards zero, not down)
+        x0, y0 = np.trunc(left).astype(np.intp), np.trunc(top).astype(np.intp)
+        widths = np.trunc(right).astype(np.intp) - x0
+        heights = np.trunc(bottom).astype(np.intp) - y0
+        colors = np.asarray(colors, dtype=np.uint8).reshape(-1, 3)
+
+        # group circles sharing a sprite. one key per (width, height), packed into a single integer
+        keys = (widths << 32) | heights
+        unique_keys, groups = np.unique(keys, return_inverse=True)
+        order = np.argsort(groups, kind='stable')
+        bounds = np.searchsorted(groups[order], np.arange(len(unique_keys) + 1))
+
+        size = self.size
+        # circles not entirely inside of the frame get their pixels outside of it dropped
+        inside = (x0 >= 0) & (y0 >= 0) & (x0 + widths < size) & (y0 + heights < size)
+        corners = y0 * size + x0
+        # where circles overlap, the one drawn last (highest index) wins, like with one ellipse after another. every
+        # pixel gets the highest circle covering it, then the covered pixels are painted in the colors of their circles
+        owners = self._owners
+        for group, key in enumerate(unique_keys.tolist()):
+            members = order[bounds[group]:bounds[group + 1]]
+            width, height = key >> 32, key & 0xFFFFFFFF
+            rows, cols, offsets = self.sprite(width, height)
+            if not len(offsets):
+                continue
+            clipped = members[~inside[members]]
+            members = members[inside[members]]
+            np.maximum.at(owners, (corners[members, None] + offsets).ravel(), np.repeat(members, len(offsets)))
+            if len(clipped):
+                y = y0[clipped, None] + rows
+                x = x0[clipped, None] + cols
+                keep = (y >= 0) & (y < size) & (x >= 0) & (x < size)
+                np.maximum.at(owners, y[keep] * size + x[keep], np.repeat(clipped, keep.sum(axis=1)))
+
+        covered = np.flatnonzero(owners >= 0)
+        # pixels copied as single 3 byte items, quite a bit faster than rows of 3 uint8
+        pixels = buffer.reshape(-1, 3).view('V3').ravel()
+        pixels[covered] = np.ascontiguousarray(colors).view('V3').ravel()[owners[covered]]
+        owners[covered] = -1
+        return buffer
+
+def splat_points(frame, x, y, colors):
+    '''
+    paints one pixel per circle, in its color (the last circle wins where several share a pixel)
+    :param frame: (size, size, 3) uint8 array to paint into
+    :param x: (n,) pixel columns of the circle centers (inside of the frame)
+    :param y: (n,) pixel rows
+    :param colors: (n, 3) colors, in the channel order of the frame
+    :return: frame
+    '''
+    frame.reshape(-1, 3)[y * frame.shape[1] + x] = colors
+    return frame
+
+def splat_density(frame, x, y, colors):
+    '''
+    paints the pixels holding circles by how many they hold: the mean color of the circles in the pixel, brightest in
+    the pixel holding the most circles (on a log scale, so sparse pixels stay visible)
+    (x, y and colors see splat_points)
+    :return: frame
+    '''
+    if not len(x):
+        return frame
+    flat = frame.reshape(-1, 3)
+    pixels = y * frame.shape[1] + x
+    counts = np.bincount(pixels, minlength=len(flat))
+    hit = np.nonzero(counts)[0]
+    counts = counts[hit]
+    brightness = np.log1p(counts) / np.log1p(counts.max()) / counts
+    for channel in range(3):
+        sums = np.bincount(pixels, colors[:, channel], minlength=len(flat))[hit]
+        flat[hit, channel] = (sums * brightness).astype(np.uint8)
+    return frame
@@ -1,20 +1,34 @@
-from base_simulation import BaseRenderer
+from circle_simulation.base_simulation import BaseRenderer
 import numpy as np
-import pygame as pg, sys
-import cv2, keyboard
+import sys
+
+# the backends (pygame for the window, OpenCV for the video, keyboard for the quit hotkey and PIL for rendering) are
+# imported by the methods using them, the first time they're used. importing this module costs nothing but numpy
 
 class SimDisplayer(BaseRenderer):
 
-    def __init__(self, simbox, resolution=5, fps=30):
+    def __init__(self, simbox, resolution=5, fps=30, backend='pil', decoupled=False, sim_rate=None,
+                 interpolate=False, lod=None, lod_size=1., zoom=1., view_center=(0, 0)):
 
-        super().__init__(simbox, resolution)
+        super().__init__(simbox, resolution, backend, lod, lod_size, zoom, view_center)
         self.PAUSE = False
         self.FPS = fps
 
+        # decoupled live mode (see _run_decoupled): the simbox is stepped on a background thread at a fixed
+        # "sim_rate" frames per second (self.FPS by default) while the window renders the latest state at self.FPS.
+        # interpolate blends the last two simulated states, for smooth motion when sim_rate is below self.FPS
+        self.decoupled = decoupled
+        self.sim_rate = sim_rate if sim_rate is not None else fps
+        self.interpolate = interpolate
+
         # this will hold the screen / window after self.initialize is called
         self.screen = None
+        # surface reading the frame buffer of the sprite rasterizer directly, and that buffer (see _display_array)
+        self._surface = None
+        self._surface_buffer = None
 
     def _initialize(self):
+        import pygame as pg
         # Initializes pygame
         pg.init()
 
@@ -25,34 +39,141 @@ class SimDisplayer(BaseRenderer):
         pg.display.set_caption("Circle sim")
 
     def run_live_sim(self):
+        import pygame as pg
         self._initialize()
         # clock ensures adherence to self.FPS. (bounds the upper limit of sim framerate to self.FPS)
         clock = pg.time.Clock()
+        if self.decoupled:
+            self._run_decoupled(clock)
         while True:
-            # check if the x-button has been clicked
-            for event in pg.event.get():
-                if event.type == pg.QUIT:
-                    self.close()
-                # check if "space key" was pressed. toggles pause
-                elif event.type == pg.KEYUP:  # Key release event
-                    if event.key == pg.K_SPACE:  # Space bar release
-                        self.toggle_pause()
+            self._handle_events()
 
             if not self.PAUSE:
                 self.simbox.simulate_frame()
 
-                # renders current state of sim
-                frame = self.render_frame()
+                if self._renders_arrays():
+                    # renders straight into the buffer behind the displayed surface. no copies on the way
+                    frame = self.render_array()
+                    self._mark('render')
+                    self._display_array(frame)
+                else:
+                    # renders current state of sim
+                    frame = self.render_frame()
+                    self._mark('render')
+
+                    # displays frame
+                    self._display_frame(frame)
+                self._mark('display')
+
+                clock.tick(self.FPS)
+
+    def _handle_events(self):
+        import pygame as pg
+        # check if the x-button has been clicked
+        for event in pg.event.get():
+            if event.type == pg.QUIT:
+                self.close()
+            # check if "space key" was pressed. toggles pause
+            elif event.type == pg.KEYUP:  # Key release event
+                if event.key == pg.K_SPACE:  # Space bar release
+                    self.toggle_pause()
+                # +/- zoom in and out, the arrow keys move the view (by a tenth of what's on screen)
+                elif event.key in (pg.K_PLUS, pg.K_EQUALS, pg.K_KP_PLUS):
+                    self.zoom *= 1.25
+                elif event.key in (pg.K_MINUS, pg.K_KP_MINUS):
+                    self.zoom = max(self.zoom / 1.25, 1.)
+                elif event.key in (pg.K_LEFT, pg.K_RIGHT, pg.K_UP, pg.K_DOWN):
+                    step = 0.2 * self.simbox.radius / self.zoom
+                    x, y = self.view_center
+                    dx = {pg.K_LEFT: -step, pg.K_RIGHT: step}.get(event.key, 0)
+                    dy = {pg.K_DOWN: -step, pg.K_UP: step}.get(event.key, 0)
+                    self.view_center = (x + dx, y + dy)
+
+    def _run_decoupled(self, clock):
+        '''
+        live mode in which the physics don't wait for the screen and the screen doesn't wait for the physics.
+        a background thread steps the simbox every 1 / self.sim_rate seconds and publishes a snapshot of each finished
+        frame (positions, radii, colors and current_frame). the window keeps handling events and shows the latest
+        snapshot at self.FPS, so pausing and closing stay responsive however long a single frame of physics takes.
+        (subclasses overriding render_frame draw snapshots, see SnapshotSimbox)
+        :param clock: pygame clock of the display loop
+        :return: None (leaves through self.close)
+        '''
+        import copy, threading, time
+        from circle_simulation.trajectory import SnapshotSimbox
+
+        # double buffer: the physics thread only ever replaces the whole pair, the window only reads it.
+        # (previous snapshot, latest snapshot, time the latest one was published)
+        published = [None, None, 0.]
+        lock = threading.Lock()
+        stop = threading.Event()
+        errors = []
+
+        def snapshot():
+            sim = self.simbox
+            return sim.get_positions(), sim.get_radii(), sim.get_colors(), sim.current_frame
+
+        def physics():
+            step = 1 / self.sim_rate
+            next_step = time.perf_counter()
+            try:
+                while not stop.is_set():
+                    if self.PAUSE:
+                        time.sleep(0.01)
+                        next_step = time.perf_counter()
+                        continue
+                    self.simbox.simulate_frame()
+                    state = snapshot()
+                    with lock:
+                        published[:] = [published[1], state, time.perf_counter()]
+                    # fixed timestep. when the physics fall far behind, stop trying to catch up
+                    next_step += step
+                    delay = next_step - time.perf_counter()
+                    if delay > 0:
+                        time.sleep(delay)
+                    elif delay < -5 * step:
+                        next_step = time.perf_counter()
+            except BaseException as e:
+                errors.append(e)
+
+        published[1] = snapshot()
+        # draws the snapshots, so the live simbox is never read while the physics thread steps it
+        view = copy.copy(self)
+        view.simbox = SnapshotSimbox(self.simbox.radius, self.simbox.color, self.simbox.thickness)
+        view._rasterizer = None
 
-                # displays frame
-                self._display_frame(frame)
+        thread = threading.Thread(target=physics, daemon=True)
+        thread.start()
+        try:
+            while True:
+                self._handle_events()
+                if errors:
+                    raise errors[0]
 
+                with lock:
+                    previous, latest, published_at = published
+                positions, radii, colors, frame_number = latest
+                if self.interpolate and not self.PAUSE and previous is not None and len(previous[0]) == len(positions):
+                    # show the state between the last two frames, as far along as time went since the last one
+                    alpha = min((time.perf_counter() - published_at) * self.sim_rate, 1.)
+                    positions = previous[0] + (positions - previous[0]) * alpha
+                view.simbox.load_frame(positions, radii, colors, frame_number)
+                view.zoom, view.view_center = self.zoom, self.view_center
+
+                if view._renders_arrays():
+                    self._display_array(view.render_array())
+                else:
+                    self._display_frame(view.render_frame())
                 clock.tick(self.FPS)
+        finally:
+            # the physics thread may be in the midst of a long frame, don't wait for it (it's a daemon)
+            stop.set()
 
     def toggle_pause(self):
         self.PAUSE = not self.PAUSE
 
     def _display_frame(self, image):
+        import pygame as pg
 
         # convert from pillow.image to pg.image (pg.surface)
         image_data = image.tobytes()
@@ -64,49 +185,415 @@ class SimDisplayer(BaseRenderer):
         # Update the display
         pg.display.flip()
 
+    def _display_array(self, frame):
+        import pygame as pg
+        # the surface wraps the frame buffer itself, so it only has to be created again if the buffer is replaced
+        if self._surface_buffer is not frame:
+            self._surface = pg.image.frombuffer(frame, (self.size, self.size), 'RGB')
+            self._surface_buffer = frame
+
+        self.screen.blit(self._surface, (0, 0))
+        pg.display.flip()
+
     def close(self):
+        import pygame as pg
         pg.quit()
         sys.exit()
 
 class SimExporter(BaseRenderer):
-    def __init__(self, name, simbox, fps=30, resolution=5, seconds_to_run=20, quit_hotkey='q'):
-        super().__init__(simbox, resolution)
+    def __init__(self, name, simbox, fps=30, resolution=5, seconds_to_run=20, quit_hotkey='q',
+                 checkpoint_every=None, checkpoint_path=None, backend='pil', pipeline=False, render_workers=1,
+                 queue_size=8, lod=None, lod_size=1., zoom=1., view_center=(0, 0), export_workers=1):
+        super().__init__(simbox, resolution, backend, lod, lod_size, zoom, view_center)
         self.FPS = fps
         self.name = name
         self.seconds_to_run = seconds_to_run
         self.quit_hotkey = quit_hotkey
 
+        # saves a checkpoint of the simbox every "checkpoint_every" frames (and when quitting early), so a long
+        # export can be picked up again with simbox.load_checkpoint(checkpoint_path). None turns it off
+        self.checkpoint_every = checkpoint_every
+        self.checkpoint_path = checkpoint_path if checkpoint_path is not None else f"{name}.checkpoint.npz"
+
+        # runs simulating, rendering and encoding as separate stages on their own threads (see _run_pipeline).
+        # render_workers threads render frames, queue_size bounds the amount of frames waiting between two stages
+        self.pipeline = pipeline
+        self.render_workers = render_workers
+        self.queue_size = queue_size
+        # frames handled and busy time of each stage on the last pipelined export
+        self.stage_stats = {}
+
+        # renders and encodes the video on export_workers processes, one segment of the frames each, joined without
+        # encoding anything again at the end (see _run_segments). the physics run first, recorded into a trajectory,
+        # unless simbox already plays one back (ReplaySimbox)
+        self.export_workers = export_workers
+
         self.video_writer = None
+        # BGR array reused for converting every PIL frame for OpenCV
+        self._bgr = None
 
     def _initialize(self):
+        import cv2
         self.video_writer = cv2.VideoWriter(f"{self.name}.mp4", cv2.VideoWriter_fourcc(*'mp4v'), self.FPS,
                         (self.size, self.size))
 
     def run_sim(self):
+        if self.export_workers > 1:
+            self._run_segments()
+            self.close()
         self._initialize()
+        if self.pipeline:
+            self._run_pipeline()
+            self.close()
         c = 0
-        # progress bar var
-        max_blocks = 40
         while c < self.seconds_to_run * self.FPS:
             c += 1
-            percentage_done = c / (self.seconds_to_run * self.FPS)
-            # update the progress-bar
-            print('\r' + int(percentage_done * max_blocks) * '\u2588' + (max_blocks - int(percentage_done * max_blocks))*'-', end='')
+            self._print_progress(c)
 
             self.simbox.simulate_frame()
-            frame = self.render_frame()
+            frame = self._render_video_frame()
+            self._mark('render')
             self._write_frame(frame)
+            self._mark('encode')
+            if self.checkpoint_every and not c % self.checkpoint_every:
+                self.simbox.save_checkpoint(self.checkpoint_path)
+                self._mark('checkpoint')
             # early quitting... in case of long wait time )-:
-            if keyboard.is_pressed(self.quit_hotkey):
+            if self._quit_pressed():
+                if self.checkpoint_every:
+                    self.simbox.save_checkpoint(self.checkpoint_path)
                 self.close()
         self.close()
 
+    def _quit_pressed(self):
+        '''
+        polls the quit hotkey. keyboard (which needs root on linux) is only imported here, and never with
+        quit_hotkey=None, which exports without one (e.g. on headless machines)
+        :return: True if the quit hotkey is held down
+        '''
+        if self.quit_hotkey is None:
+            return False
+        import keyboard
+        return keyboard.is_pressed(self.quit_hotkey)
+
+    def _print_progress(self, c):
+        # progress bar var
+        max_blocks = 40
+        percentage_done = c / (self.seconds_to_run * self.FPS)
+        # update the progress-bar
+        print('\r' + int(percentage_done * max_blocks) * '\u2588' + (max_blocks - int(percentage_done * max_blocks))*'-', end='')
+
+    def _run_segments(self):
+        '''
+        exports the video in segments: the frames are cut into export_workers runs of frames, each rendered and encoded
+        into a file of its own by a worker process, and the files are joined into "name".mp4 without encoding anything
+        again (see mp4.py). the workers render from a trajectory (see trajectory.py): the one simbox plays back if it
+        is a ReplaySimbox, otherwise the physics are run first (in this process) and recorded into a temporary one.
+        (subclasses overriding render_frame draw ReplaySimboxes)
+        :return: None
+        '''
+        import copy, multiprocessing, os, queue, shutil, tempfile, time
+        from circle_simulation.trajectory import ReplaySimbox
+        from circle_simulation.mp4 import concat_mp4
+
+        frames = self.seconds_to_run * self.FPS
+        directory = tempfile.mkdtemp(prefix=os.path.basename(self.name) + '.', suffix='.segments',
+                                     dir=os.path.dirname(os.path.abspath(self.name)))
+        try:
+            if isinstance(self.simbox, ReplaySimbox):
+                trajectory, start = self.simbox.reader.path, self.simbox.frame_index
+                self.simbox.frame_index = min(start + frames, len(self.simbox.reader))
+            else:
+                trajectory, start = os.path.join(directory, 'trajectory'), 0
+                frames = self._record(trajectory, frames)
+                print()
+
+            wall_start = time.perf_counter()
+            workers = max(min(self.export_workers, frames), 1)
+            bounds = (np.arange(workers + 1) * frames // workers).tolist()
+            totals = [stop - first for first, stop in zip(bounds, bounds[1:])]
+            names = [os.path.join(directory, f"segment_{i:03d}") for i in range(workers)]
+            # the renderer as the workers get it, without the simbox and the video writer
+            renderer = copy.copy(self)
+            renderer.simbox, renderer.video_writer, renderer._rasterizer, renderer._bgr = None, None, None, None
+
+            context = multiprocessing.get_context()
+            # frames done by every worker, and (segment, None or the traceback of what went wrong) once one is done
+            progress = context.Array('q', workers)
+            results = context.Queue()
+            processes = [context.Process(target=_export_segment, args=(renderer, trajectory, start + bounds[i],
+                                                                        totals[i], names[i], progress, i, results),
+                                         daemon=True)
+                         for i in range(workers)]
+            for process in processes:
+                process.start()
+            try:
+                finished = 0
+                self._print_segments(progress[:], totals, redraw=False)
+                while finished < workers:
+                    try:
+                        index, error = results.get(timeout=0.2)
+                    except queue.Empty:
+                        if any(process.exitcode not in (0, None) for process in processes):
+                            raise RuntimeError("a worker of the export died")
+                    else:
+                        if error is not None:
+                            raise RuntimeError(f"segment {index + 1} of the export failed:\n{error}")
+                        finished += 1
+                    self._print_segments(progress[:], totals)
+            finally:
+                for process in processes:
+                    if process.is_alive():
+                        process.terminate()
+                    process.join()
+
+            concat_mp4([f"{name}.mp4" for name in names], f"{self.name}.mp4")
+            wall_time = time.perf_counter() - wall_start
+            print(f"{frames} frames in {wall_time:.2f}s ({frames / wall_time:.1f} frames/s) on {workers} workers")
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    def _record(self, path, frames):
+        '''
+        simulates the frames of the export, recording them into a trajectory (the first step of _run_segments)
+        :param path: trajectory directory to write
+        :param frames: amount of frames
+        :return: amount of frames recorded (fewer if the quit hotkey was pressed)
+        '''
+        from circle_simulation.trajectory import TrajectoryWriter
+        # recorded as is, so the frames come out exactly like the ones of an export without workers
+        with TrajectoryWriter(path, self.simbox, dtype=np.float64, metadata={'fps': self.FPS}) as writer:
+            for c in range(1, frames + 1):
+                self._print_progress(c)
+                self.simbox.simulate_frame()
+                writer.write_frame()
+                if self.checkpoint_every and not c % self.checkpoint_every:
+                    self.simbox.save_checkpoint(self.checkpoint_path)
+                # early quitting... exports what was simulated so far
+                if self._quit_pressed():
+                    if self.checkpoint_every:
+                        self.simbox.save_checkpoint(self.checkpoint_path)
+                    return c
+        return frames
+
+    def _print_segments(self, done, totals, redraw=True):
+        '''
+        progress bar of every worker of _run_segments, drawn over the previous ones
+        :param done: frames done by each worker
+        :param totals: frames of each worker's segment
+        :param redraw: whether to move back up over the bars printed last time
+        :return: None
+        '''
+        max_blocks = 40
+        lines = []
+        for i, (frames, total) in enumerate(zip(done + [sum(done)], totals + [sum(totals)])):
+            blocks = int(frames / total * max_blocks) if total else max_blocks
+            label = f"segment {i + 1}" if i < len(totals) else "total"
+            lines.append(f"{label:>11} " + blocks * '\u2588' + (max_blocks - blocks) * '-' + f" {frames}/{total}")
+        print((f"\x1b[{len(lines)}A" if redraw else '') + '\n'.join('\r' + line for line in lines), flush=True)
+
+    def _run_pipeline(self):
+        '''
+        runs the export as 3 stages connected by bounded queues:
+            simulate (this thread) -> render (render_workers threads) -> encode (one thread)
+        a full queue blocks the stage feeding it, so no stage gets more than queue_size frames ahead of the next one.
+        rendering works on snapshots of the circles (positions, radii, colors and current_frame, see SnapshotSimbox)
+        so the physics can go on with the next frame in the meantime. frames are written in order no matter which
+        render worker finishes first.
+        :return: None
+        '''
+        import copy, queue, threading, time
+        from circle_simulation.trajectory import SnapshotSimbox
+
+        snapshots = queue.Queue(self.queue_size)
+        frames = queue.Queue(self.queue_size)
+        # set when a stage fails, tells every other stage to give up
+        stop = threading.Event()
+        errors = []
+        # marks the end of the frames on a queue
+        end = object()
+        self.stage_stats = {stage: {'frames': 0, 'seconds': 0.} for stage in ('simulate', 'render', 'encode')}
+        lock = threading.Lock()
+
+        def record(stage, start):
+            with lock:
+                self.stage_stats[stage]['frames'] += 1
+                self.stage_stats[stage]['seconds'] += time.perf_counter() - start
+
+        def put(q, item):
+            # waits for room on the queue, unless the pipeline is stopped
+            while not stop.is_set():
+                try:
+                    q.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def get(q):
+            # waits for the next item, None if the pipeline is stopped
+            while not stop.is_set():
+                try:
+                    return q.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+            return None
+
+        def render():
+            # every worker renders with its own copy of the renderer and its own snapshot of the scene
+            renderer = copy.copy(self)
+            renderer.simbox = SnapshotSimbox(self.simbox.radius, self.simbox.color, self.simbox.thickness)
+            renderer._rasterizer = None
+            try:
+                while True:
+                    item = get(snapshots)
+                    if item is None or item is end:
+                        break
+                    index, state = item
+                    start = time.perf_counter()
+                    renderer.simbox.load_frame(*state)
+                    frame = renderer._render_video_frame()
+                    if isinstance(frame, np.ndarray):
+                        # the worker's frame buffer is drawn over by its next frame
+                        frame = frame.copy()
+                    record('render', start)
+                    if not put(frames, (index, frame)):
+                        break
+                put(frames, end)
+            except BaseException as e:
+                errors.append(e)
+                stop.set()
+
+        def encode():
+            # frames that arrived before the ones preceding them
+            pending = {}
+            next_index = 0
+            finished = 0
+            try:
+                while finished < self.render_workers:
+                    item = get(frames)
+                    if item is None:
+                        return
+                    if item is end:
+                        finished += 1
+                        continue
+                    index, frame = item
+                    pending[index] = frame
+                    while next_index in pending:
+                        start = time.perf_counter()
+                        self._write_frame(pending.pop(next_index))
+                        record('encode', start)
+                        next_index += 1
+            except BaseException as e:
+                errors.append(e)
+                stop.set()
+
+        threads = [threading.Thread(target=render, daemon=True) for _ in range(self.render_workers)]
+        threads.append(threading.Thread(target=encode, daemon=True))
+        for thread in threads:
+            thread.start()
+
+        wall_start = time.perf_counter()
+        try:
+            for c in range(1, self.seconds_to_run * self.FPS + 1):
+                self._print_progress(c)
+                start = time.perf_counter()
+                self.simbox.simulate_frame()
+                sim = self.simbox
+                state = (sim.get_positions(), sim.get_radii(), sim.get_colors(), sim.current_frame)
+                record('simulate', start)
+                if not put(snapshots, (c - 1, state)):
+                    break
+                if self.checkpoint_every and not c % self.checkpoint_every:
+                    self.simbox.save_checkpoint(self.checkpoint_path)
+                # early quitting... in case of long wait time )-:
+                if self._quit_pressed():
+                    if self.checkpoint_every:
+                        self.simbox.save_checkpoint(self.checkpoint_path)
+                    break
+            for _ in range(self.render_workers):
+                put(snapshots, end)
+        except BaseException:
+            stop.set()
+            raise
+        finally:
+            for thread in threads:
+                thread.join()
+        if errors:
+            raise errors[0]
+        self._report_stages(time.perf_counter() - wall_start)
+
+    def _report_stages(self, wall_time):
+        '''
+        prints the throughput of every stage of the last pipelined export. the slowest stage sets the pace of the
+        whole export
+        :param wall_time: seconds the whole export took
+        :return: None
+        '''
+        print()
+        throughput = {}
+        for stage, stats in self.stage_stats.items():
+            workers = self.render_workers if stage == 'render' else 1
+            per_frame = stats['seconds'] / stats['frames'] if stats['frames'] else 0
+            throughput[stage] = workers / per_frame if per_frame else float('inf')
+            print(f"{stage:>8}: {stats['frames']} frames, {1000 * per_frame:.2f} ms/frame, "
+                  f"{throughput[stage]:.1f} frames/s")
+        frames = self.stage_stats['encode']['frames']
+        print(f"   total: {frames} frames in {wall_time:.2f}s ({frames / wall_time:.1f} frames/s), "
+              f"bottleneck: {min(throughput, key=throughput.get)}")
+
+    def _render_video_frame(self):
+        '''
+        :return: the current frame for _write_frame. a BGR array drawn by the rasterizer in the channel order OpenCV
+                 expects where possible (see BaseRenderer._renders_arrays), the PIL image of render_frame otherwise
+        '''
+        if self._renders_arrays():
+            return self.render_array(channels='BGR')
+        return self.render_frame()
+
     def _write_frame(self, frame):
-        # Convert PIL image to NumPy array
-        frame_array = cv2.cvtColor(np.array(frame), cv2.COLOR_RGB2BGR)
-        self.video_writer.write(frame_array)
+        if isinstance(frame, np.ndarray):
+            # already BGR (see _render_video_frame)
+            self.video_writer.write(frame)
+            return
+        import cv2
+        # Convert PIL image to NumPy array, into the same BGR array every frame
+        self._bgr = cv2.cvtColor(np.asarray(frame), cv2.COLOR_RGB2BGR, dst=self._bgr)
+        self.video_writer.write(self._bgr)
 
     def close(self):
-        self.video_writer.release()
+        if self.video_writer is not None:
+            self.video_writer.release()
         sys.exit()
 
+def _export_segment(renderer, trajectory, start, frames, name, progress, index, results):
+    '''
+    renders and encodes one segment of SimExporter._run_segments (in a worker process)
+    :param renderer: copy of the SimExporter, without simbox and video writer
+    :param trajectory: trajectory directory to render
+    :param start: first recorded frame of the segment
+    :param frames: amount of frames of the segment
+    :param name: file to write (without .mp4)
+    :param progress: shared array of the frames done by every worker
+    :param index: index of the segment
+    :param results: queue to report (index, None or the traceback of what went wrong) on
+    :return: None
+    '''
+    try:
+        from circle_simulation.trajectory import ReplaySimbox
+        replay = ReplaySimbox(trajectory)
+        # frames past the end of the recording show its last one, like an export without workers
+        replay.frame_index = min(start, max(len(replay.reader) - 1, 0))
+        renderer.simbox = replay
+        renderer.name = name
+        renderer._initialize()
+        for c in range(frames):
+            replay.simulate_frame()
+            renderer._write_frame(renderer._render_video_frame())
+            progress[index] = c + 1
+        renderer.video_writer.release()
+        results.put((index, None))
+    except BaseException:
+        import traceback
+        results.put((index, traceback.format_exc()))
+
@@ -0,0 +1,128 @@
+'''
+Sleeping of settled circles (sleep_speed and sleep_steps of BaseSimbox and VectorSimbox).
+
+A circle moving slower than sleep_speed for sleep_steps sub-steps in a row is ready to sleep. Circles ready to sleep
+that touch each other form an island, which falls asleep as a whole, unless one of its circles touches a circle that
+is still moving. Sleeping circles stop (their vector is set to 0) and are left out of the sub-steps: collisions,
+integration and clean-up skip them, and VectorSimbox only runs the broad phase on them where awake circles are close.
+As soon as an awake circle touches a sleeping one, the whole island of the sleeping circle wakes up and takes part in
+that same sub-step (in VectorSimbox, circles of the island far from any awake circle only get their contacts from the
+next sub-step on, they are standing still until then).
+Only used in the discrete collision mode.
+'''
+import numpy as np
+from circle_simulation.broad_phase import SLACK
+
+def near_awake(positions, radii, asleep):
+    '''
+    :param positions: (n, 2) array of circle positions
+    :param radii: (n,) array of circle radii
+    :param asleep: (n,) mask of the sleeping circles
+    :return: mask of the circles the broad phase has to look at: the awake ones, the sleeping ones close enough to
+             an awake circle to touch it, and the ones close enough to those to touch them once they wake up
+    '''
+    awake = ~asleep
+    n = len(positions)
+    if awake.all() or not awake.any():
+        return awake
+    # circles that touch are in the same or in neighboring cells of a grid with cells as large as the largest
+    # circle (fewer, larger cells when that would make too many of them)
+    low = positions.min(axis=0)
+    extent = float(np.ptp(positions, axis=0).max())
+    cell_size = max(2 * float(radii.max()) * (1 + SLACK), extent / np.sqrt(4 * n), 1e-12)
+    cells = np.floor((positions - low) / cell_size).astype(np.intp) + 2
+    occupied = np.zeros(tuple(cells.max(axis=0) + 3), dtype=bool)
+    occupied[cells[awake, 0], cells[awake, 1]] = True
+    # cells up to two cells away from an awake circle
+    for _ in range(2):
+        near = occupied.copy()
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                near[1:-1, 1:-1] |= occupied[1 + dx:near.shape[0] - 1 + dx, 1 + dy:near.shape[1] - 1 + dy]
+        occupied = near
+    return occupied[cells[:, 0], cells[:, 1]]
+
+def wake_islands(asleep, rest_steps, islands, rows):
+    '''
+    wakes the circles "rows" and every other circle of their islands. the arrays are updated in place
+    :param asleep: (n,) mask of the sleeping circles
+    :param rest_steps: (n,) sub-steps each circle has been resting for
+    :param islands: (n,) island of every sleeping circle (-1 for awake circles)
+    :param rows: circles to wake
+    :return: mask of the circles woken
+    '''
+    woken = asleep & np.isin(islands, np.unique(islands[rows]))
+    asleep[woken] = False
+    rest_steps[woken] = 0
+    islands[woken] = -1
+    return woken
+
+def wake_touched(first, second, asleep, rest_steps, islands):
+    '''
+    wakes the islands of sleeping circles touching awake ones (again and again, as woken circles may touch other
+    islands). the arrays are updated in place
+    :param first: first circle of every pair of touching circles
+    :param second: second circle of every pair
+    (asleep, rest_steps and islands see wake_islands)
+    :return: mask of the pairs between awake circles (pairs of sleeping circles are left out of the sub-step), and
+             whether any circle was woken
+    '''
+    woke = False
+    while True:
+        hit = asleep[first] != asleep[second]
+        if not hit.any():
+            return ~asleep[first], woke
+        wake_islands(asleep, rest_steps, islands, np.where(asleep[first[hit]], first[hit], second[hit]))
+        woke = True
+
+def components(n, first, second):
+    '''
+    :param n: amount of circles
+    :param first: first circle of every pair of touching circles
+    :param second: second circle of every pair
+    :return: (n,) label of every circle, the same for all circles connected through touching pairs (the lowest row
+             among them)
+    '''
+    labels = np.arange(n)
+    while True:
+        low = np.minimum(labels[first], labels[second])
+        new = labels.copy()
+        np.minimum.at(new, first, low)
+        np.minimum.at(new, second, low)
+        # follow the labels to the circles they point at (every label is a row of the same group)
+        new = new[new]
+        if np.array_equal(new, labels):
+            return labels
+        labels = new
+
+def settle(speeds, asleep, rest_steps, islands, first, second, sleep_speed, sleep_steps):
+    '''
+    counts the sub-steps every awake circle has been resting for, and puts the islands of circles ready to sleep to
+    sleep. the arrays are updated in place
+    :param speeds: (n,) speed of every circle after the sub-step
+    (asleep, rest_steps and islands see wake_islands)
+    :param first: first circle of every pair of touching circles of the sub-step
+    :param second: second circle of every pair
+    :param sleep_speed: speed below which a circle is resting
+    :param sleep_steps: sub-steps a circle has to rest for before it can fall asleep
+    :return: array of the circles that fell asleep
+    '''
+    n = len(speeds)
+    awake = ~asleep
+    rest_steps[awake] = np.where(speeds[awake] < sleep_speed, rest_steps[awake] + 1, 0)
+    ready = awake & (rest_steps >= sleep_steps)
+    if not ready.any():
+        return np.zeros(0, dtype=np.intp)
+
+    # islands of circles ready to sleep. islands touching a circle that's still moving stay awake
+    both = ready[first] & ready[second]
+    labels = components(n, first[both], second[both])
+    edge = ready[first] != ready[second]
+    blocked = np.zeros(n, dtype=bool)
+    blocked[labels[np.where(ready[first[edge]], first[edge], second[edge])]] = True
+    sleepers = np.nonzero(ready & ~blocked[labels])[0]
+    if len(sleepers):
+        _, island = np.unique(labels[sleepers], return_inverse=True)
+        asleep[sleepers] = True
+        islands[sleepers] = max(int(islands.max()) + 1, 0) + island
+    return sleepers
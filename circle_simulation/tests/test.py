@@ -41,10 +41,154 @@ class Tests:
         #SimDisplayer(simbox=sim, resolution=5, fps=30).run_live_sim()
         SimExporter("test_004", sim, seconds_to_run=4).run_sim()
 
+    def test_vector_engine(self):
+        # same scene as test_stress_test, stepped by the array-backed engine
+        import random
+        from circle_simulation.vector_simulation import VectorSimbox
+        amount = 500
+        radius = 100
+        positions = random_vectors_in_circle(amount, radius)
+        sim = VectorSimbox(radius=radius, boundary_color=(255, 255, 255), boundary_thickness=1, steps_per_frame=1,
+                           amount=amount, positions=positions, sizes=[2 for _ in range(amount)],
+                           speeds=[1 for _ in range(amount)], angles=[random.random() * 6.28 for _ in range(amount)],
+                           vectors=None, weights=[1 for _ in range(amount)], damping=[0.2 for _ in range(amount)],
+                           colors=[(60, 120, 250) for _ in range(amount)])
+        SimExporter("test_005", sim, seconds_to_run=4).run_sim()
+
+    def test_headless_run(self):
+        # 10 seconds worth of frames at 30 fps, no rendering
+        recorded = self.basic_scene.run(300)
+        print("positions", recorded['positions'].shape, "collisions", recorded['collisions'].sum())
+
+    def test_replay(self):
+        # simulate once, render twice at different resolutions from the recording
+        from circle_simulation.trajectory import record_trajectory, ReplaySimbox
+        record_trajectory(self.basic_scene, "test_006.traj", frames=300)
+        SimExporter("test_006_low", ReplaySimbox("test_006.traj"), resolution=2, seconds_to_run=10).run_sim()
+        SimExporter("test_006_high", ReplaySimbox("test_006.traj"), resolution=8, seconds_to_run=10).run_sim()
+
+    def test_checkpoint_roundtrip(self):
+        # saving, loading into a fresh simbox and stepping on gives exactly what the uninterrupted run gives
+        import os, tempfile
+        import numpy as np
+        from circle_simulation.vector_simulation import VectorSimbox
+        from circle_simulation.extras import uniform_in_disk, random_vectors
+        for simbox in (BaseSimbox, VectorSimbox):
+            def scene(amount):
+                sim = simbox(radius=60, boundary_color=(255, 255, 255), boundary_thickness=1, steps_per_frame=2,
+                             amount=0)
+                if amount:
+                    sim.add_circles(uniform_in_disk(amount, 55, seed=0), 2, vectors=random_vectors(amount, 1.5, seed=1),
+                                    damping=0.1)
+                return sim
+            path = os.path.join(tempfile.mkdtemp(), "test_checkpoint.npz")
+            original = scene(200)
+            original.run(10)
+            original.save_checkpoint(path)
+            original.run(10)
+            resumed = scene(0)
+            resumed.load_checkpoint(path)
+            resumed.run(10)
+            os.remove(path)
+            assert np.array_equal(resumed.get_positions(), original.get_positions())
+            assert np.array_equal(resumed.get_vectors(), original.get_vectors())
+            assert np.array_equal(resumed.get_ids(), original.get_ids())
+            assert resumed.current_frame == original.current_frame
+            assert resumed.number_of_collisions == original.number_of_collisions
+            print(simbox.__name__, "resumed run is identical after", original.current_frame, "sub-steps")
+
+    def test_circle_ids(self):
+        # ids follow their circles through swap-removes, and ids of removed circles are handed out again
+        import numpy as np
+        from circle_simulation.vector_simulation import VectorSimbox
+        for simbox in (BaseSimbox, VectorSimbox):
+            sim = simbox(radius=100, boundary_color=(255, 255, 255), boundary_thickness=1, steps_per_frame=1, amount=0)
+            positions = np.stack((np.arange(10) * 10. - 45, np.zeros(10)), axis=1)
+            ids = sim.add_circles(positions, 2)
+            assert ids.tolist() == list(range(10))
+            position_of = dict(zip(ids.tolist(), positions.tolist()))
+
+            removed = [2, 5, 9]
+            sim.remove_circles(removed)
+            left = [i for i in range(10) if i not in removed]
+            assert sorted(sim.get_ids().tolist()) == left and sim.get_ids().tolist() != left
+            for circle_id in left:
+                circle = sim.get_circle(circle_id)
+                assert circle.circle_id == circle_id and circle.position.tolist() == position_of[circle_id]
+            for circle_id in removed:
+                try:
+                    sim.get_circle(circle_id)
+                    raise AssertionError(f"removed circle {circle_id} is still there")
+                except KeyError:
+                    pass
+
+            # the freed ids come back (last freed first), only then new ones
+            new = sim.add_circles(np.zeros((4, 2)), 1)
+            assert new.tolist() == [9, 5, 2, 10]
+            assert sorted(sim.get_ids().tolist()) == list(range(11))
+            for circle_id in new.tolist():
+                assert sim.get_circle(circle_id).radius == 1
+            print(simbox.__name__, "ids after removing and adding:", sim.get_ids().tolist())
+
+    def test_collision_response(self):
+        # the response since pairs are resolved once (see the README), against what the first versions did
+        import numpy as np
+        from circle_simulation.vector_simulation import VectorSimbox
+        from circle_simulation.extras import poisson_disk, random_vectors
+        for simbox in (BaseSimbox, VectorSimbox):
+            def scene(radius, positions, circle_radius, vectors):
+                sim = simbox(radius=radius, boundary_color=(255, 255, 255), boundary_thickness=1, steps_per_frame=1,
+                             amount=0)
+                sim.add_circles(positions, circle_radius, vectors=vectors)
+                return sim
+
+            # a resting pair overlapping by 1: each circle moves out by 0.5. (the first versions moved the first circle
+            # by the overlap times the offset between the centers, to (-3, 0), and left the second one where it was)
+            sim = scene(50, np.array([[0., 0.], [3., 0.]]), 2, np.zeros((2, 2)))
+            sim.simulate_frame()
+            assert np.allclose(sim.get_positions(), [[-0.5, 0.], [3.5, 0.]])
+
+            # an overlapping pair already moving apart keeps its vectors. (the first versions exchanged momentum anyway,
+            # turning both circles back into each other)
+            sim = scene(50, np.array([[0., 0.], [3., 0.]]), 2, np.array([[-0.1, 0.], [0.1, 0.]]))
+            sim.simulate_frame()
+            assert np.array_equal(sim.get_vectors(), [[-0.1, 0.], [0.1, 0.]])
+            assert np.allclose(sim.get_positions(), [[-0.5, 0.], [3.5, 0.]])
+
+            # a dense elastic scene keeps most of its energy. (about 80% with the first versions, and it grew without
+            # bound when separating pairs still exchanged momentum with the half-overlap push)
+            positions = poisson_disk(55, 3.9, 300, seed=0)
+            sim = scene(60, positions, 2, random_vectors(len(positions), 1, seed=1))
+            energy = (sim.get_vectors() ** 2).sum()
+            sim.run(30)
+            ratio = (sim.get_vectors() ** 2).sum() / energy
+            print(simbox.__name__, "energy after 30 frames", ratio)
+            assert 0.85 < ratio < 1.05
+
     def test_steps_per_frame(self):
         self.basic_scene.steps_per_frame = 5 # test for 1, 5, 50, 5000
         SimDisplayer(simbox=self.basic_scene).run_live_sim()
 
+    def test_grid_size(self):
+        # cells smaller than the circles. each circle is then checked against cells further away
+        self.basic_scene.broad_phase = 'grid'
+        self.basic_scene.grid_size = 2
+        SimDisplayer(simbox=self.basic_scene).run_live_sim()
+
+    def test_mixed_sizes(self):
+        # a few big circles among many small ones. 'auto' should stay away from the uniform grid here
+        import random
+        amount = 300
+        sizes = [30 if i % 50 == 0 else 3 for i in range(amount)]
+        sim = BaseSimbox(radius=200, boundary_color=(255, 255, 255), boundary_thickness=1, steps_per_frame=1,
+                         amount=amount, positions=random_vectors_in_circle(amount, 170), sizes=sizes,
+                         speeds=[1 for _ in range(amount)], angles=[random.random() * 6.28 for _ in range(amount)],
+                         vectors=None, weights=sizes, damping=[0 for _ in range(amount)],
+                         colors=[(60, 120, 250) for _ in range(amount)], broad_phase='auto')
+        sim.simulate_frame()
+        print("broad phase chosen:", sim.broad_phase_used)
+        SimDisplayer(simbox=sim, resolution=2).run_live_sim()
+
     def test_adding_circle(self):
         class AddCircle(BaseSimbox):
             def simulate_frame(self):
@@ -81,10 +225,202 @@ class Tests:
             c.vector *= 10
         SimDisplayer(simbox=self.basic_scene).run_live_sim()
 
+    def test_continuous_high_speeds(self):
+        # same as test_high_speeds, but collisions are resolved at their exact time. nothing tunnels at 1 step per frame
+        for c in self.basic_scene.circles:
+            c.vector *= 10
+        self.basic_scene.collision_mode = 'continuous'
+        SimDisplayer(simbox=self.basic_scene).run_live_sim()
+
+    def test_continuous_neighbours(self):
+        # a heavy circle knocks a resting one into a third: the resting circles aren't neighbours at the start of the
+        # step (their disks don't overlap), the collision still happens once the knocked circle gets its new disk
+        import numpy as np
+        from circle_simulation.continuous import advance
+        positions = np.array([[-30., 0.], [-20., 0.], [-14., 0.]])
+        vectors = np.array([[10., 0.], [0., 0.], [0., 0.]])
+        first, second, walls, _ = advance(positions, vectors, np.array([2., 1., 1.]), np.array([100., 1., 1.]),
+                                          np.ones(3), 100, 1.)
+        print("collisions", list(zip(first.tolist(), second.tolist())), "positions", positions.tolist())
+        assert [tuple(sorted(pair)) for pair in zip(first.tolist(), second.tolist())][:2] == [(0, 1), (1, 2)]
+        assert np.sqrt(((positions[1] - positions[2]) ** 2).sum()) >= 2 - 1e-9
+
+    def test_continuous_restitution(self):
+        # a circle catching up with one that loses most of its energy in the collision: the scaled vectors alone would
+        # still bring them together, the pair collides once and separates with the momentum the collision left
+        import numpy as np
+        from circle_simulation.continuous import advance
+        positions = np.array([[0., 0.], [2.5, 0.]])
+        vectors = np.array([[1., 0.], [0.5, 0.]])
+        first, _, _, _ = advance(positions, vectors, np.ones(2), np.ones(2), np.array([1., 0.1]), 100, 1.)
+        print("collisions", len(first), "vectors", vectors.tolist())
+        assert len(first) == 1
+        assert np.isclose(vectors[:, 0].sum(), 0.5 * 1 + 1 * 0.1)
+        assert np.isclose(vectors[1, 0] - vectors[0, 0], 0.1 * 0.5)
+
     def test_damping(self):
         for c in self.basic_scene.circles:
             c.damping = 0.2
         SimDisplayer(simbox=self.basic_scene).run_live_sim()
 
+    def test_sleeping(self):
+        # damped gas cooling down. frames should get cheaper as more and more circles fall asleep
+        import time
+        from circle_simulation.vector_simulation import VectorSimbox
+        from circle_simulation.extras import uniform_in_disk, random_vectors
+        sim = VectorSimbox(radius=300, boundary_color=(255, 255, 255), boundary_thickness=1, steps_per_frame=4, amount=0,
+                           sleep_speed=0.05, sleep_steps=20)
+        sim.add_circles(uniform_in_disk(3000, 250, seed=0), 3, vectors=random_vectors(3000, 1, seed=1), damping=0.3)
+        for c in range(8):
+            start = time.perf_counter()
+            sim.run(50)
+            print("frames", c * 50, "asleep", sim.store.asleep[:sim.store.size].sum(),
+                  "seconds", round(time.perf_counter() - start, 3))
+
+    def test_sleeping_state(self):
+        # a row of resting circles falls asleep and stays put, the one hit by a moving circle wakes up, and the run
+        # ends exactly where the same run without sleeping does
+        import numpy as np
+        from circle_simulation.vector_simulation import VectorSimbox
+        for simbox in (BaseSimbox, VectorSimbox):
+            def scene(sleep_speed):
+                sim = simbox(radius=100, boundary_color=(255, 255, 255), boundary_thickness=1, steps_per_frame=2,
+                             amount=0, sleep_speed=sleep_speed, sleep_steps=5)
+                sim.add_circles(np.stack((np.arange(7) * 10. - 30, np.zeros(7)), axis=1), 3, vectors=np.zeros((7, 2)))
+                # heading straight for the middle one of the row
+                sim.add_circles(np.array([[0., 50.]]), 3, vectors=np.array([[0., -2.]]))
+                return sim
+            sleeping, awake = scene(0.01), scene(None)
+            start = sleeping.get_positions()
+
+            sleeping.run(10)
+            awake.run(10)
+            assert [circle.asleep for circle in sleeping.circles] == [True] * 7 + [False]
+            assert np.array_equal(sleeping.get_positions()[:7], start[:7])
+
+            sleeping.run(30)
+            awake.run(30)
+            # the middle circle got hit and moves on, the moving one stopped and fell asleep in its place
+            assert [circle.asleep for circle in sleeping.circles] == [True] * 3 + [False] + [True] * 4
+            assert sleeping.get_positions()[3, 1] < -10
+            assert np.array_equal(np.delete(sleeping.get_positions(), [3, 7], axis=0), np.delete(start, [3, 7], axis=0))
+            assert np.array_equal(sleeping.get_positions(), awake.get_positions())
+            assert np.array_equal(sleeping.get_vectors(), awake.get_vectors())
+            print(simbox.__name__, "sleeping run matches the run without sleeping")
+
+    def test_barnes_hut_accuracy(self):
+        # the approximated field against the sum over every pair, relative to a typical field
+        import numpy as np
+        from circle_simulation.forces import barnes_hut, exact_field
+        rng = np.random.default_rng(0)
+        positions = rng.normal(size=(2000, 2)) * 50
+        for sources in (rng.random(2000) + 0.5, rng.choice([-1., 1.], 2000)):
+            exact = exact_field(positions, sources)
+            typical = np.median(np.sqrt((exact ** 2).sum(axis=1)))
+            assert np.abs(barnes_hut(positions, sources, theta=0) - exact).max() < 1e-9 * typical
+            for theta, mean_error in ((0.2, 0.002), (0.45, 0.025), (0.7, 0.1)):
+                error = np.sqrt(((barnes_hut(positions, sources, theta) - exact) ** 2).sum(axis=1)) / typical
+                print("theta", theta, "mean error", error.mean(), "max error", error.max())
+                assert error.mean() < mean_error
+
+    def test_charges_by_id(self):
+        # charges stay with their circles when a removal moves the last circle into the gap, and a circle added later
+        # (which takes over the id of the removed one) gets its own. one frame from rest gives the acceleration of every
+        # circle as its vector
+        import numpy as np
+        from circle_simulation.forces import Electrostatics, exact_field
+        from circle_simulation.vector_simulation import VectorSimbox
+        positions = np.array([[-40., 0.], [0., 30.], [35., -10.], [0., -45.]])
+        for simbox in (BaseSimbox, VectorSimbox):
+            charges = {0: 4., 1: -2., 2: 1., 3: 3.}
+            electrostatics = Electrostatics(list(charges.values()), theta=0)
+            sim = simbox(radius=100, boundary_color=(255, 255, 255), boundary_thickness=1, steps_per_frame=1, amount=4,
+                         positions=positions, sizes=[2] * 4, speeds=[0] * 4, angles=[0] * 4, vectors=None,
+                         weights=[1, 2, 1, 3], damping=[0] * 4, colors=[(60, 120, 250)] * 4,
+                         forces=[electrostatics])
+            sim.remove_circles([0])
+            added = sim.add_circles(np.array([[20., 20.]]), 2, speeds=0, weights=2)
+            electrostatics.set_charges(added, -5.)
+            charges[added[0]] = -5.
+            ids = sim.get_ids()
+            expected_positions, weights = sim.get_positions(), sim.get_weights()
+            sim.simulate_frame()
+            id_charges = np.array([charges[i] for i in ids.tolist()])
+            expected = -(id_charges / weights)[:, None] * exact_field(expected_positions, id_charges)
+            print(simbox.__name__, "ids", ids, "largest error", np.abs(sim.get_vectors() - expected).max())
+            assert np.allclose(sim.get_vectors(), expected, rtol=1e-12, atol=0)
+
+    def test_sprite_zoom(self):
+        # zoomed in views, with circles hanging off the edges of the frame and circles wider than it, come out of the
+        # sprite backend exactly like out of pil
+        import numpy as np
+        from circle_simulation.base_simulation import BaseRenderer
+        from circle_simulation.extras import uniform_in_disk
+        from circle_simulation.rasterizer import SpriteRasterizer
+        rng = np.random.default_rng(0)
+        sim = BaseSimbox(radius=50, boundary_color=(255, 255, 255), boundary_thickness=1, steps_per_frame=1, amount=0)
+        sim.add_circles(uniform_in_disk(200, 45, seed=0), rng.uniform(0.5, 4, 200), colors=(60, 120, 250))
+        sim.add_circles(np.array([[0., 0.]]), 8, colors=(60, 120, 250))
+        for zoom, view_center in ((1, (0, 0)), (2.5, (10, -7.3)), (6, (30, 3)), (5, (0, 0))):
+            pil = BaseRenderer(sim, resolution=3, zoom=zoom, view_center=view_center).render_array()
+            sprite = BaseRenderer(sim, resolution=3, zoom=zoom, view_center=view_center, backend='sprite').render_array()
+            print("zoom", zoom, "differing pixels", (pil != sprite).any(axis=2).sum())
+            assert np.array_equal(pil, sprite)
+        # only the most recently used sprites are kept
+        rasterizer = SpriteRasterizer(100, max_sprites=2)
+        for width in (4, 6, 8, 6):
+            rasterizer.render([10.], [10.], [10. + width], [10. + width], [(255, 0, 0)])
+        assert list(rasterizer.sprites) == [(8, 8), (6, 6)]
+
+    def test_sprite_backend(self):
+        # the same crowded scene of overlapping circles in many sizes and colors drawn by both backends: the circle drawn
+        # last ends up on top with either
+        import numpy as np
+        from circle_simulation.base_simulation import BaseRenderer
+        from circle_simulation.extras import uniform_in_disk
+        rng = np.random.default_rng(1)
+        sim = BaseSimbox(radius=50, boundary_color=(255, 255, 255), boundary_thickness=1, steps_per_frame=1, amount=0)
+        sim.add_circles(uniform_in_disk(400, 45, seed=1), rng.uniform(0.5, 5, 400), colors=rng.integers(0, 256, (400, 3)))
+        for channels in ('RGB', 'BGR'):
+            for zoom, view_center in ((1, (0, 0)), (3, (20, -10))):
+                pil = BaseRenderer(sim, resolution=4, zoom=zoom, view_center=view_center).render_array(channels)
+                sprite = BaseRenderer(sim, resolution=4, zoom=zoom, view_center=view_center,
+                                      backend='sprite').render_array(channels)
+                print(channels, "zoom", zoom, "differing pixels", (pil != sprite).any(axis=2).sum())
+                assert np.array_equal(pil, sprite)
+
+    def test_parallel_export(self):
+        # the same scene exported in one go and on two workers. the joined file has every frame, lasts as long, starts
+        # every segment on a key frame, and its first segment is exactly the serial export
+        import cv2
+        import numpy as np
+        from circle_simulation.mp4 import track_info
+
+        def export(name, workers):
+            try:
+                SimExporter(name, Tests().basic_scene, seconds_to_run=2, quit_hotkey=None,
+                            export_workers=workers).run_sim()
+            except SystemExit:
+                pass
+            capture = cv2.VideoCapture(f"{name}.mp4")
+            assert capture.get(cv2.CAP_PROP_FPS) == 30
+            frames = []
+            while True:
+                ok, frame = capture.read()
+                if not ok:
+                    return frames
+                frames.append(frame)
+
+        serial = export("test_007", 1)
+        parallel = export("test_007_parallel", 2)
+        assert len(serial) == len(parallel) == 60
+        info = track_info("test_007_parallel.mp4")
+        assert info['frames'] == 60 and info['seconds'] == info['movie_seconds'] == 2
+        assert {0, 30} <= set(info['key_frames'].tolist())
+        assert all(np.array_equal(a, b) for a, b in zip(serial[:30], parallel[:30]))
+        # later segments start on a key frame of their own, so they only match the serial export up to the encoding
+        print("mean difference of the second segment", np.mean([np.abs(a.astype(int) - b).mean()
+                                                                  for a, b in zip(serial[30:], parallel[30:])]))
+
 if __name__ == '__main__':
     Tests().test_display_ability()
\ No newline at end of file
@@ -0,0 +1,216 @@
+'''
+Trajectory files: a recording of what a simulation looked like on every frame, so it can be rendered any number of
+times (at any resolution / fps) without running the physics again.
+
+A trajectory is a directory:
+    header.json           radius, boundary color and thickness of the simbox, amount of frames, chunks...
+    chunk_00000/          frames [0, chunk_frames)
+        offsets.npy       (frames + 1,) rows of frame k are offsets[k]:offsets[k+1] of the arrays below
+        positions.npy     (rows, 2) positions of the circles
+        radii.npy         (rows,) radii of the circles
+        colors.npy        (rows, 3) colors of the circles
+        frame_numbers.npy (frames,) simbox.current_frame of every frame
+    chunk_00001/ ...
+
+Each frame may hold a different amount of circles. All arrays are plain .npy files, opened memory-mapped on read.
+'''
+import json
+import os
+import numpy as np
+from circle_simulation.vector_simulation import VectorSimbox
+
+FORMAT_VERSION = 1
+
+class TrajectoryWriter:
+    '''
+    records frames of a simbox into a trajectory directory.
+    Usage:
+        with TrajectoryWriter("scene.traj", sim) as writer:
+            for _ in range(frames):
+                sim.simulate_frame()
+                writer.write_frame()
+    '''
+    def __init__(self, path, simbox, chunk_frames=256, dtype=np.float32, metadata=None):
+        '''
+        :param path: directory to write to (created if missing)
+        :param simbox: simbox to record (any BaseSimbox)
+        :param chunk_frames: amount of frames per chunk
+        :param dtype: dtype of positions and radii on disk
+        :param metadata: optional dict saved in the header, e.g. {'fps': 30}
+        '''
+        self.path = path
+        self.simbox = simbox
+        self.chunk_frames = chunk_frames
+        self.dtype = np.dtype(dtype)
+        self.metadata = metadata or {}
+
+        self.frames = 0
+        self.chunks = []
+        # frames of the chunk being filled
+        self._buffer = []
+        os.makedirs(path, exist_ok=True)
+
+    def write_frame(self):
+        '''
+        records the current state of the simbox as the next frame
+        :return: None
+        '''
+        sim = self.simbox
+        self._buffer.append((sim.get_positions().astype(self.dtype), sim.get_radii().astype(self.dtype),
+                             sim.get_colors(), sim.current_frame))
+        self.frames += 1
+        if len(self._buffer) == self.chunk_frames:
+            self._flush()
+
+    def _flush(self):
+        if not self._buffer:
+            return
+        positions, radii, colors, frame_numbers = zip(*self._buffer)
+        directory = os.path.join(self.path, f"chunk_{len(self.chunks):05d}")
+        os.makedirs(directory, exist_ok=True)
+        offsets = np.zeros(len(positions) + 1, dtype=np.int64)
+        np.cumsum([len(p) for p in positions], out=offsets[1:])
+        np.save(os.path.join(directory, 'offsets.npy'), offsets)
+        np.save(os.path.join(directory, 'positions.npy'), np.concatenate(positions).reshape(-1, 2))
+        np.save(os.path.join(directory, 'radii.npy'), np.concatenate(radii))
+        np.save(os.path.join(directory, 'colors.npy'), np.concatenate(colors).reshape(-1, 3).astype(np.uint8))
+        np.save(os.path.join(directory, 'frame_numbers.npy'), np.array(frame_numbers, dtype=np.int64))
+        self.chunks.append(len(positions))
+        self._buffer = []
+        # keep the header up to date, so a crashed recording is still readable up to the last chunk
+        self._write_header()
+
+    def _write_header(self):
+        header = {'version': FORMAT_VERSION, 'radius': self.simbox.radius,
+                  'boundary_color': list(self.simbox.color), 'boundary_thickness': self.simbox.thickness,
+                  'frames': sum(self.chunks), 'chunk_frames': self.chunk_frames, 'chunks': self.chunks,
+                  'metadata': self.metadata}
+        with open(os.path.join(self.path, 'header.json'), 'w') as f:
+            json.dump(header, f, indent=1)
+
+    def close(self):
+        self._flush()
+        self._write_header()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def record_trajectory(simbox, path, frames, **kwargs):
+    '''
+    simulates "frames" frames of simbox (headless) and records each of them into a trajectory
+    :param simbox: simbox to simulate
+    :param path: trajectory directory to write
+    :param frames: amount of frames
+    :param kwargs: passed on to TrajectoryWriter
+    :return: None
+    '''
+    with TrajectoryWriter(path, simbox, **kwargs) as writer:
+        for _ in range(frames):
+            simbox.simulate_frame()
+            writer.write_frame()
+
+class TrajectoryReader:
+    '''
+    random access to the frames of a trajectory directory. chunks are memory-mapped on first use
+    '''
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'header.json')) as f:
+            self.header = json.load(f)
+        if self.header['version'] != FORMAT_VERSION:
+            raise ValueError(f"unsupported trajectory version {self.header['version']}")
+        # first frame of every chunk
+        self._chunk_starts = np.cumsum([0] + self.header['chunks'])
+        self._chunks = {}
+
+    def __len__(self):
+        return self.header['frames']
+
+    def _chunk(self, chunk):
+        if chunk not in self._chunks:
+            directory = os.path.join(self.path, f"chunk_{chunk:05d}")
+            self._chunks[chunk] = {name: np.load(os.path.join(directory, name + '.npy'), mmap_mode='r')
+                                   for name in ('offsets', 'positions', 'radii', 'colors', 'frame_numbers')}
+        return self._chunks[chunk]
+
+    def frame(self, index):
+        '''
+        :param index: frame to read (0 is the first recorded frame)
+        :return: positions (n, 2), radii (n,), colors (n, 3) and the simbox.current_frame of that frame
+        '''
+        if not 0 <= index < len(self):
+            raise IndexError(f"frame {index} is out of range, the trajectory has {len(self)} frames")
+        chunk = int(np.searchsorted(self._chunk_starts, index, side='right')) - 1
+        arrays = self._chunk(chunk)
+        k = index - self._chunk_starts[chunk]
+        start, stop = arrays['offsets'][k], arrays['offsets'][k + 1]
+        return (arrays['positions'][start:stop], arrays['radii'][start:stop], arrays['colors'][start:stop],
+                int(arrays['frame_numbers'][k]))
+
+class SnapshotSimbox(VectorSimbox):
+    '''
+    Simbox without physics of its own, holding a state loaded from somewhere else (a recording, another simbox...)
+    so that renderers can draw it.
+    '''
+    def __init__(self, radius, boundary_color, boundary_thickness):
+        super().__init__(radius=radius, boundary_color=boundary_color, boundary_thickness=boundary_thickness,
+                         steps_per_frame=1)
+
+    def simulate_frame(self):
+        pass
+
+    def load_frame(self, positions, radii, colors, frame_number):
+        '''
+        replaces the scene by the given state
+        :param positions: (n, 2) positions of the circles
+        :param radii: (n,) radii of the circles
+        :param colors: (n, 3) colors of the circles
+        :param frame_number: becomes self.current_frame
+        :return: None
+        '''
+        n = len(positions)
+        # reuse the circles of the previous frame, only add or drop the difference
+        if len(self.circles) < n:
+            self.add_circles(np.zeros((n - len(self.circles), 2)), 0)
+        elif len(self.circles) > n:
+            self.remove_circles(self.get_ids()[n:])
+        store = self.store
+        store.positions[:n] = positions
+        store.radii[:n] = radii
+        store.colors[:n] = colors
+        self.current_frame = frame_number
+
+class ReplaySimbox(SnapshotSimbox):
+    '''
+    Simbox that plays a recorded trajectory back instead of simulating. simulate_frame loads the next recorded frame,
+    so any renderer (SimDisplayer, SimExporter...) renders the recording without running the physics.
+    Once the recording ends, the last frame stays on.
+    '''
+    def __init__(self, path, start_frame=0):
+        '''
+        :param path: trajectory directory (see TrajectoryWriter)
+        :param start_frame: first recorded frame to show
+        '''
+        self.reader = TrajectoryReader(path)
+        header = self.reader.header
+        super().__init__(radius=header['radius'], boundary_color=tuple(header['boundary_color']),
+                         boundary_thickness=header['boundary_thickness'])
+        # index of the next recorded frame to load
+        self.frame_index = start_frame
+
+    @property
+    def finished(self):
+        return self.frame_index >= len(self.reader)
+
+    def simulate_frame(self):
+        '''
+        loads the next recorded frame into the scene
+        :return:
+        '''
+        if self.finished:
+            return
+        self.load_frame(*self.reader.frame(self.frame_index))
+        self.frame_index += 1
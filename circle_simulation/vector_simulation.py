@@ -0,0 +1,777 @@
+from collections.abc import MutableSequence
+import numpy as np
+from circle_simulation.base_simulation import BaseSimbox, BaseCircle, StepArrays, _circle_arrays
+from circle_simulation.broad_phase import find_pairs, overlap_push
+
+class CircleStore:
+    '''
+    Structure-of-arrays storage for every circle of a VectorSimbox.
+    Row i of each array holds the state of the i-th circle. Only the first "size" rows are in use, the rest is
+    spare capacity so that adding circles does not reallocate every time.
+    Every circle also gets an id that stays the same while it's part of the store, no matter how rows move around.
+    ids of removed circles go onto a free list and are handed out again, so the id table never outgrows the largest
+    amount of circles the store held at once.
+    '''
+    # BaseCircle attributes served by the store: array holding it and conversion applied on read
+    # (None keeps the row itself, so circle.position is a view that can be modified in place)
+    ATTRIBUTES = {'position': ('positions', None), 'vector': ('vectors', None), 'radius': ('radii', float),
+                  'weight': ('weights', float), 'damping': ('damping', float),
+                  'color': ('colors', lambda color: tuple(color.tolist())),
+                  'number_of_collisions': ('collisions', int), 'distance_traveled': ('distances', float),
+                  'circle_time': ('times', float), 'asleep': ('asleep', bool), 'rest_steps': ('rest_steps', int),
+                  'island': ('islands', int), 'current_colliders': (None, None)}
+    # name of each array and the attribute of BaseCircle it backs
+    FIELDS = {field: attribute for attribute, (field, convert) in ATTRIBUTES.items() if field is not None}
+    # every per-row array: the fields and the id of the circle in each row
+    ROW_ARRAYS = tuple(FIELDS) + ('ids',)
+
+    def __init__(self, owner, capacity=64):
+        # the simbox these circles belong to (reported as the wall in current_colliders)
+        self.owner = owner
+        self.size = 0
+        self.capacity = 0
+
+        self.positions = np.zeros((0, 2))
+        self.vectors = np.zeros((0, 2))
+        self.radii = np.zeros(0)
+        self.weights = np.zeros(0)
+        # stored as the restitution factor, exactly like BaseCircle.damping (1 - damping)
+        self.damping = np.zeros(0)
+        self.colors = np.zeros((0, 3), dtype=np.uint8)
+        # info arrays
+        self.collisions = np.zeros(0, dtype=np.int64)
+        self.distances = np.zeros(0)
+        self.times = np.zeros(0)
+        # sleeping (see sleeping.py)
+        self.asleep = np.zeros(0, dtype=bool)
+        self.rest_steps = np.zeros(0, dtype=np.int64)
+        self.islands = np.zeros(0, dtype=np.int64)
+
+        # id of the circle in each row, and the row of each id (-1 for ids not in use)
+        self.ids = np.zeros(0, dtype=np.int64)
+        self.rows = np.zeros(0, dtype=np.int64)
+        # ids given back by removed circles (handed out again last in, first out), and the next id never used
+        self.free_ids = []
+        self.next_id = 0
+
+        # circle objects viewing the rows, by id. circles added in bulk only get one once accessed (see view)
+        self.views = {}
+        # circles whose class overrides update_movement_vector (called as hooks on every sub-step), by id
+        self.hooked = {}
+
+        # contacts of the last sub-step: pairs of rows (first < second) and a mask of rows touching the wall
+        self.contact_first = np.zeros(0, dtype=np.intp)
+        self.contact_second = np.zeros(0, dtype=np.intp)
+        self.wall_contacts = np.zeros(0, dtype=bool)
+        # per-row collider lists, built lazily from the contacts above
+        self._collider_offsets = None
+        self._collider_rows = None
+
+        self.reserve(capacity)
+
+    def reserve(self, capacity):
+        '''
+        grows every array to hold at least "capacity" circles
+        :param capacity: minimal amount of rows
+        :return: None
+        '''
+        if capacity <= self.capacity:
+            return
+        # grow geometrically so that appending one circle at a time stays cheap
+        capacity = max(capacity, 2 * self.capacity)
+        for field in self.ROW_ARRAYS:
+            old = getattr(self, field)
+            new = np.zeros((capacity,) + old.shape[1:], dtype=old.dtype)
+            new[:self.size] = old[:self.size]
+            setattr(self, field, new)
+        self.capacity = capacity
+
+    def _new_ids(self, amount):
+        '''
+        :param amount: amount of ids needed
+        :return: array of unused ids, taken from the free list first
+        '''
+        reused = min(amount, len(self.free_ids))
+        ids = np.empty(amount, dtype=np.int64)
+        ids[:reused] = self.free_ids[len(self.free_ids) - reused:][::-1]
+        del self.free_ids[len(self.free_ids) - reused:]
+        ids[reused:] = np.arange(self.next_id, self.next_id + amount - reused)
+        self.next_id += amount - reused
+        if self.next_id > len(self.rows):
+            rows = np.full(max(self.next_id, 2 * len(self.rows)), -1, dtype=np.int64)
+            rows[:len(self.rows)] = self.rows
+            self.rows = rows
+        return ids
+
+    def insert(self, index, circle):
+        '''
+        copies the state of "circle" into row "index" (shifting the following rows) and turns circle into a view
+        :param index: row to insert at
+        :param circle: unbound BaseCircle (or subclass)
+        :return: id of the circle
+        '''
+        if circle._store is not None:
+            raise ValueError("circle is already part of a simbox")
+        self.reserve(self.size + 1)
+        for field in self.ROW_ARRAYS:
+            array = getattr(self, field)
+            array[index + 1:self.size + 1] = array[index:self.size]
+        self.size += 1
+        self.rows[self.ids[index + 1:self.size]] += 1
+        circle_id = int(self._new_ids(1)[0])
+        self.ids[index] = circle_id
+        self.rows[circle_id] = index
+
+        state = circle.__dict__
+        for field, attribute in self.FIELDS.items():
+            getattr(self, field)[index] = state.pop(attribute)
+        state.pop('current_colliders', None)
+        circle.circle_id = circle_id
+        circle._store = self
+        self.views[circle_id] = circle
+        if type(circle).update_movement_vector is not BaseCircle.update_movement_vector:
+            self.hooked[id(circle)] = circle
+        self.clear_contacts()
+        return circle_id
+
+    def add_rows(self, positions, vectors, radii, weights, damping, colors):
+        '''
+        appends one row per entry of the arrays in one go, without creating any circle objects. the circles viewing
+        the new rows are only created once accessed (see view)
+        :param positions: (n, 2) array
+        :param vectors: (n, 2) array
+        :param radii: (n,) array
+        :param weights: (n,) array
+        :param damping: (n,) array of restitution factors (1 - damping)
+        :param colors: (n, 3) array
+        :return: array of the ids of the new circles
+        '''
+        start, stop = self.size, self.size + len(positions)
+        self.reserve(stop)
+        ids = self._new_ids(stop - start)
+        new = {'positions': positions, 'vectors': vectors, 'radii': radii, 'weights': weights, 'damping': damping,
+               'colors': colors, 'collisions': 0, 'distances': 0, 'times': 0, 'asleep': False, 'rest_steps': 0,
+               'islands': -1, 'ids': ids}
+        for field in self.ROW_ARRAYS:
+            getattr(self, field)[start:stop] = new[field]
+        self.rows[ids] = np.arange(start, stop)
+        self.size = stop
+        self.clear_contacts()
+        return ids
+
+    def view(self, index):
+        '''
+        :param index: row of a circle
+        :return: the circle viewing row "index". rows added by add_rows get a plain BaseCircle (named "c" + its id)
+                 the first time they are accessed
+        '''
+        circle_id = int(self.ids[:self.size][index])
+        circle = self.views.get(circle_id)
+        if circle is None:
+            circle = BaseCircle.__new__(BaseCircle)
+            circle.name = "c" + str(circle_id)
+            circle.sim_box = self.owner
+            circle.temp_position = np.array([0, 0])
+            circle.temp_vector = np.array([0, 0])
+            circle.circle_id = circle_id
+            circle._store = self
+            self.views[circle_id] = circle
+        return circle
+
+    def _release(self, circle_ids):
+        # circles of removed rows (if any were created) get their state back, their ids go onto the free list.
+        # (called while the rows still hold their state)
+        for circle_id in circle_ids.tolist():
+            circle = self.views.pop(circle_id, None)
+            if circle is not None:
+                self.hooked.pop(id(circle), None)
+                state = circle.__dict__
+                for field, attribute in self.FIELDS.items():
+                    value = getattr(circle, attribute)
+                    # rows are views into the store, copy them so the circle owns its data again
+                    state[attribute] = value.copy() if isinstance(value, np.ndarray) else value
+                state['current_colliders'] = []
+                circle._store = None
+                circle.circle_id = -1
+        self.rows[circle_ids] = -1
+        self.free_ids.extend(circle_ids.tolist())
+
+    def remove(self, index):
+        '''
+        removes row "index" (shifting the following rows, which keeps the order of the circles). The circle viewing
+        it gets its state back
+        :param index: row to remove
+        :return: the removed circle (None if the row was never accessed, see view)
+        '''
+        circle_id = int(self.ids[index])
+        circle = self.views.get(circle_id)
+        self._release(self.ids[index:index + 1].copy())
+        for field in self.ROW_ARRAYS:
+            array = getattr(self, field)
+            array[index:self.size - 1] = array[index + 1:self.size]
+        self.size -= 1
+        self.rows[self.ids[index:self.size]] -= 1
+        self.clear_contacts()
+        return circle
+
+    def remove_rows(self, rows):
+        '''
+        removes many rows at once. the last rows are moved into the gaps instead of shifting everything that follows
+        (swap-remove), so the cost only depends on the amount of rows removed. the order of the circles changes
+        :param rows: array of rows to remove
+        :return: None
+        '''
+        rows = np.unique(np.asarray(rows, dtype=np.intp))
+        if not len(rows):
+            return
+        size = self.size - len(rows)
+        self._release(self.ids[rows].copy())
+        # rows past the new end that stay fill the gaps before it
+        gaps = rows[rows < size]
+        tail = np.arange(size, self.size)
+        movers = tail[~np.isin(tail, rows, assume_unique=True)]
+        for field in self.ROW_ARRAYS:
+            array = getattr(self, field)
+            array[gaps] = array[movers]
+        self.rows[self.ids[gaps]] = gaps
+        self.size = size
+        self.clear_contacts()
+
+    def read(self, circle_id, attribute):
+        '''
+        :param circle_id: id of a circle
+        :param attribute: name of the BaseCircle attribute
+        :return: value of the attribute (see ATTRIBUTES)
+        '''
+        index = self.rows[circle_id]
+        if attribute == 'current_colliders':
+            return self.colliders_of(index)
+        field, convert = self.ATTRIBUTES[attribute]
+        value = getattr(self, field)[index]
+        return value if convert is None else convert(value)
+
+    def write(self, circle_id, attribute, value):
+        if attribute == 'current_colliders':
+            raise AttributeError("current_colliders is computed by the simbox while the circle is part of it")
+        getattr(self, self.ATTRIBUTES[attribute][0])[self.rows[circle_id]] = value
+
+    def set_ids(self, ids):
+        '''
+        gives the circles of the store the ids "ids" (row by row, e.g. from a checkpoint). the free list is rebuilt
+        from the ids left unused
+        :param ids: (size,) array of distinct ids
+        :return: None
+        '''
+        ids = np.asarray(ids, dtype=np.int64)
+        views = {}
+        for circle in self.views.values():
+            circle_id = int(ids[self.rows[circle.circle_id]])
+            circle.circle_id = circle_id
+            views[circle_id] = circle
+        self.views = views
+        self.ids[:self.size] = ids
+        self.next_id = int(ids.max()) + 1 if len(ids) else 0
+        self.rows = np.full(max(self.next_id, 64), -1, dtype=np.int64)
+        self.rows[ids] = np.arange(self.size)
+        self.free_ids = np.nonzero(self.rows[:self.next_id] < 0)[0][::-1].tolist()
+
+    def set_contacts(self, first, second, wall):
+        '''
+        :param first: rows of the first circle of each colliding pair
+        :param second: rows of the second circle of each colliding pair
+        :param wall: boolean mask of rows touching the wall
+        :return: None
+        '''
+        self.contact_first = first
+        self.contact_second = second
+        self.wall_contacts = wall
+        self._collider_offsets = None
+        self._collider_rows = None
+
+    def clear_contacts(self):
+        empty = np.zeros(0, dtype=np.intp)
+        self.set_contacts(empty, empty, np.zeros(0, dtype=bool))
+
+    def colliders_of(self, index):
+        '''
+        :param index: row of a circle
+        :return: list of circles (and the simbox for the wall) it collided with during the last sub-step
+        '''
+        if self._collider_offsets is None:
+            # group both sides of every pair by row, partners sorted by row like BaseSimbox.circles order
+            rows = np.concatenate((self.contact_first, self.contact_second))
+            partners = np.concatenate((self.contact_second, self.contact_first))
+            order = np.lexsort((partners, rows))
+            self._collider_rows = partners[order]
+            self._collider_offsets = np.searchsorted(rows[order], np.arange(self.size + 1))
+        start, stop = self._collider_offsets[index], self._collider_offsets[index + 1]
+        colliders = [self.view(i) for i in self._collider_rows[start:stop]]
+        if index < len(self.wall_contacts) and self.wall_contacts[index]:
+            colliders.append(self.owner)
+        return colliders
+
+class CircleList(MutableSequence):
+    '''
+    list-like access to the circles of a VectorSimbox. Adding, removing and replacing circles through it keeps
+    the CircleStore in sync, so code written for BaseSimbox.circles (append, pop, clear...) keeps working.
+    '''
+    def __init__(self, store):
+        self.store = store
+
+    def __len__(self):
+        return self.store.size
+
+    def __getitem__(self, index):
+        rows = range(self.store.size)[index]
+        if isinstance(index, slice):
+            return [self.store.view(i) for i in rows]
+        return self.store.view(rows)
+
+    def __iter__(self):
+        for i in range(self.store.size):
+            yield self.store.view(i)
+
+    def __setitem__(self, index, circle):
+        if isinstance(index, slice):
+            raise TypeError("slice assignment is not supported, use clear() and extend()")
+        index = range(self.store.size)[index]
+        self.store.remove(index)
+        self.store.insert(index, circle)
+
+    def __delitem__(self, index):
+        if isinstance(index, slice):
+            # remove from the back so the remaining indices stay valid
+            for i in sorted(range(self.store.size)[index], reverse=True):
+                self.store.remove(i)
+        else:
+            self.store.remove(range(self.store.size)[index])
+
+    def insert(self, index, circle):
+        index = min(max(index + self.store.size if index < 0 else index, 0), self.store.size)
+        self.store.insert(index, circle)
+
+    def copy(self):
+        return [self.store.view(i) for i in range(self.store.size)]
+
+    def __repr__(self):
+        return repr(self.copy())
+
+class VectorSimbox(BaseSimbox):
+    '''
+    Same scene as BaseSimbox, but the state of every circle lives in contiguous numpy arrays (self.store) and each
+    sub-step (collision detection, response, integration and clean-up) runs as batched array operations.
+    Circles added to it become views into those arrays, so renderers and scenes keep using circle.position etc.
+
+    Differences to BaseSimbox:
+    - subclasses of BaseCircle overriding update_movement_vector are still called on every sub-step, but only
+      as hooks. (circle.current_colliders is filled in, the physics are already taken care of) the batched hooks
+      (pre_step, post_contact, post_step) get views of the arrays instead and keep everything at array speed
+    - circle.position and circle.vector return views of the arrays. copy them to keep an old value around
+    - circles added with add_circles (or the constructor) are written straight into the arrays. their circle objects
+      are only created once accessed through self.circles
+    '''
+    # class of self.store
+    store_class = CircleStore
+
+    def __init__(self, *args, capacity=64, **kwargs):
+        self.store = self.store_class(self, capacity)
+        super().__init__(*args, **kwargs)
+
+    @property
+    def circles(self):
+        return self._circles
+
+    @circles.setter
+    def circles(self, circles):
+        circles = list(circles)
+        self._circles = CircleList(self.store)
+        self._circles.clear()
+        self._circles.extend(circles)
+
+    def get_positions(self, out=None):
+        '''
+        :param out: optional (n, 2) array to write into
+        :return: (n, 2) array of the positions of all circles (a copy)
+        '''
+        positions = self.store.positions[:self.store.size]
+        if out is None:
+            return positions.copy()
+        out[:] = positions
+        return out
+
+    def get_vectors(self, out=None):
+        '''
+        :param out: optional (n, 2) array to write into
+        :return: (n, 2) array of the movement vectors of all circles (a copy)
+        '''
+        vectors = self.store.vectors[:self.store.size]
+        if out is None:
+            return vectors.copy()
+        out[:] = vectors
+        return out
+
+    def get_radii(self):
+        '''
+        :return: (n,) array of the radii of all circles (a copy)
+        '''
+        return self.store.radii[:self.store.size].copy()
+
+    def get_weights(self):
+        '''
+        :return: (n,) array of the weights of all circles (a copy)
+        '''
+        return self.store.weights[:self.store.size].copy()
+
+    def get_colors(self):
+        '''
+        :return: (n, 3) uint8 array of the colors of all circles (a copy)
+        '''
+        return self.store.colors[:self.store.size].copy()
+
+    def get_distances(self):
+        '''
+        :return: (n,) array of the distance every circle traveled so far (a copy)
+        '''
+        return self.store.distances[:self.store.size].copy()
+
+    def add_circle(self, circle):
+        '''
+        :param circle: Circle to add to Sim (it gets its id from the store)
+        :return:
+        '''
+        circle.sim_box = self
+        self.circles.append(circle)
+
+    def add_circles(self, positions, radii, vectors=None, angles=None, speeds=None, weights=1, damping=0,
+                    colors=(156, 156, 156)):
+        '''
+        same as BaseSimbox.add_circles, but the arrays are copied into the store in one go and no circle object is
+        created until the circle is accessed
+        '''
+        return self.store.add_rows(**_circle_arrays(positions, radii, vectors, angles, speeds, weights, damping,
+                                                     colors))
+
+    def remove_circles(self, circle_ids):
+        '''
+        same as BaseSimbox.remove_circles. the cost only depends on the amount of circles removed (see
+        CircleStore.remove_rows)
+        '''
+        circle_ids = np.asarray(circle_ids, dtype=np.int64).reshape(-1)
+        self.store.remove_rows(self._rows_of(circle_ids))
+
+    def get_circle(self, circle_id):
+        '''
+        :param circle_id: id of a circle in the simbox
+        :return: the circle
+        '''
+        return self.store.view(self._rows_of(np.array([circle_id], dtype=np.int64))[0])
+
+    def get_ids(self):
+        '''
+        :return: (n,) array of the ids of all circles (a copy), in the order of self.circles
+        '''
+        return self.store.ids[:self.store.size].copy()
+
+    def _rows_of(self, circle_ids):
+        store = self.store
+        known = (circle_ids >= 0) & (circle_ids < store.next_id)
+        rows = np.full(len(circle_ids), -1, dtype=np.int64)
+        rows[known] = store.rows[circle_ids[known]]
+        if np.any(rows < 0):
+            raise KeyError(f"no circle with id {circle_ids[rows < 0][0]} in the simbox")
+        return rows
+
+    def _get_circle_names(self):
+        store = self.store
+        names = []
+        for circle_id in store.ids[:store.size].tolist():
+            circle = store.views.get(circle_id)
+            names.append(str(circle.name) if circle is not None else "c" + str(circle_id))
+        return names
+
+    def _set_circle_names(self, names):
+        store = self.store
+        for i, (circle_id, name) in enumerate(zip(store.ids[:store.size].tolist(), names)):
+            # circles not accessed yet are named after their id anyway
+            if circle_id in store.views or name != "c" + str(circle_id):
+                store.view(i).name = name
+
+    def _get_circle_state(self):
+        '''
+        :return: dict of the per-circle arrays of a checkpoint, straight from the store
+        '''
+        n = self.store.size
+        return {name: getattr(self.store, name)[:n] for name in CircleStore.ROW_ARRAYS}
+
+    def _set_circle_state(self, state):
+        store = self.store
+        n = store.size
+        for name in CircleStore.FIELDS:
+            getattr(store, name)[:n] = state[name]
+        store.set_ids(state['ids'])
+        store.clear_contacts()
+
+    def simulate_frame(self):
+        '''
+        top-level function to run a single frame of the simulation.
+        (runs a full frame, potentially containing multiple sub-steps)
+        :return:
+        '''
+        profiler = self.profiler
+        if profiler is not None:
+            profiler.begin_frame(self.current_frame)
+        self._update_steps_per_frame()
+        if profiler is not None and self.adaptive_steps:
+            profiler.mark('adaptive_steps')
+        for i in range(self.steps_per_frame):
+            self.current_frame += 1
+            self._simulate_step()
+
+    def _simulate_step(self):
+        profiler = self.profiler
+        if self._overrides('pre_step'):
+            self._run_hook(self.pre_step, contacts=False)
+        if self.forces:
+            self._apply_forces()
+            if profiler is not None:
+                profiler.mark('forces')
+        if self.collision_mode == 'continuous':
+            self._simulate_step_continuous()
+            if profiler is not None:
+                profiler.mark('continuous_step')
+            self._run_step_hooks()
+            return
+        store = self.store
+        n = store.size
+        positions, vectors = store.positions[:n], store.vectors[:n]
+        radii, weights = store.radii[:n], store.weights[:n]
+
+        # ensures constant time no matter simbox steps per frame
+        store.times[:n] += 1 / self.steps_per_frame
+
+        # detect collisions
+        sleeping = self.sleep_speed is not None and store.asleep[:n].any()
+        if sleeping:
+            first, second = self._find_awake_contacts()
+        else:
+            first, second = self._find_contacts(positions, radii)
+        wall = np.sqrt(positions[:, 0] ** 2 + positions[:, 1] ** 2) >= self.radius - radii
+        if sleeping:
+            wall &= ~store.asleep[:n]
+        store.set_contacts(first, second, wall)
+        contacts = np.bincount(first, minlength=n) + np.bincount(second, minlength=n)
+        store.collisions[:n] += contacts
+        self.number_of_collisions += len(first)
+        if profiler is not None:
+            profiler.mark('narrow_phase')
+            profiler.count('contacts', len(first))
+        if self._overrides('post_contact'):
+            self._run_hook(self.post_contact)
+
+        for circle in list(self.store.hooked.values()):
+            circle.update_movement_vector(my_neighbors=circle.current_colliders)
+        if profiler is not None:
+            profiler.mark('update_movement_vector')
+
+        # handle vector changes due to collisions
+        new_vectors = self._collision_vectors(first, second, contacts, wall)
+        if profiler is not None:
+            profiler.mark('handle_collision')
+
+        # move circles according to their (updated) movement vectors
+        vectors[:] = new_vectors
+        positions += vectors / self.steps_per_frame
+        store.distances[:n] += np.sqrt(vectors[:, 0] ** 2 + vectors[:, 1] ** 2)
+        if profiler is not None:
+            profiler.mark('update_position')
+
+        # ensures no circle escapes boundary or overlaps with another circle
+        self._clean_collisions(first, second, wall)
+        if profiler is not None:
+            profiler.mark('clean_collisions')
+
+        if self.sleep_speed is not None:
+            from circle_simulation.sleeping import settle
+            sleepers = settle(np.sqrt(vectors[:, 0] ** 2 + vectors[:, 1] ** 2), store.asleep[:n],
+                              store.rest_steps[:n], store.islands[:n], first, second, self.sleep_speed,
+                              self.sleep_steps)
+            vectors[sleepers] = 0
+            if profiler is not None:
+                profiler.mark('sleeping')
+        if self._overrides('post_step'):
+            self._run_hook(self.post_step)
+
+    def _run_hook(self, hook, contacts=True):
+        '''
+        calls a batched hook with views of the store's arrays (changes go straight into the simulation)
+        :param hook: bound method (pre_step, post_contact or post_step)
+        :param contacts: whether to hand over the contacts of the sub-step (empty otherwise)
+        :return: None
+        '''
+        store = self.store
+        n = store.size
+        if contacts:
+            first, second, wall = store.contact_first, store.contact_second, store.wall_contacts
+        else:
+            first = second = np.zeros(0, dtype=np.intp)
+            wall = np.zeros(n, dtype=bool)
+        hook(StepArrays(store.positions[:n], store.vectors[:n], store.colors[:n], store.radii[:n], first, second,
+                        wall))
+        # the time of a hook is a phase of its own (pre_step, post_contact or post_step)
+        if self.profiler is not None:
+            self.profiler.mark(hook.__name__)
+
+    def _find_awake_contacts(self):
+        '''
+        contacts of a sub-step with sleeping circles: the broad phase only runs on the awake circles and the sleeping
+        ones close to them, islands touched by awake circles wake up (see sleeping.py)
+        :return: arrays "first", "second" of colliding rows between awake circles (first < second), sorted by first
+                 then second
+        '''
+        from circle_simulation.sleeping import near_awake, wake_touched
+        store = self.store
+        n = store.size
+        positions, radii = store.positions[:n], store.radii[:n]
+        rows = np.nonzero(near_awake(positions, radii, store.asleep[:n]))[0]
+        first, second = self._find_contacts(positions[rows], radii[rows])
+        # rows are ascending, so the pairs stay sorted
+        first, second = rows[first], rows[second]
+        # circles woken up far from any awake circle (the rest of an island) are standing still, they pick up their
+        # contacts on the next sub-step
+        keep, woke = wake_touched(first, second, store.asleep[:n], store.rest_steps[:n], store.islands[:n])
+        return first[keep], second[keep]
+
+    def wake(self, circle_ids=None):
+        '''
+        wakes sleeping circles (and the rest of their islands), e.g. after moving them by hand
+        :param circle_ids: ids of the circles to wake (None wakes every circle)
+        :return: None
+        '''
+        from circle_simulation.sleeping import wake_islands
+        store = self.store
+        n = store.size
+        if circle_ids is None:
+            rows = np.arange(n)
+        else:
+            rows = self._rows_of(np.asarray(circle_ids, dtype=np.int64).reshape(-1))
+        wake_islands(store.asleep[:n], store.rest_steps[:n], store.islands[:n], rows)
+
+    def _apply_forces(self):
+        '''
+        adds the accelerations of all force fields onto the movement vectors, in one go
+        :return: None
+        '''
+        from circle_simulation.forces import accelerations
+        store = self.store
+        n = store.size
+        change = accelerations(self.forces, store.positions[:n], store.weights[:n], store.ids[:n])
+        change /= self.steps_per_frame
+        # sleeping circles stay put
+        change[store.asleep[:n]] = 0
+        store.vectors[:n] += change
+
+    def _simulate_step_continuous(self):
+        '''
+        one sub-step in the continuous collision mode, run on the store's arrays in place (see continuous.advance)
+        :return: None
+        '''
+        from circle_simulation.continuous import advance, unique_pairs
+        store = self.store
+        n = store.size
+        vectors = store.vectors[:n]
+
+        # ensures constant time no matter simbox steps per frame
+        store.times[:n] += 1 / self.steps_per_frame
+        first, second, walls, self.broad_phase_used = advance(store.positions[:n], vectors, store.radii[:n],
+                                                              store.weights[:n], store.damping[:n], self.radius,
+                                                              1 / self.steps_per_frame, self.broad_phase,
+                                                              self.grid_size)
+        store.collisions[:n] += np.bincount(first, minlength=n) + np.bincount(second, minlength=n)
+        self.number_of_collisions += len(first)
+        if self.profiler is not None:
+            self.profiler.count('contacts', len(first))
+        store.distances[:n] += np.sqrt(vectors[:, 0] ** 2 + vectors[:, 1] ** 2)
+
+        # colliders of the sub-step: every pair that collided once, and the circles that bounced off the wall
+        wall = np.zeros(n, dtype=bool)
+        wall[walls] = True
+        store.set_contacts(*unique_pairs(first, second), wall)
+
+        for circle in list(self.store.hooked.values()):
+            circle.update_movement_vector(my_neighbors=circle.current_colliders)
+
+    def _find_contacts(self, positions, radii):
+        '''
+        :param positions: (n, 2) array of circle positions
+        :param radii: (n,) array of circle radii
+        :return: arrays "first", "second" of colliding rows (first < second), sorted by first then second
+        '''
+        first, second, self.broad_phase_used = find_pairs(self.broad_phase, positions, radii, self.grid_size)
+        profiler = self.profiler
+        if profiler is not None:
+            profiler.mark('broad_phase')
+            profiler.count('candidates', len(first))
+        delta = positions[first] - positions[second]
+        touching = np.sqrt(delta[:, 0] ** 2 + delta[:, 1] ** 2) <= radii[first] + radii[second]
+        return first[touching], second[touching]
+
+    def _collision_vectors(self, first, second, contacts, wall):
+        '''
+        batched version of BaseCircle._handle_collision and BaseCircle.update_movement_vector
+        :return: (n, 2) array of movement vectors after the collisions of this sub-step
+        '''
+        store = self.store
+        n = store.size
+        positions, vectors, weights = store.positions[:n], store.vectors[:n], store.weights[:n]
+        new_vectors = vectors.copy()
+
+        if len(first):
+            delta = positions[first] - positions[second]
+            d = np.sqrt(delta[:, 0] ** 2 + delta[:, 1] ** 2)
+            # coinciding centers have no collision normal, leave them be
+            d[d == 0] = np.inf
+            normal = delta / d[:, None]
+            relative = vectors[first] - vectors[second]
+            p = 2 * (relative[:, 0] * normal[:, 0] + relative[:, 1] * normal[:, 1]) / (weights[first] + weights[second])
+            # pairs that are already moving apart (still overlapping from an earlier sub-step) exchange nothing
+            p = np.minimum(p, 0)
+            push_first = -(p * weights[second])[:, None] * normal
+            push_second = (p * weights[first])[:, None] * normal
+            for axis in range(2):
+                new_vectors[:, axis] += np.bincount(first, push_first[:, axis], minlength=n)
+                new_vectors[:, axis] += np.bincount(second, push_second[:, axis], minlength=n)
+            # energy lost once per collision
+            new_vectors *= (store.damping[:n] ** contacts)[:, None]
+
+        # reflect vector over position vector for circles touching the wall
+        touching = np.nonzero(wall & np.any(positions != 0, axis=1))[0]
+        if len(touching):
+            posit = positions[touching]
+            posit_normalized = posit / np.sqrt(posit[:, 0] ** 2 + posit[:, 1] ** 2)[:, None]
+            v = new_vectors[touching]
+            proj = ((v * posit_normalized).sum(axis=1) / (posit_normalized ** 2).sum(axis=1))[:, None] * posit_normalized
+            new_vectors[touching] = v - 2 * proj
+        return new_vectors
+
+    def _clean_collisions(self, first, second, wall):
+        '''
+        batched version of BaseCircle._clean_collision and BaseCircle._clean_simbox_collision
+        :return: None
+        '''
+        store = self.store
+        n = store.size
+        positions, radii = store.positions[:n], store.radii[:n]
+
+        if len(first):
+            difference = overlap_push(positions[second] - positions[first], radii[first] + radii[second])
+            shift = np.zeros_like(positions)
+            for axis in range(2):
+                shift[:, axis] -= np.bincount(first, difference[:, axis], minlength=n)
+                shift[:, axis] += np.bincount(second, difference[:, axis], minlength=n)
+            positions += shift
+
+        # colliding with boundary
+        cur_distance = np.sqrt(positions[:, 0] ** 2 + positions[:, 1] ** 2)
+        max_distance = self.radius - radii
+        escaped = wall & (cur_distance > max_distance)
+        positions[escaped] *= (max_distance[escaped] / cur_distance[escaped])[:, None]
@@ -17,7 +17,13 @@ setup(
     ],
     python_requires='>=3.6',  # Minimum Python version requirement
     install_requires=[
-        # Add any dependencies your package needs here
-        'numpy', 'pillow', 'pygame', 'opencv-python', 'keyboard'
+        # the physics only need numpy. the renderer backends are optional, and imported when first used
+        'numpy'
     ],
+    extras_require={
+        'render': ['pillow'],
+        'display': ['pillow', 'pygame'],
+        'export': ['pillow', 'opencv-python', 'keyboard'],
+        'all': ['pillow', 'pygame', 'opencv-python', 'keyboard'],
+    },
 )